@@ -0,0 +1,35 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Published Counts Update Script"
+_script_description = """Use this script to update the published media counts of tags and categories.
+
+The counts are kept up to date automatically as media are edited, and when
+publish dates pass, the next time the counts are displayed. Run this script
+from cron to keep them current even when they aren't being displayed, or
+with --all to recount everything after the database was modified by some
+other means.
+"""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--all', action='store_true', dest='all', help='Recount every tag and category.', default=False)
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+from mediacore.model.meta import DBSession
+from mediacore.model.published_counts import (update_published_counts,
+    update_scheduled_counts)
+
+def main(parser, options, args):
+    if options.all:
+        update_published_counts()
+        DBSession.commit()
+    else:
+        update_scheduled_counts()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Job Runner Script"
+_script_description = """Use this script to run the queued background jobs, such as processing uploads.
+
+Set job_runner = worker in your config to leave all jobs to this script.
+By default it keeps running, checking for new jobs every few seconds. Use
+--once to run the jobs that are waiting and then exit, for example from cron.
+"""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--once', action='store_true', dest='once', help='Run the waiting jobs and exit.', default=False)
+    cmd.parser.add_option('--interval', type='int', dest='interval', help='Seconds to wait between checks for new jobs. Default: 5', default=5)
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+from mediacore.lib.jobs import run_pending_jobs
+from mediacore.model.meta import DBSession
+
+def main(parser, options, args):
+    while True:
+        run_pending_jobs()
+        DBSession.remove()
+        if options.once:
+            break
+        time.sleep(options.interval)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
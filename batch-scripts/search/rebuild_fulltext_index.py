@@ -0,0 +1,30 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Fulltext Index Rebuild Script"
+_script_description = """Use this script to recreate the fulltext search index for all media.
+
+The index is kept up to date automatically as media, tags and categories
+are edited. This script is only needed when upgrading from a version that
+relied on the MySQL triggers in setup_triggers.sql, or after the database
+was modified by some other means.
+"""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+from mediacore.model.meta import DBSession
+from mediacore.model.fulltext import rebuild_fulltext_index
+
+def main(parser, options, args):
+    count = rebuild_fulltext_index()
+    DBSession.commit()
+    print "Indexed %d media." % count
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
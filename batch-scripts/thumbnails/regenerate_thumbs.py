@@ -0,0 +1,39 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Thumbnail Regeneration Script"
+_script_description = """Use this script to regenerate the thumbnails of all media and podcasts.
+
+Run it after changing thumb_sizes, and after upgrading to move any thumbnails
+still named for their media or podcast ID into the thumbnail store. Thumbnails
+are regenerated from the original image where it was kept, otherwise from the
+largest thumbnail. Files in the store that are no longer used are then removed.
+Use --clean to only remove the unused files.
+"""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--clean', action='store_true', dest='clean', help='Only remove unused files from the thumbnail store.', default=False)
+    cmd.parser.add_option('--processes', type='int', dest='processes', help='Number of worker processes. Default: the number of CPUs', default=None)
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+from mediacore.lib.thumbnails import regenerate_thumbs, remove_unused_thumbs
+from mediacore.model import DBSession, Media, Podcast
+
+def main(parser, options, args):
+    items = Media.query.all() + Podcast.query.all()
+    errors = []
+    if not options.clean:
+        errors = regenerate_thumbs(items, options.processes)
+        DBSession.commit()
+        for error in errors:
+            print >> sys.stderr, error
+        print "Regenerated thumbs for %d items." % len(items)
+    print "Removed %d unused files." % remove_unused_thumbs(items)
+    sys.exit(errors and 1 or 0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -27,6 +27,9 @@ import mediacore.lib.helpers
 
 from mediacore.config.routing import make_map
 from mediacore.lib.auth import classifier_for_flash_uploads
+from mediacore.lib.jobs import init_jobs
+from mediacore.lib.search import init_search
+from mediacore.lib.thumbnails import init_thumbs
 from mediacore.lib.templating import TemplateLoader
 from mediacore.model import Media, Podcast, init_model
 from mediacore.model.meta import DBSession
@@ -81,6 +84,8 @@ def load_environment(global_conf, app_conf):
     # Setup the SQLAlchemy database engine
     engine = engine_from_config(config, 'sqlalchemy.')
     init_model(engine, config.get('db_table_prefix', None))
+    init_search(config, engine)
+    init_jobs(config)
     events.Environment.init_model()
 
     # CONFIGURATION OPTIONS HERE (note: all config options will override
@@ -108,6 +113,8 @@ def load_environment(global_conf, app_conf):
 
     # END CUSTOM CONFIGURATION OPTIONS
 
+    init_thumbs(config)
+
     events.Environment.loaded(config)
 
     return config
@@ -215,6 +215,11 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
             path = os.path.join(config['image_dir'], image_type)
             static_urlmap[dir] = StaticURLParser(path)
 
+        # Files in the thumbnail store never change, so cache them for a year
+        static_urlmap['/images/thumbs'] = StaticURLParser(
+            os.path.join(config['image_dir'], 'thumbs'),
+            cache_max_age=31536000)
+
         app = Cascade([public_app, static_urlmap, app])
 
     app.config = config
@@ -13,14 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import webhelpers.paginate
-
 from pylons import request, response, session, tmpl_context
 from repoze.what.predicates import has_permission
 
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
+from mediacore.lib.paginate import KeysetPage
 from mediacore.model import Comment, Media, fetch_row
 from mediacore.model.meta import DBSession
 from mediacore.plugin import events
@@ -82,7 +81,7 @@ class IndexController(BaseController):
 
     @expose('admin/media/dash-table.html')
     @observable(events.Admin.IndexController.media_table)
-    def media_table(self, table, page, **kwargs):
+    def media_table(self, table, page, cursor=None, **kwargs):
         """Fetch XHTML to inject when the 'showmore' ajax action is clicked.
 
         :param table: ``awaiting_review``, ``awaiting_encoding``, or
@@ -90,18 +89,24 @@ class IndexController(BaseController):
         :type table: ``unicode``
         :param page: Page number, defaults to 1.
         :type page: int
+        :param cursor: The cursor for this page, given by the last one.
+        :type cursor: str or None
         :rtype: dict
         :returns:
             media
                 A list of :class:`~mediacore.model.media.Media` instances.
 
         """
+        media_page = self._fetch_page(table, page, cursor=cursor)
+        if media_page.next_cursor:
+            response.headers['X-Next-Cursor'] = media_page.next_cursor
         return dict(
-            media = self._fetch_page(table, page).items,
+            media = media_page.items,
         )
 
 
-    def _fetch_page(self, type='awaiting_review', page=1, items_per_page=6):
+    def _fetch_page(self, type='awaiting_review', page=1, items_per_page=6,
+                    cursor=None):
         """Helper method for paginating media results"""
         query = Media.query.order_by(Media.modified_on.desc())
 
@@ -112,4 +117,4 @@ class IndexController(BaseController):
         elif type == 'awaiting_publishing':
             query = query.filter_by(reviewed=True, encoded=True, publishable=False)
 
-        return webhelpers.paginate.Page(query, page, items_per_page)
+        return KeysetPage(query, page, items_per_page, cursor=cursor)
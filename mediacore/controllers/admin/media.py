@@ -29,13 +29,15 @@ from sqlalchemy import orm
 from mediacore.forms.admin import SearchForm, ThumbForm
 from mediacore.forms.admin.media import AddFileForm, EditFileForm, MediaForm, UpdateStatusForm
 from mediacore.lib import helpers
+from mediacore.lib.compat import any
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate, validate_xhr
 from mediacore.lib.helpers import redirect, url_for
 from mediacore.lib.storage import add_new_media_file
 from mediacore.lib.templating import render
-from mediacore.lib.thumbnails import thumb_path, thumb_paths, create_thumbs_for, create_default_thumbs_for, has_thumbs, has_default_thumbs
+from mediacore.lib.thumbnails import thumb_paths, create_thumbs_for, create_default_thumbs_for, delete_thumbs, has_thumbs, has_default_thumbs
 from mediacore.model import Author, Category, Media, Podcast, Tag, fetch_row, get_available_slug
+from mediacore.model.jobs import QUEUED, RUNNING
 from mediacore.model.meta import DBSession
 from mediacore.plugin import events
 
@@ -53,7 +55,7 @@ class MediaController(BaseController):
     allow_only = has_permission('edit')
 
     @expose_xhr('admin/media/index.html', 'admin/media/index-table.html')
-    @paginate('media', items_per_page=15)
+    @paginate('media', items_per_page=15, keyset=True)
     @observable(events.Admin.MediaController.index)
     def index(self, page=1, search=None, filter=None, podcast=None,
               category=None, tag=None, **kwargs):
@@ -472,10 +474,14 @@ class MediaController(BaseController):
         elif input.slug.startswith('_stub_') \
         and has_default_thumbs(orig) \
         and not has_default_thumbs(input):
-            for key, dst_path in thumb_paths(orig).iteritems():
-                src_path = thumb_path(input, key)
-                # This will raise an OSError on Windows, but not *nix
-                os.rename(src_path, dst_path)
+            if input.thumbs is not None:
+                orig.thumbs = input.thumbs
+            else:
+                src_paths = thumb_paths(input)
+                for key, dst_path in thumb_paths(orig).iteritems():
+                    # This will raise an OSError on Windows, but not *nix
+                    os.rename(src_paths[key], dst_path)
+                orig.thumbs = None
             DBSession.delete(input)
 
         # Report an error
@@ -570,6 +576,36 @@ class MediaController(BaseController):
         )
 
 
+    @expose('json')
+    @observable(events.Admin.MediaController.jobs)
+    def jobs(self, id, **kwargs):
+        """Report the status of the background jobs for the given media.
+
+        :param id: Media ID
+        :type id: ``int``
+        :returns:
+            jobs
+                A list of dicts with the type, status, progress and message
+                of each job, oldest first.
+            pending
+                ``True`` if any job is yet to finish.
+
+        """
+        media = fetch_row(Media, id)
+        jobs = [dict(
+            id = job.id,
+            type = job.type,
+            status = job.status,
+            progress = job.progress,
+            message = job.message,
+            created_on = job.created_on.isoformat(),
+            finished_on = job.finished_on and job.finished_on.isoformat(),
+        ) for job in media.jobs]
+        return dict(
+            jobs = jobs,
+            pending = any(job['status'] in (QUEUED, RUNNING) for job in jobs),
+        )
+
     @expose('json')
     @validate(update_status_form, error_handler=edit)
     @observable(events.Admin.MediaController.update_status)
@@ -692,8 +728,7 @@ class MediaController(BaseController):
         DBSession.delete(media)
         DBSession.flush()
         # Cleanup the thumbnails
-        thumbs = thumb_paths(media).values()
-        helpers.delete_files(thumbs, Media._thumb_dir)
+        delete_thumbs(media)
 
         # Delete it
         DBSession.delete(media)
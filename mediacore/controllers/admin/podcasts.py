@@ -22,11 +22,10 @@ from sqlalchemy import orm, sql
 
 from mediacore.forms.admin import SearchForm, ThumbForm
 from mediacore.forms.admin.podcasts import PodcastForm
-from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
-from mediacore.lib.thumbnails import thumb_paths, create_thumbs_for, create_default_thumbs_for
+from mediacore.lib.thumbnails import create_thumbs_for, create_default_thumbs_for, delete_thumbs
 from mediacore.model import Author, AuthorWithIP, Podcast, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
 from mediacore.plugin import events
@@ -145,10 +144,9 @@ class PodcastsController(BaseController):
         podcast = fetch_row(Podcast, id)
 
         if delete:
-            file_paths = thumb_paths(podcast).values()
             DBSession.delete(podcast)
             DBSession.commit()
-            helpers.delete_files(file_paths, Podcast._thumb_dir)
+            delete_thumbs(podcast)
             redirect(action='index', id=None)
 
         if not slug:
@@ -22,6 +22,7 @@ from sqlalchemy import orm
 
 from mediacore.controllers.api import APIException, get_order_by
 from mediacore.lib import helpers
+from mediacore.lib.apicache import cached_response
 from mediacore.lib.base import BaseController
 from mediacore.lib.compat import any
 from mediacore.lib.decorators import expose
@@ -29,6 +30,7 @@ from mediacore.lib.helpers import get_featured_category, url_for
 from mediacore.lib.thumbnails import thumb
 from mediacore.model import Category
 from mediacore.model.meta import DBSession
+from mediacore.model.published_counts import update_scheduled_counts
 
 log = logging.getLogger(__name__)
 
@@ -36,7 +38,7 @@ order_columns = {
     'id': Category.id,
     'name': Category.name,
     'slug': Category.slug,
-    'media_count': 'media_count %s',
+    'media_count': Category.media_count_published,
 }
 
 class CategoriesController(BaseController):
@@ -44,6 +46,7 @@ class CategoriesController(BaseController):
     JSON Category API
     """
 
+    @cached_response
     @expose('json')
     def index(self, order=None, offset=0, limit=10, secret_key=None, **kwargs):
         """Query for a flat list of categories.
@@ -94,6 +97,7 @@ class CategoriesController(BaseController):
 
         return self._index_query(order, offset, limit, tree=False)
 
+    @cached_response
     @expose('json')
     def tree(self, depth=10, secret_key=None, **kwargs):
         """Query for an expanded tree of categories.
@@ -128,6 +132,7 @@ class CategoriesController(BaseController):
 
     def _index_query(self, order=None, offset=0, limit=10, tree=False, depth=10, **kwargs):
         """Query a list of categories"""
+        update_scheduled_counts()
         if asbool(tree):
             query = Category.query.roots()
         else:
@@ -155,6 +160,7 @@ class CategoriesController(BaseController):
 
     def _get_query(self, id=None, name=None, slug=None, tree=False, depth=10, **kwargs):
         """Query for a specific category item by ID, name or slug and optionally expand the children of this category."""
+        update_scheduled_counts()
         query = Category.query
         depth = min(int(depth), int(app_globals.settings['api_tree_max_depth']))
 
@@ -22,9 +22,14 @@ from sqlalchemy import orm, sql
 
 from mediacore.controllers.api import APIException, get_order_by
 from mediacore.lib import helpers
+from mediacore.lib.apicache import cached_response, dont_cache
 from mediacore.lib.base import BaseController
+from mediacore.lib.counts import cached_count
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import get_featured_category, url_for
+from mediacore.lib.players import uris_expire
+from mediacore.lib.related import related_media
+from mediacore.lib.storage import StorageEngine
 from mediacore.lib.thumbnails import thumb
 from mediacore.model import Category, Media, Podcast, Tag, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
@@ -54,6 +59,7 @@ class MediaController(BaseController):
     JSON Media API
     """
 
+    @cached_response
     @expose('json')
     @observable(events.API.MediaController.index)
     def index(self, type=None, podcast=None, tag=None, category=None, search=None,
@@ -214,9 +220,6 @@ class MediaController(BaseController):
             if featured_cat:
                 query = query.in_category(featured_cat)
 
-        # Preload podcast slugs so we don't do n+1 queries
-        podcast_slugs = dict(DBSession.query(Podcast.id, Podcast.slug))
-
         # Rudimentary pagination support
         start = int(offset)
         end = start + min(int(limit), int(app_globals.settings['api_media_max_results']))
@@ -224,18 +227,20 @@ class MediaController(BaseController):
         if format == "mrss":
             request.override_template = "sitemaps/mrss.xml"
             return dict(
-                media = query[start:end],
+                media = _eager(query, files=True, tags=True)[start:end],
                 title = "Media Feed",
             )
 
-        media = [self._info(m, podcast_slugs, include_embed) for m in query[start:end]]
+        results = _eager(query, files=include_embed)[start:end]
+        media = self._info_list(results, include_embed=include_embed)
 
         return dict(
             media = media,
-            count = query.count(),
+            count = cached_count(query),
         )
 
 
+    @cached_response
     @expose('json')
     @observable(events.API.MediaController.get)
     def get(self, id=None, slug=None, secret_key=None, format="json", **kwargs):
@@ -259,7 +264,8 @@ class MediaController(BaseController):
         if format not in ("json", "mrss"):
             return dict(error= INVALIDFORMATERROR % format)
 
-        query = Media.query.published()
+        query = _eager(Media.query.published(), files=True,
+                       tags=(format == "mrss"))
 
         if id:
             query = query.filter_by(id=id)
@@ -278,28 +284,106 @@ class MediaController(BaseController):
                 title = "Media Entry",
             )
 
-        return self._info(media, include_embed=True)
+        return self._info_list([media], include_embed=True)[0]
 
 
-    def _info(self, media, podcast_slugs=None, include_embed=False):
-        """Return a JSON-ready dict for the given media instance"""
-        if media.podcast_id:
-            media_url = url_for(controller='/media', action='view', slug=media.slug,
-                                podcast_slug=media.podcast.slug, qualified=True)
+    @cached_response
+    @expose('json')
+    @observable(events.API.MediaController.related)
+    def related(self, id=None, slug=None, limit=6, secret_key=None, **kwargs):
+        """List published media related to a specific media item.
+
+        :param id: A :attr:`mediacore.model.media.Media.id` for lookup
+        :type id: int
+        :param slug: A :attr:`mediacore.model.media.Media.slug` for lookup
+        :type slug: str
+        :param limit: The maximum number of results to return
+        :type limit: int
+        :param api_key:
+            The api access key if required in settings
+        :type api_key: unicode or None
+        :returns: JSON dict
+
+        """
+        if asbool(app_globals.settings['api_secret_key_required']) \
+            and secret_key != app_globals.settings['api_secret_key']:
+            return dict(error=AUTHERROR)
+
+        query = Media.query.published()
+
+        if id:
+            query = query.filter_by(id=id)
         else:
-            media_url = url_for(controller="/media", action="view", slug=media.slug,
-                                qualified=True)
+            query = query.filter_by(slug=slug)
+
+        try:
+            media = query.one()
+        except orm.exc.NoResultFound:
+            return dict(error="No match found")
+
+        limit = min(int(limit), int(app_globals.settings['api_media_max_results']))
+        related = related_media(media, limit)
+
+        return dict(
+            media = self._info_list(related),
+            count = len(related),
+        )
+
+
+    def _info_list(self, media_list, include_embed=False):
+        """Return JSON-ready dicts for the given media instances.
 
+        Everything the dicts need that wasn't loaded along with the media
+        is loaded for all of them at once, in a fixed number of queries.
+
+        """
+        if not media_list:
+            return []
+        media_ids = [m.id for m in media_list]
+
+        podcast_ids = set(m.podcast_id for m in media_list
+                          if m.podcast_id is not None)
+        if podcast_ids:
+            podcast_slugs = dict(DBSession.query(Podcast.id, Podcast.slug)
+                                 .filter(Podcast.id.in_(podcast_ids)))
+        else:
+            podcast_slugs = {}
+
+        # Load the categories of every media item in one query, unless
+        # they've already been loaded with the media.
+        unloaded = [m for m in media_list if 'categories' not in m.__dict__]
+        if unloaded:
+            DBSession.query(Media)\
+                .filter(Media.id.in_([m.id for m in unloaded]))\
+                .options(orm.subqueryload('categories'))\
+                .all()
+
+        if include_embed:
+            # The players look at the URIs of every file, which each need
+            # their storage engine. There are only a few, so load them all.
+            DBSession.query(StorageEngine).all()
+            if any(uris_expire(m) for m in media_list):
+                # Signed URLs would outlive themselves in the cache
+                dont_cache()
+
+        thumb_sizes = config['thumb_sizes'][Media._thumb_dir].keys()
+        return [self._info(m, podcast_slugs, include_embed, thumb_sizes)
+                for m in media_list]
+
+    def _info(self, media, podcast_slugs, include_embed=False,
+              thumb_sizes=()):
+        """Return a JSON-ready dict for the given media instance"""
         if media.podcast_id is None:
             podcast_slug = None
-        elif podcast_slugs:
-            podcast_slug = podcast_slugs[media.podcast_id]
+            media_url = url_for(controller="/media", action="view", slug=media.slug,
+                                qualified=True)
         else:
-            podcast_slug = DBSession.query(Podcast.slug)\
-                .filter_by(id=media.podcast_id).scalar()
+            podcast_slug = podcast_slugs[media.podcast_id]
+            media_url = url_for(controller='/media', action='view', slug=media.slug,
+                                podcast_slug=podcast_slug, qualified=True)
 
         thumbs = {}
-        for size in config['thumb_sizes'][media._thumb_dir].iterkeys():
+        for size in thumb_sizes:
             thumbs[size] = thumb(media, size, qualified=True)
 
         info = dict(
@@ -326,6 +410,7 @@ class MediaController(BaseController):
         return info
 
 
+    @cached_response
     @expose('json')
     def files(self, id=None, slug=None, secret_key=None, **kwargs):
         """List all files related to specific media.
@@ -375,3 +460,12 @@ class MediaController(BaseController):
                                       id=file.id, container=file.container,
                                       slug=media.slug, qualified=True),
         )
+
+def _eager(query, files=False, tags=False):
+    """Load the relations the API responses use along with the media."""
+    options = [orm.subqueryload('categories')]
+    if files:
+        options.append(orm.subqueryload('files'))
+    if tags:
+        options.append(orm.subqueryload('tags'))
+    return query.options(*options)
@@ -21,7 +21,8 @@ from mediacore.lib.decorators import (beaker_cache, expose, expose_xhr,
     observable, paginate, validate)
 from mediacore.lib.helpers import get_featured_category, redirect, url_for
 from mediacore.model import Category, Media, Podcast, fetch_row
-from mediacore.model.meta import DBSession
+from mediacore.model.categories import category_tree
+from mediacore.model.published_counts import update_scheduled_counts
 from mediacore.plugin import events
 
 import logging
@@ -41,20 +42,17 @@ class CategoriesController(BaseController):
         """Load all our category data before each request."""
         BaseController.__before__(self, *args, **kwargs)
 
-        c.categories = Category.query.order_by(Category.name).populated_tree()
-
-        counts = dict(DBSession.query(Category.id,
-                                      Category.media_count_published))
-        c.category_counts = counts.copy()
-        for cat, depth in c.categories.traverse():
-            count = counts[cat.id]
-            if count:
-                for ancestor in cat.ancestors():
-                    c.category_counts[ancestor.id] += count
+        update_scheduled_counts()
+        tree = category_tree()
+        c.categories = tree.roots
+        c.category_counts = tree.counts
 
         category_slug = request.environ['pylons.routes_dict'].get('slug', None)
         if category_slug:
-            c.category = fetch_row(Category, slug=category_slug)
+            c.category = tree.by_slug.get(category_slug)
+            if c.category is None:
+                # The category may be newer than the cached tree
+                c.category = fetch_row(Category, slug=category_slug)
             c.breadcrumb = c.category.ancestors()
             c.breadcrumb.append(c.category)
 
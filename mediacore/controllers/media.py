@@ -17,30 +17,36 @@
 Publicly Facing Media Controllers
 """
 import logging
-import os.path
 
 from itertools import izip
 
 from akismet import Akismet
 from formencode import Invalid, Schema, validators
 from paste.deploy.converters import asbool
-from paste.fileapp import FileApp
 from paste.util import mimeparse
 from pylons import app_globals, config, request, response
 from pylons.i18n import _
 from pylons.controllers.util import forward
-from sqlalchemy import orm, sql
+from sqlalchemy import orm
 from webob.exc import HTTPNotAcceptable, HTTPNotFound
 
 from mediacore import USER_AGENT
 from mediacore.forms.comments import PostCommentForm
 from mediacore.lib import email, helpers
 from mediacore.lib.base import BaseController
+from mediacore.lib.counts import cached_count
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
+from mediacore.lib.fileserve import FileServingApp, served_file
+from mediacore.lib.fragments import cached_fragment
 from mediacore.lib.helpers import file_path, pick_uris, redirect, store_transient_message, url_for
-from mediacore.lib.players import JWPlayer, manager
+from mediacore.lib.players import (JWPlayer, manager, media_player,
+    uris_expire)
+from mediacore.lib.random_media import random_published_media
+from mediacore.lib.related import related_media, related_media_ids
+from mediacore.lib.templating import render
 from mediacore.model import (DBSession, fetch_row, get_available_slug,
-    Media, MediaFile, Comment, Tag, Category, Author, AuthorWithIP, Podcast)
+    Media, Comment, Tag, Category, Author, AuthorWithIP, Podcast)
+from mediacore.model.published_counts import update_scheduled_counts
 from mediacore.plugin import events
 
 log = logging.getLogger(__name__)
@@ -65,7 +71,7 @@ class MediaController(BaseController):
     """
 
     @expose('media/index.html')
-    @paginate('media', items_per_page=10)
+    @paginate('media', items_per_page=10, keyset=True)
     @observable(events.MediaController.index)
     def index(self, page=1, show='latest', q=None, tag=None, **kwargs):
         """List media with pagination.
@@ -99,7 +105,7 @@ class MediaController(BaseController):
 
         if q:
             search = media.search(q, bool=True)
-            if search.count():
+            if cached_count(search):
                 media = search
             else:
                 media = media.filter(Media.title.like("%%%s%%" % q))
@@ -109,7 +115,7 @@ class MediaController(BaseController):
 
         return dict(
             media = media,
-            result_count = media.count(),
+            result_count = cached_count(media),
             search_query = q,
             show = show,
             tag = tag,
@@ -118,8 +124,8 @@ class MediaController(BaseController):
     @expose('media/tags.html')
     def tags(self, **kwargs):
         """Display a listing of all tags."""
+        update_scheduled_counts()
         tags = Tag.query\
-            .options(orm.undefer('media_count_published'))\
             .filter(Tag.media_count_published > 0)
         return dict(
             tags = tags,
@@ -164,11 +170,7 @@ class MediaController(BaseController):
     @expose()
     def random(self, **kwargs):
         """Redirect to a randomly selected media item."""
-        # TODO: Implement something more efficient than ORDER BY RAND().
-        #       This method does a full table scan every time.
-        media = Media.query.published()\
-            .order_by(sql.func.random())\
-            .first()
+        media = random_published_media()
         if media is None:
             redirect(action='explore')
         if media.podcast_id:
@@ -192,6 +194,12 @@ class MediaController(BaseController):
         :returns:
             media
                 The :class:`~mediacore.model.media.Media` instance for display.
+            player
+                The player markup.
+            related_media
+                The markup listing related media, if there are any.
+            comments
+                The markup listing published comments.
             comment_form
                 The :class:`~mediacore.forms.comments.PostCommentForm` instance.
             comment_form_action
@@ -211,14 +219,27 @@ class MediaController(BaseController):
             if url_for() != url_for(podcast_slug=media.podcast.slug):
                 redirect(podcast_slug=media.podcast.slug)
 
-        if media.fulltext:
-            search_terms = '%s %s' % (media.title, media.fulltext.tags)
-            related = Media.query.published()\
-                .options(orm.undefer('comment_count_published'))\
-                .filter(Media.id != media.id)\
-                .search(search_terms, bool=False)
+        # The player, related media and comments are rendered once and
+        # cached until the media, or the data they depend on, is changed.
+        # Players with signed URLs are rendered for each view instead.
+        settings = app_globals.settings
+        if uris_expire(media):
+            player = media_player(media, width=560, height=315)
         else:
-            related = []
+            player = cached_fragment('player', media,
+                lambda: media_player(media, width=560, height=315),
+                stamp=(settings['player_type'], settings['flash_player'],
+                       settings['html5_player']))
+        related = cached_fragment('related', media,
+            lambda: render('media/_related.html',
+                           dict(related_media=related_media(media)),
+                           method='xhtml'),
+            stamp=related_media_ids(media))
+        comments = cached_fragment('comments', media,
+            lambda: render('comments/_items.html',
+                           dict(comments=media.comments.published().all()),
+                           method='xhtml'),
+            stamp=(media.comment_count_published,))
 
         media.increment_views()
 
@@ -229,8 +250,9 @@ class MediaController(BaseController):
 
         return dict(
             media = media,
-            related_media = related[:6],
-            comments = media.comments.published().all(),
+            player = player,
+            related_media = related,
+            comments = comments,
             comment_form = post_comment_form,
             comment_form_action = url_for(action='comment', anchor=post_comment_form.id),
             comment_form_values = kwargs,
@@ -368,15 +390,10 @@ class MediaController(BaseController):
             match, then a 406 (not acceptable) response is returned.
 
         """
-        file = fetch_row(MediaFile, id=id)
-
-        file_path = helpers.file_path(file).encode('utf-8')
-        file_type = file.mimetype.encode('utf-8')
-        file_name = file.display_name.encode('utf-8')
-
-        if not os.path.exists(file_path):
-            log.warn('No such file or directory: %r', file_path)
+        served = served_file(id)
+        if served is None:
             raise HTTPNotFound()
+        file_path, file_type, file_name = served
 
         # Ensure the request accepts files with this container
         accept = request.environ.get('HTTP_ACCEPT', '*/*')
@@ -405,7 +422,7 @@ class MediaController(BaseController):
             response.headers['X-Accel-Redirect'] = file_path
             response.headers.update(headers)
         else:
-            app = FileApp(file_path, headers, content_type=file_type)
+            app = FileServingApp(file_path, file_type, headers)
             return forward(app)
 
         response.headers['Content-Type'] = file_type
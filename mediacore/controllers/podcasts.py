@@ -21,6 +21,7 @@ import pylons.templating
 
 from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
+from mediacore.lib.counts import cached_count
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import redirect
 from mediacore.model import Category, Media, Podcast, fetch_row
@@ -74,7 +75,7 @@ class PodcastsController(BaseController):
 
 
     @expose('podcasts/view.html')
-    @paginate('episodes', items_per_page=10)
+    @paginate('episodes', items_per_page=10, keyset=True)
     @observable(events.PodcastsController.view)
     def view(self, slug, page=1, show='latest', **kwargs):
         """View a podcast and the media that belongs to it.
@@ -102,7 +103,7 @@ class PodcastsController(BaseController):
         return dict(
             podcast = podcast,
             episodes = episodes,
-            result_count = episodes.count(),
+            result_count = cached_count(episodes),
             show = show,
         )
 
@@ -16,16 +16,20 @@
 """
 Sitemaps Controller
 """
+import gzip
 import logging
-import math
 
 from paste.util import mimeparse
-from pylons import request, response
+from pylons import config, request, response
+from pylons.controllers.util import forward
+from webob.exc import HTTPNotFound, HTTPServiceUnavailable
 
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, beaker_cache
-from mediacore.lib.helpers import url_for
-from mediacore.model import Media
+from mediacore.lib.fileserve import FileServingApp
+from mediacore.lib.jobs import UpdateSitemapsJob, enqueue
+from mediacore.lib.sitemaps import refresh_due, sitemap_file, sitemaps_written
+from mediacore.model import DBSession, Media
 
 log = logging.getLogger(__name__)
 
@@ -34,67 +38,50 @@ class SitemapsController(BaseController):
     Sitemap generation
     """
 
-    @beaker_cache(expire=60 * 60 * 4, query_args=True)
-    @expose('sitemaps/google.xml')
-    def google(self, page=None, limit=10000, **kwargs):
-        """Generate a sitemap which contains googles Video Sitemap information.
+    @expose()
+    def google(self, page=None, **kwargs):
+        """Serve the Google video sitemap index, or one of its sitemaps.
 
-        This action may return a <sitemapindex> or a <urlset>, depending
-        on how many media items are in the database, and the values of the
-        page and limit params.
+        The sitemaps are written ahead of time by
+        :mod:`mediacore.lib.sitemaps`, one or more for each month. When
+        they're out of date, they're updated by a background job.
 
-        :param page: Page number, defaults to 1.
-        :type page: int
-        :param page: max records to display on page, defaults to 10000.
-        :type page: int
+        :param page: The sitemap to serve, as listed in the index.
+        :type page: str
 
         """
-        response.content_type = mimeparse.best_match(
-            ['application/xml', 'text/xml'],
-            request.environ.get('HTTP_ACCEPT', '*/*')
-        )
-
-        media = Media.query.published()
-
         if page is None:
-            if media.count() > limit:
-                return dict(pages=math.ceil(media.count() / float(limit)))
+            name = 'sitemap.xml.gz'
         else:
-            page = int(page)
-            media = media.offset(page * limit).limit(limit)
+            name = 'sitemap%s.xml.gz' % page
+        return self._serve(name, ['application/xml', 'text/xml'])
 
-        if page:
-            links = []
-        else:
-            links = [
-                url_for(controller='/', qualified=True),
-                url_for(controller='/media', show='poplular', qualified=True),
-                url_for(controller='/media', show='latest', qualified=True),
-                url_for(controller='/categories', qualified=True),
-            ]
-
-        return dict(
-            media = media,
-            page = page,
-            links = links,
-        )
-
-    @beaker_cache(expire=60 * 60 * 4, query_args=True)
-    @expose('sitemaps/mrss.xml')
+    @expose()
     def mrss(self, **kwargs):
-        """Generate a media rss (mRSS) feed of all the sites media."""
-
-        response.content_type = mimeparse.best_match(
-            ['application/rss+xml', 'application/xml', 'text/xml'],
-            request.environ.get('HTTP_ACCEPT', '*/*')
-        )
-
-        media = Media.query.published()
-
-        return dict(
-            media = media,
-            title = 'MediaRSS Sitemap',
-        )
+        """Serve a media rss (mRSS) feed of all the sites media."""
+        return self._serve('mrss.xml.gz',
+            ['application/rss+xml', 'application/xml', 'text/xml'])
+
+    def _serve(self, name, content_types):
+        if refresh_due(config):
+            enqueue(UpdateSitemapsJob.type, host_url=request.host_url,
+                    script_name=request.script_name)
+        path = sitemap_file(name, config)
+        if path is None:
+            if sitemaps_written(config):
+                raise HTTPNotFound()
+            # Commit the job we queued, even though this request fails
+            DBSession.commit()
+            raise HTTPServiceUnavailable(headers=[('Retry-After', '60')])
+        content_type = mimeparse.best_match(content_types,
+            request.environ.get('HTTP_ACCEPT', '*/*'))
+        if 'gzip' in request.accept_encoding:
+            headers = [('Content-Encoding', 'gzip'),
+                       ('Vary', 'Accept-Encoding')]
+            return forward(FileServingApp(path, content_type, headers))
+        response.content_type = content_type
+        response.headers['Vary'] = 'Accept-Encoding'
+        return _iter_gunzip(path)
 
     @beaker_cache(expire=60 * 60 * 4, query_args=True)
     @expose('sitemaps/mrss.xml')
@@ -115,3 +102,15 @@ class SitemapsController(BaseController):
             media = media,
             title = 'Latest Media',
         )
+
+def _iter_gunzip(path, block_size=65536):
+    """Yield the decompressed contents of the given gzip file."""
+    fp = gzip.open(path, 'rb')
+    try:
+        while True:
+            data = fp.read(block_size)
+            if not data:
+                break
+            yield data
+    finally:
+        fp.close()
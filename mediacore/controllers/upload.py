@@ -19,12 +19,11 @@ import simplejson as json
 from pylons import app_globals, config, request, response, session, tmpl_context
 
 from mediacore.forms.uploader import UploadForm
-from mediacore.lib import email
+from mediacore.lib import email, uploads
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
-from mediacore.lib.storage import add_new_media_file
-from mediacore.lib.thumbnails import create_default_thumbs_for, has_thumbs
+from mediacore.lib.jobs import ProcessUploadJob, enqueue, spool_upload
 from mediacore.model import Author, DBSession, get_available_slug, Media
 from mediacore.plugin import events
 
@@ -122,16 +121,23 @@ class UploadController(BaseController):
                 # else actually save it!
                 kwargs.setdefault('name')
 
-                media_obj = self.save_media_obj(
-                    kwargs['name'], kwargs['email'],
-                    kwargs['title'], kwargs['description'],
-                    None, kwargs['file'], kwargs['url'],
-                )
-                email.send_media_notification(media_obj)
-                data = dict(
-                    success = True,
-                    redirect = url_for(action='success')
-                )
+                try:
+                    media_obj = self.save_media_obj(
+                        kwargs['name'], kwargs['email'],
+                        kwargs['title'], kwargs['description'],
+                        None, kwargs['file'], kwargs['url'],
+                        kwargs.get('upload_id'), kwargs.get('upload_filename'),
+                    )
+                except uploads.ChunkError, e:
+                    data = dict(
+                        success = False,
+                        file = unicode(e),
+                    )
+                else:
+                    data = dict(
+                        success = True,
+                        redirect = url_for(action='success')
+                    )
 
         return data
 
@@ -144,16 +150,87 @@ class UploadController(BaseController):
         kwargs.setdefault('name')
 
         # Save the media_obj!
-        media_obj = self.save_media_obj(
-            kwargs['name'], kwargs['email'],
-            kwargs['title'], kwargs['description'],
-            None, kwargs['file'], kwargs['url'],
-        )
-        email.send_media_notification(media_obj)
+        try:
+            media_obj = self.save_media_obj(
+                kwargs['name'], kwargs['email'],
+                kwargs['title'], kwargs['description'],
+                None, kwargs['file'], kwargs['url'],
+                kwargs.get('upload_id'), kwargs.get('upload_filename'),
+            )
+        except uploads.ChunkError:
+            redirect(action='failure')
 
         # Redirect to success page!
         redirect(action='success')
 
+    @expose('json')
+    @observable(events.UploadController.begin_upload)
+    def begin_upload(self, **kwargs):
+        """Start a chunked upload, for files too large to send all at once.
+
+        Once every chunk has been sent to :meth:`upload_chunk`, submit the
+        upload form with the ``upload_id`` and the ``upload_filename``
+        instead of a file.
+
+        :rtype: JSON dict
+        :returns:
+            upload_id
+                The ID to send with each chunk.
+            chunk_size
+                The size in bytes of every chunk except the last.
+
+        """
+        return dict(
+            upload_id = uploads.begin_upload(config),
+            chunk_size = uploads.chunk_size(config),
+        )
+
+    @expose('json')
+    @observable(events.UploadController.upload_chunk)
+    def upload_chunk(self, upload_id=None, offset=None, checksum=None,
+                     chunk=None, **kwargs):
+        """Append a chunk to an upload, or report how much has been received.
+
+        :param upload_id: The ID returned by :meth:`begin_upload`.
+        :param offset: The offset in the file that the chunk begins at.
+        :param checksum: The hex SHA-1 digest of the chunk.
+        :param chunk: The chunk, as a file upload. If it is omitted, the
+            current offset is returned so that an interrupted upload can
+            resume.
+        :rtype: JSON dict
+        :returns:
+            success
+                bool
+            offset
+                The offset of the next chunk, if it is known.
+            error
+                Why the chunk was rejected, if it was.
+
+        """
+        try:
+            if not hasattr(chunk, 'file'):
+                return dict(
+                    success = True,
+                    offset = uploads.upload_offset(upload_id, config),
+                )
+            try:
+                offset = int(offset)
+            except (TypeError, ValueError):
+                raise uploads.ChunkError('Invalid offset.')
+            max_size = int(app_globals.settings['max_upload_size'])
+            offset = uploads.append_chunk(upload_id, offset, chunk.file,
+                                          checksum, config, max_size)
+        except uploads.ChunkError, e:
+            return dict(
+                success = False,
+                offset = e.offset,
+                error = unicode(e),
+            )
+        return dict(
+            success = True,
+            offset = offset,
+        )
+
     @expose('upload/success.html')
     @observable(events.UploadController.success)
     def success(self, **kwargs):
@@ -164,7 +241,13 @@ class UploadController(BaseController):
     def failure(self, **kwargs):
         return dict()
 
-    def save_media_obj(self, name, email, title, description, tags, uploaded_file, url):
+    def save_media_obj(self, name, email, title, description, tags, uploaded_file, url,
+                       upload_id=None, upload_filename=None):
+        # Claim the chunked upload first, so that nothing is saved if it's
+        # invalid.
+        if upload_id:
+            upload_path = uploads.finish_upload(upload_id, upload_filename, config)
+
         # create our media object as a status-less placeholder initially
         media_obj = Media()
         media_obj.author = Author(name, email)
@@ -178,14 +261,18 @@ class UploadController(BaseController):
         DBSession.add(media_obj)
         DBSession.flush()
 
-        # Create a MediaFile object, add it to the media_obj, and store the file permanently.
-        media_file = add_new_media_file(media_obj, file=uploaded_file, url=url)
-
-        # The thumbs may have been created already by add_new_media_file
-        if not has_thumbs(media_obj):
-            create_default_thumbs_for(media_obj)
-
-        media_obj.update_status()
-        DBSession.flush()
+        # Storing the file, creating thumbnails and notifying the admins
+        # can be slow, so it's left to a background job. We only need to
+        # keep a copy of the uploaded file for it, which is quick.
+        if upload_id:
+            enqueue(ProcessUploadJob.type, media_obj,
+                    path=upload_path,
+                    filename=upload_filename)
+        elif uploaded_file is not None:
+            enqueue(ProcessUploadJob.type, media_obj,
+                    path=spool_upload(uploaded_file, config),
+                    filename=uploaded_file.filename)
+        else:
+            enqueue(ProcessUploadJob.type, media_obj, url=url)
 
         return media_obj
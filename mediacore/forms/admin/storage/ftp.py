@@ -15,12 +15,14 @@
 
 from formencode.validators import Int
 from pylons.i18n import N_ as _
+from tw.forms import RadioButtonList
+from tw.forms.validators import StringBool
 
 from mediacore.forms import ListFieldSet, TextField
 from mediacore.forms.admin.storage import StorageForm
 from mediacore.lib.storage.ftp import (FTP_SERVER,
     FTP_USERNAME, FTP_PASSWORD,
-    FTP_UPLOAD_DIR, FTP_MAX_INTEGRITY_RETRIES,
+    FTP_UPLOAD_DIR, FTP_MAX_INTEGRITY_RETRIES, FTP_BACKGROUND_TRANSFER,
     HTTP_DOWNLOAD_URI, RTMP_SERVER_URI)
 
 class FTPStorageForm(StorageForm):
@@ -35,6 +37,7 @@ class FTPStorageForm(StorageForm):
                 TextField('password', label_text=_('Password')),
                 TextField('upload_dir', label_text=_('Subdirectory on server to upload to')),
                 TextField('upload_integrity_retries', label_text=_('How many times should MediaCore try to verify the FTP upload before declaring it a failure?'), validator=Int()),
+                RadioButtonList('background_transfer', label_text=_('Upload files to the FTP server in the background, after the request is over?'), options=((True, _('Yes')), (False, _('No'))), validator=StringBool),
                 TextField('http_download_uri', label_text=_('HTTP URL to access remotely stored files')),
                 TextField('rtmp_server_uri', label_text=_('RTMP Server URL to stream remotely stored files (Optional)')),
             ]
@@ -51,6 +54,7 @@ class FTPStorageForm(StorageForm):
         ftp.setdefault('password', data.get(FTP_PASSWORD, None))
         ftp.setdefault('upload_dir', data.get(FTP_UPLOAD_DIR, None))
         ftp.setdefault('upload_integrity_retries', data.get(FTP_MAX_INTEGRITY_RETRIES, None))
+        ftp.setdefault('background_transfer', data.get(FTP_BACKGROUND_TRANSFER, False))
         ftp.setdefault('http_download_uri', data.get(HTTP_DOWNLOAD_URI, None))
         ftp.setdefault('rtmp_server_uri', data.get(RTMP_SERVER_URI, None))
         return StorageForm.display(self, value, **kwargs)
@@ -77,5 +81,6 @@ class FTPStorageForm(StorageForm):
         engine._data[FTP_PASSWORD] = ftp['password']
         engine._data[FTP_UPLOAD_DIR] = ftp['upload_dir']
         engine._data[FTP_MAX_INTEGRITY_RETRIES] = ftp['upload_integrity_retries']
+        engine._data[FTP_BACKGROUND_TRANSFER] = ftp['background_transfer']
         engine._data[HTTP_DOWNLOAD_URI] = ftp['http_download_uri']
         engine._data[RTMP_SERVER_URI] = ftp['rtmp_server_uri']
@@ -0,0 +1,113 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from formencode.api import Invalid
+from formencode.validators import Int
+from pylons.i18n import N_ as _
+from tw.forms import RadioButtonList
+from tw.forms.validators import StringBool
+
+from mediacore.forms import ListFieldSet, TextField
+from mediacore.forms.admin.storage import StorageForm
+from mediacore.lib.storage.s3 import (S3_ACCESS_KEY, S3_SECRET_KEY,
+    S3_BUCKET, S3_HOST, S3_PORT, S3_SECURE, S3_KEY_PREFIX, S3_URL_EXPIRES,
+    CLOUDFRONT_HTTP, CLOUDFRONT_RTMP, MIN_URL_EXPIRES)
+
+_fields = [
+    ('access_key', S3_ACCESS_KEY),
+    ('secret_key', S3_SECRET_KEY),
+    ('bucket', S3_BUCKET),
+    ('host', S3_HOST),
+    ('port', S3_PORT),
+    ('secure', S3_SECURE),
+    ('key_prefix', S3_KEY_PREFIX),
+    ('url_expires', S3_URL_EXPIRES),
+    ('cloudfront_http', CLOUDFRONT_HTTP),
+    ('cloudfront_rtmp', CLOUDFRONT_RTMP),
+]
+
+class URLExpiresValidator(Int):
+    """Accept 0, for unsigned URLs, or at least :data:`MIN_URL_EXPIRES`."""
+
+    min = 0
+    messages = {
+        'tooShort': _('Use 0, or at least %(min_expires)i seconds. Players '
+                      'request the file again to seek, so its URL has to '
+                      'last as long as playback.'),
+    }
+
+    def validate_python(self, value, state):
+        Int.validate_python(self, value, state)
+        if value and value < MIN_URL_EXPIRES:
+            raise Invalid(self.message('tooShort', state,
+                                       min_expires=MIN_URL_EXPIRES),
+                          value, state)
+
+class AmazonS3StorageForm(StorageForm):
+
+    fields = StorageForm.fields + [
+        ListFieldSet('s3',
+            suppress_label=True,
+            legend=_('Amazon S3 Details:'),
+            children=[
+                TextField('access_key', label_text=_('Access Key ID')),
+                TextField('secret_key', label_text=_('Secret Access Key')),
+                TextField('bucket', label_text=_('Bucket Name')),
+                TextField('host',
+                    label_text=_('Server Hostname (Optional)'),
+                    help_text=_('For S3-compatible services such as MinIO. Defaults to Amazon S3.'),
+                ),
+                TextField('port', label_text=_('Server Port (Optional)'), validator=Int()),
+                RadioButtonList('secure', label_text=_('Connect with HTTPS?'), options=((True, _('Yes')), (False, _('No'))), validator=StringBool),
+                TextField('key_prefix', label_text=_('Prefix for the names of uploaded files (Optional)')),
+                TextField('url_expires',
+                    label_text=_('Seconds until file URLs expire'),
+                    help_text=_('Use 0 for a public bucket. Otherwise, use at least two hours (7200).'),
+                    validator=URLExpiresValidator(),
+                ),
+                TextField('cloudfront_http', label_text=_('CloudFront or CDN URL to access the files (Optional)')),
+                TextField('cloudfront_rtmp', label_text=_('CloudFront RTMP Server URL to stream the files (Optional)')),
+            ]
+        ),
+    ] + StorageForm.buttons
+
+    def display(self, value, **kwargs):
+        """Display the form with default values from the engine param."""
+        engine = kwargs['engine']
+        data = engine._data
+        s3 = value.setdefault('s3', {})
+        for field, key in _fields:
+            s3.setdefault(field, data.get(key, None))
+        return StorageForm.display(self, value, **kwargs)
+
+    def save_engine_params(self, engine, **kwargs):
+        """Map validated field values to engine data.
+
+        Since form widgets may be nested or named differently than the keys
+        in the :attr:`mediacore.lib.storage.StorageEngine._data` dict, it is
+        necessary to manually map field values to the data dictionary.
+
+        :type engine: :class:`mediacore.lib.storage.StorageEngine` subclass
+        :param engine: An instance of the storage engine implementation.
+        :param \*\*kwargs: Validated and filtered form values.
+        :raises formencode.Invalid: If some post-validation error is detected
+            in the user input. This will trigger the same error handling
+            behaviour as with the @validate decorator.
+
+        """
+        StorageForm.save_engine_params(self, engine, **kwargs)
+        s3 = kwargs['s3']
+        for field, key in _fields:
+            engine._data[key] = s3[field]
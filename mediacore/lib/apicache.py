@@ -0,0 +1,194 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+API Response Caching
+
+The JSON API is polled constantly by sites that embed our media, and
+the answer rarely changes between polls. Actions decorated with
+:func:`cached_response` keep their rendered output in memory, keyed by
+the host and path of the request and its normalized query parameters.
+Each response is sent with an ETag and a Last-Modified date, so clients
+that already have it get a ``304 Not Modified`` instead.
+
+Once any change to the media, their files, podcasts, categories or tags
+has been committed, all the cached responses are discarded, so that
+responses from this process never outlive the data they were built
+from. Other processes see the change when their responses expire,
+after ``api_cache_expire`` seconds. That expiry also lets media that
+were scheduled for later publication show up in the results.
+
+Actions can call :func:`dont_cache` when a response includes something
+that mustn't be cached, such as a player with signed URLs.
+
+"""
+import time
+import threading
+
+from wsgiref.handlers import format_date_time
+
+from decorator import decorator
+from paste.deploy.converters import asint
+from pylons import app_globals, config, request, response
+
+from mediacore.lib.compat import sha1
+from mediacore.lib.fileserve import not_modified
+from mediacore.model import after_commit_hook
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+__all__ = ['cached_response', 'discard_responses', 'dont_cache',
+           'response_key']
+
+_cached_params = frozenset([
+    'category', 'depth', 'featured', 'format', 'id', 'include_embed',
+    'limit', 'max_age', 'min_age', 'name', 'offset', 'order', 'podcast',
+    'published_after', 'published_before', 'search', 'secret_key', 'slug',
+    'tag', 'type',
+])
+"""Query parameters the API actions accept. Requests with any others
+aren't cached, so that made up parameters can't fill the cache."""
+
+_ignored_params = frozenset(['_'])
+"""Query parameters that don't change the response. jQuery adds ``_``
+with the current time to defeat browser caches."""
+
+_max_entries = 1000
+"""Responses cached before the cache is emptied and started over."""
+
+_dont_cache_key = 'mediacore.apicache.dont_cache'
+
+_entries = {'count': 0}
+_entries_lock = threading.Lock()
+
+def response_key(host_url, script_name, path, params):
+    """Return the cache key for a request.
+
+    The host and script name are part of the key because the responses
+    contain absolute URLs. Parameters are sorted and empty values dropped,
+    so requests that only differ in the order or presence of blank
+    parameters share a response.
+
+    :param host_url: The scheme, host and port of the request.
+    :param script_name: The path the app is mounted at.
+    :param path: The path of the request within the app.
+    :param params: A list of ``(name, value)`` query parameters.
+    :rtype: str, or None if the request shouldn't be cached.
+
+    """
+    params = sorted((name, value) for name, value in params
+                    if value != '' and name not in _ignored_params)
+    for name, value in params:
+        if name not in _cached_params:
+            return None
+    key = u'%s\n%s\n%s\n%r' % (host_url, script_name, path, params)
+    return sha1(key.encode('utf-8')).hexdigest()
+
+def _response_cache(expire):
+    return app_globals.cache.get_cache('api_responses', type='memory',
+                                       expire=expire)
+
+def _cached_response(func, *args, **kwargs):
+    expire = asint(config.get('api_cache_expire', 60))
+    if not expire or request.method not in ('GET', 'HEAD'):
+        return func(*args, **kwargs)
+    try:
+        cache = _response_cache(expire)
+    except TypeError:
+        # No app_globals outside of the app
+        return func(*args, **kwargs)
+
+    key = response_key(request.host_url, request.script_name,
+                       request.path_info, request.GET.items())
+    if key is None:
+        return func(*args, **kwargs)
+    try:
+        entry = cache.get(key)
+    except KeyError:
+        body = func(*args, **kwargs)
+        if not isinstance(body, basestring) or response.status_int != 200 \
+        or request.environ.get(_dont_cache_key, False):
+            return body
+        if isinstance(body, unicode):
+            body = body.encode(response.charset or 'utf-8')
+        entry = dict(
+            body = body,
+            content_type = response.headers.get('Content-Type'),
+            etag = '"%s"' % sha1(body).hexdigest(),
+            modified = int(time.time()),
+        )
+        _put(cache, key, entry)
+
+    if entry['content_type']:
+        response.headers['Content-Type'] = entry['content_type']
+    response.headers['ETag'] = entry['etag']
+    response.headers['Last-Modified'] = format_date_time(entry['modified'])
+    if not_modified(request.environ, entry['etag'], entry['modified']):
+        response.status_int = 304
+        return ''
+    return entry['body']
+
+def _put(cache, key, entry):
+    _entries_lock.acquire()
+    try:
+        if _entries['count'] >= _max_entries:
+            cache.clear()
+            _entries['count'] = 0
+        _entries['count'] += 1
+    finally:
+        _entries_lock.release()
+    cache.put(key, entry)
+
+def cached_response(func):
+    """Cache the rendered output of the decorated action.
+
+    This must be applied above :func:`~mediacore.lib.decorators.expose`
+    so that the output is a string. Only successful GET requests are
+    cached.
+    """
+    return decorator(_cached_response, func)
+
+def dont_cache():
+    """Keep the response to the current request out of the cache."""
+    request.environ[_dont_cache_key] = True
+
+def discard_responses():
+    """Discard all the cached responses."""
+    try:
+        cache = _response_cache(asint(config.get('api_cache_expire', 60)))
+    except TypeError:
+        return
+    _entries_lock.acquire()
+    try:
+        cache.clear()
+        _entries['count'] = 0
+    finally:
+        _entries_lock.release()
+
+@after_commit_hook
+def _discard_committed(keys):
+    discard_responses()
+
+@observes(events.Media.after_insert, events.Media.after_update,
+          events.Media.after_delete,
+          events.MediaFile.after_insert, events.MediaFile.after_update,
+          events.MediaFile.after_delete,
+          events.Podcast.after_insert, events.Podcast.after_update,
+          events.Podcast.after_delete,
+          events.Category.after_insert, events.Category.after_update,
+          events.Category.after_delete,
+          events.Tag.after_insert, events.Tag.after_update,
+          events.Tag.after_delete)
+def _changed(instance):
+    _discard_committed.add(True)
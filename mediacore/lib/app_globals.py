@@ -3,6 +3,8 @@
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
+from mediacore.lib.viewcounts import view_counter_from_config
+
 class Globals(object):
     """Globals acts as a container for objects available throughout the
     life of the application
@@ -18,6 +20,7 @@ class Globals(object):
         self.settings_cache = cache.get_cache('app_settings',
                                               expire=3600,
                                               type='memory')
+        self.view_counter = view_counter_from_config(config)
 
     @property
     def settings(self):
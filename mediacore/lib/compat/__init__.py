@@ -14,6 +14,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __all__ = [
+    'Pool',
+    'ThreadPool',
     'all',
     'any',
     'chain',
@@ -34,6 +36,13 @@ try:
 except ImportError:
     import sha as sha1
 
+try:
+    from multiprocessing import Pool
+    from multiprocessing.pool import ThreadPool
+except ImportError:
+    # Python 2.5 runs the tasks one at a time instead
+    from mediacore.lib.compat.pool import Pool, ThreadPool
+
 try:
     any = any
 except NameError:
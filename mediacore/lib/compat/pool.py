@@ -0,0 +1,77 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Sequential stand-ins for the multiprocessing pools, for Python 2.5.
+
+They run each task in the calling thread, as soon as it is given, so
+work is only done one piece at a time, but the results are the same.
+
+"""
+
+__all__ = ['Pool', 'ThreadPool']
+
+class AsyncResult(object):
+    """The result of a task that has already run."""
+
+    def __init__(self, func, args, kwargs):
+        try:
+            self._value = func(*args, **kwargs)
+            self._success = True
+        except Exception, e:
+            self._value = e
+            self._success = False
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self._success
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if self._success:
+            return self._value
+        raise self._value
+
+class Pool(object):
+    """Runs the tasks given to it one after another, when they're given."""
+
+    def __init__(self, processes=None, *args, **kwargs):
+        pass
+
+    def apply(self, func, args=(), kwargs={}):
+        return func(*args, **kwargs)
+
+    def apply_async(self, func, args=(), kwargs={}):
+        return AsyncResult(func, args, kwargs)
+
+    def map(self, func, iterable, chunksize=None):
+        return map(func, iterable)
+
+    def imap(self, func, iterable, chunksize=1):
+        for item in iterable:
+            yield func(item)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+ThreadPool = Pool
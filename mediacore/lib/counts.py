@@ -0,0 +1,98 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cached Counts
+
+Every paginated listing counts the rows its query matches, and the same
+few queries are counted over and over. :func:`cached_count` keeps each
+count for a short while, keyed by the SQL of the query and its
+parameters.
+
+Queries for published media compare against the current time, which
+would make every key unique, so datetime parameters are rounded down to
+the minute. A count may therefore be up to a minute out of date, which
+is fine for a pager. Any change to media or comments discards all the
+counts once it has been committed; other processes see it when their
+counts expire.
+
+"""
+from datetime import datetime
+
+from pylons import app_globals
+
+from mediacore.lib.compat import sha1
+from mediacore.model import after_commit_hook
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+__all__ = ['cached_count', 'discard_counts', 'query_fingerprint']
+
+_expire = 60
+"""Seconds that each count is cached for."""
+
+def _count_cache():
+    return app_globals.cache.get_cache('query_counts', type='memory',
+                                       expire=_expire)
+
+def _normalize(value):
+    if isinstance(value, datetime):
+        return value.replace(second=0, microsecond=0)
+    return value
+
+def query_fingerprint(query):
+    """Return a key that is the same for equivalent queries.
+
+    :param query: An SQLAlchemy ORM query.
+    :rtype: str
+
+    """
+    compiled = query.statement.compile()
+    params = sorted((name, _normalize(value))
+                    for name, value in compiled.params.iteritems())
+    key = u'%s\n%r' % (compiled, params)
+    return sha1(key.encode('utf-8')).hexdigest()
+
+def cached_count(query):
+    """Return the number of rows the query matches, from the cache if we can.
+
+    :param query: An SQLAlchemy ORM query.
+    :rtype: int
+
+    """
+    try:
+        cache = _count_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup.
+        return query.count()
+    return cache.get(createfunc=query.count, key=query_fingerprint(query))
+
+def discard_counts():
+    """Discard all the cached counts."""
+    try:
+        cache = _count_cache()
+    except TypeError:
+        return
+    cache.clear()
+
+@after_commit_hook
+def _discard_committed(keys):
+    discard_counts()
+
+@observes(events.Media.after_insert, events.Media.after_update,
+          events.Media.after_delete,
+          events.Comment.after_insert, events.Comment.after_update,
+          events.Comment.after_delete)
+def _changed(instance):
+    _discard_committed.add(True)
@@ -0,0 +1,294 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File Serving
+
+Self-hosted media files are streamed by :class:`FileServingApp`, which
+supports the byte ranges that players request when seeking, along with
+the ETag and Last-Modified validators they use to resume. Whenever the
+rest of the file is to be sent, it is handed to the server's
+``wsgi.file_wrapper``, which lets servers like mod_wsgi transfer it with
+``sendfile`` rather than reading it through Python.
+
+Looking up the path of a media file means loading it and asking its
+storage engine, so :func:`served_file` caches the result for each file ID.
+
+"""
+import os
+import re
+import stat
+
+from rfc822 import mktime_tz, parsedate_tz
+from wsgiref.handlers import format_date_time
+
+from pylons import app_globals
+
+from mediacore.lib.uri import file_path
+from mediacore.model import after_commit_hook
+from mediacore.model.media import MediaFile
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+__all__ = ['FileServingApp', 'discard_served_file', 'not_modified',
+           'parse_range', 'served_file']
+
+_block_size = 65536
+"""Bytes read at a time when the server can't send the file itself."""
+
+_expire = 3600
+"""Seconds that the path of each served file is cached for."""
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class FileServingApp(object):
+    """
+    A WSGI app that serves a single file, with support for byte ranges
+    and conditional requests.
+    """
+
+    def __init__(self, path, content_type, headers=None):
+        """Initialize the app.
+
+        :param path: The absolute path of the file to serve.
+        :param content_type: The mimetype to serve it as.
+        :param headers: A list of extra ``(name, value)`` response headers.
+
+        """
+        self.path = path
+        self.content_type = content_type
+        self.headers = list(headers or [])
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed',
+                           [('Allow', 'GET, HEAD'),
+                            ('Content-Length', '0')])
+            return []
+        try:
+            fd = open(self.path, 'rb')
+        except IOError:
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return []
+        try:
+            info = os.fstat(fd.fileno())
+            if not stat.S_ISREG(info.st_mode):
+                fd.close()
+                start_response('404 Not Found', [('Content-Length', '0')])
+                return []
+            return self._respond(environ, start_response, fd, info)
+        except:
+            fd.close()
+            raise
+
+    def _respond(self, environ, start_response, fd, info):
+        size = info.st_size
+        mtime = int(info.st_mtime)
+        etag = '"%x-%x-%x"' % (info.st_ino, size, mtime)
+        last_modified = format_date_time(mtime)
+        headers = [
+            ('Accept-Ranges', 'bytes'),
+            ('ETag', etag),
+            ('Last-Modified', last_modified),
+        ] + self.headers
+
+        if not_modified(environ, etag, mtime):
+            fd.close()
+            start_response('304 Not Modified', headers)
+            return []
+
+        byte_range = None
+        if self._if_range(environ, etag, last_modified):
+            byte_range = parse_range(environ.get('HTTP_RANGE'), size)
+        if byte_range is False:
+            fd.close()
+            start_response('416 Requested Range Not Satisfiable',
+                           headers + [('Content-Range', 'bytes */%d' % size),
+                                      ('Content-Length', '0')])
+            return []
+
+        headers.append(('Content-Type', self.content_type))
+        if byte_range is None:
+            start, end = 0, size
+            status = '200 OK'
+        else:
+            start, end = byte_range
+            status = '206 Partial Content'
+            headers.append(('Content-Range',
+                            'bytes %d-%d/%d' % (start, end - 1, size)))
+        headers.append(('Content-Length', str(end - start)))
+        start_response(status, headers)
+
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            fd.close()
+            return []
+        if start:
+            fd.seek(start)
+        if end == size and 'wsgi.file_wrapper' in environ:
+            # The server can send the rest of the file however it likes,
+            # ideally without ever reading it into Python.
+            return environ['wsgi.file_wrapper'](fd, _block_size)
+        return _iter_file(fd, end - start)
+
+    def _if_range(self, environ, etag, last_modified):
+        """Return True if a Range header in the request should be honoured.
+
+        If-Range asks for the whole file if it has changed since the
+        client fetched the part it has, as identified by a strong ETag or
+        the exact Last-Modified date.
+
+        """
+        if_range = environ.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        return if_range.strip() in (etag, last_modified)
+
+def not_modified(environ, etag, mtime):
+    """Return True if the client's copy of a resource is current.
+
+    :param environ: The WSGI environ of the conditional request.
+    :param etag: The quoted ETag of the current resource.
+    :param mtime: The time it was last modified, in seconds since the epoch.
+    :rtype: bool
+
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Weak comparison is used, so a W/ prefix doesn't matter
+        tags = [tag.strip().replace('W/', '', 1)
+                for tag in if_none_match.split(',')]
+        return etag in tags or '*' in tags
+    if_modified_since = _parse_date(environ.get('HTTP_IF_MODIFIED_SINCE'))
+    return if_modified_since is not None and mtime <= if_modified_since
+
+def parse_range(header, size):
+    """Parse a Range header for a file of the given size.
+
+    Only single ranges are supported. Requests for several ranges at
+    once are rare and are answered with the whole file, as RFC 2616
+    permits.
+
+    :param header: The Range header value, or None.
+    :param size: The size of the file in bytes.
+    :returns: None if the whole file should be sent, False if the range
+        cannot be satisfied, or a ``(start, end)`` tuple where `end` is
+        exclusive.
+
+    """
+    if not header:
+        return None
+    match = _range_re.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # A suffix range, for the last N bytes
+        length = int(last)
+        if not length or not size:
+            return False
+        return max(size - length, 0), size
+    start = int(first)
+    if start >= size:
+        return False
+    if last:
+        end = int(last) + 1
+        if end <= start:
+            return None
+        return start, min(end, size)
+    return start, size
+
+def _parse_date(value):
+    if not value:
+        return None
+    # Some browsers append '; length=N' to If-Modified-Since
+    parsed = parsedate_tz(value.split(';')[0])
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+def _iter_file(fd, length):
+    """Yield the given number of bytes from the file's current position."""
+    try:
+        while length > 0:
+            data = fd.read(min(_block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fd.close()
+
+def _served_file_cache():
+    return app_globals.cache.get_cache('served_files', type='memory',
+                                       expire=_expire)
+
+def served_file(file_id):
+    """Return the local path, mimetype and display name of a media file.
+
+    The result is cached by file ID, so that serving a file doesn't
+    have to load it or its storage engine from the database. Misses
+    aren't cached, so made up IDs can't fill the cache, and files
+    added by other processes are found.
+
+    :param file_id: A :attr:`~mediacore.model.media.MediaFile.id`.
+    :rtype: tuple
+    :returns: ``(path, mimetype, display_name)`` as utf-8 encoded strings,
+        or None if there is no such file or it isn't stored locally.
+
+    """
+    try:
+        file_id = int(file_id)
+    except (TypeError, ValueError):
+        return None
+    cache = _served_file_cache()
+    key = str(file_id)
+    try:
+        return cache.get(key)
+    except KeyError:
+        pass
+    file = MediaFile.query.get(file_id)
+    if file is None:
+        return None
+    path = file_path(file)
+    if path is None:
+        return None
+    result = (path.encode('utf-8'),
+              file.mimetype.encode('utf-8'),
+              file.display_name.encode('utf-8'))
+    cache.put(key, result)
+    return result
+
+def discard_served_file(*file_ids):
+    """Discard the cached paths of the given file IDs, or all of them."""
+    try:
+        cache = _served_file_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup, and so
+        # nothing to discard.
+        return
+    if not file_ids:
+        cache.clear()
+    for file_id in file_ids:
+        cache.remove_value(str(file_id))
+
+@after_commit_hook
+def _discard_committed(file_ids):
+    discard_served_file(*file_ids)
+
+@observes(events.MediaFile.after_insert, events.MediaFile.after_update,
+          events.MediaFile.after_delete)
+def _media_file_changed(instance):
+    _discard_committed.add(instance.id)
@@ -0,0 +1,126 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Rendered Fragment Cache
+
+Parts of the media view page, such as the player and the comments, are
+expensive to render but only change when the media does. We cache the
+markup for each of these fragments by media ID, along with a stamp of
+the data it was rendered from. The stamp always includes the media's
+``modified_on`` date, so an edit made by any process is noticed as
+soon as the media row is loaded again. Fragments such as the player
+contain absolute URLs, so a copy is kept for each host and script name
+that the page is requested through.
+
+Changes to comments and media files don't touch the media row, so the
+fragments that depend on them are discarded when they are changed, once
+the change has been committed.
+
+"""
+from genshi import Markup
+from pylons import app_globals, request
+
+from mediacore.model import after_commit_hook
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+__all__ = ['cached_fragment', 'discard_fragments']
+
+fragment_names = ('player', 'related', 'comments')
+"""The names of all the fragments cached for each media item."""
+
+_expire = 3600
+"""Seconds that fragments are kept for, unless otherwise specified."""
+
+_max_hosts = 4
+"""Hosts that each fragment is kept for. The host comes from the request,
+so made up hosts mustn't be able to fill the cache."""
+
+def _fragment_cache():
+    return app_globals.cache.get_cache('media_fragments', type='memory',
+                                       expire=_expire)
+
+def _key(name, media_id):
+    return '%s:%d' % (name, media_id)
+
+def cached_fragment(name, media, createfunc, stamp=(), expire=None):
+    """Return the cached markup for a fragment of the given media's page.
+
+    :param name: The name of the fragment, one of :data:`fragment_names`.
+    :param media: A :class:`~mediacore.model.media.Media` instance.
+    :param createfunc: A function that renders the fragment, used if
+        there is no cached copy or it is out of date.
+    :param stamp: Any other values that the markup depends on. If these
+        don't match the values the cached copy was rendered with, it is
+        rendered again.
+    :param expire: Optional seconds to keep this fragment for.
+    :rtype: :class:`genshi.Markup`
+
+    """
+    cache = _fragment_cache()
+    key = _key(name, media.id)
+    host = (request.host_url, request.script_name)
+    stamp = (media.modified_on,) + tuple(stamp)
+    try:
+        cached_stamp, hosts = cache.get_value(key)
+    except KeyError:
+        hosts = {}
+    else:
+        if cached_stamp != stamp:
+            hosts = {}
+        elif host in hosts:
+            return Markup(hosts[host])
+    if len(hosts) >= _max_hosts:
+        hosts = {}
+    # Copied so that a concurrent render doesn't change a cached dict
+    hosts = dict(hosts)
+    hosts[host] = markup = unicode(createfunc())
+    if expire is None:
+        cache.set_value(key, (stamp, hosts))
+    else:
+        cache.set_value(key, (stamp, hosts), expiretime=expire)
+    return Markup(markup)
+
+def discard_fragments(media_id, *names):
+    """Discard the given fragments of a media item, or all of them."""
+    try:
+        cache = _fragment_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup, and so
+        # no fragments to discard.
+        return
+    for name in names or fragment_names:
+        cache.remove_value(_key(name, media_id))
+
+@after_commit_hook
+def _discard_committed(keys):
+    for name, media_id in keys:
+        discard_fragments(media_id, name)
+
+@observes(events.Media.after_update, events.Media.after_delete)
+def _media_changed(instance):
+    _discard_committed.add(*[(name, instance.id) for name in fragment_names])
+
+@observes(events.MediaFile.after_insert, events.MediaFile.after_update,
+          events.MediaFile.after_delete)
+def _media_file_changed(instance):
+    if instance.media_id is not None:
+        _discard_committed.add(('player', instance.media_id))
+
+@observes(events.Comment.after_insert, events.Comment.after_update,
+          events.Comment.after_delete)
+def _comment_changed(instance):
+    if instance.media_id is not None:
+        _discard_committed.add(('comments', instance.media_id))
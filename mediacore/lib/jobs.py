@@ -0,0 +1,521 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Background Jobs
+
+Slow work, like storing and transcoding an uploaded file or sending a
+notification email, is queued with :func:`enqueue` as a row in the
+``jobs`` table. Once the request's transaction commits, a job runner
+claims the job and runs the :class:`AbstractJob` implementation for its
+type, recording its progress and outcome on the row as it goes.
+
+The runner is chosen with the ``job_runner`` config directive:
+
+    ``thread``
+        Jobs are run by a background thread in each web server process.
+    ``worker``
+        Jobs are left for ``batch-scripts/jobs/run_jobs.py``, which can
+        run on a separate machine, to claim them.
+
+Either way, jobs are claimed with an atomic UPDATE so that several
+runners can share one queue. Jobs that were claimed by a runner that
+died before finishing are claimed again once they are stale.
+
+"""
+import logging
+import os
+import tempfile
+import threading
+
+from datetime import datetime, timedelta
+from shutil import copyfileobj
+
+from paste.deploy.converters import asint
+from pylons import config
+from sqlalchemy import sql
+
+from mediacore.lib.email import send_media_notification
+from mediacore.lib.sitemaps import update_sitemaps
+from mediacore.lib.storage import add_new_media_file
+from mediacore.lib.thumbnails import create_default_thumbs_for, has_thumbs
+from mediacore.model import MediaFile, after_commit_hook
+from mediacore.model.jobs import DONE, FAILED, QUEUED, RUNNING, Job, jobs
+from mediacore.model.meta import DBSession
+from mediacore.plugin.abc import AbstractClass, abstractmethod, abstractproperty
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'AbstractJob',
+    'AbstractJobRunner',
+    'JobError',
+    'claim_job',
+    'enqueue',
+    'init_jobs',
+    'job_runner',
+    'run_job',
+    'run_pending_jobs',
+    'spool_upload',
+]
+
+_stale_after = timedelta(hours=1)
+"""How long a job may run before it's assumed its runner has died."""
+
+_max_attempts = 3
+"""How many times a job is claimed before it is given up on."""
+
+class JobError(Exception):
+    """Base class for all job exceptions."""
+
+###############################################################################
+
+class AbstractJob(AbstractClass):
+    """
+    Base class for all job types.
+
+    An instance is created for each job that is run.
+    """
+
+    type = abstractproperty()
+    """A unique string name for the job type, stored in ``jobs.type``."""
+
+    def __init__(self, job):
+        """Initialize the job.
+
+        :param job: The :class:`~mediacore.model.jobs.Job` to run.
+
+        """
+        self.job = job
+
+    @abstractmethod
+    def run(self):
+        """Do the work.
+
+        This is run within a transaction of the :class:`DBSession`, which
+        is committed once it returns, or rolled back if it raises.
+
+        """
+
+    def progress(self, progress, message=None):
+        """Record how far the job has come.
+
+        This is written immediately, on a separate connection, so that
+        it can be seen before the job's transaction is committed.
+
+        :param progress: An estimate of how much is complete, in percent.
+        :param message: An optional description of what is happening now.
+
+        """
+        _update_job(self.job.id, progress=progress, message=message)
+
+class ProcessUploadJob(AbstractJob):
+    """
+    Store a file or URL that was submitted through the upload form.
+
+    The job data must include ``path`` and ``filename`` for a file that
+    was spooled with :func:`spool_upload`, or else a ``url``.
+    """
+
+    type = 'process_upload'
+
+    def run(self):
+        media = self.job.media
+        if media is None:
+            # The media was deleted before we got around to it
+            return
+        data = self.job.data
+        file = None
+        if data.get('path'):
+            file = SpooledUpload(data['filename'], open(data['path'], 'rb'),
+                                 data['path'])
+
+        self.progress(10, u'Storing the file')
+        add_new_media_file(media, file=file, url=data.get('url'))
+
+        self.progress(70, u'Creating thumbnails')
+        # The thumbs may have been created already by add_new_media_file
+        if not has_thumbs(media):
+            create_default_thumbs_for(media)
+
+        media.update_status()
+        DBSession.flush()
+        enqueue(MediaNotificationJob.type, media)
+        if file is not None:
+            _remove_spooled_upload.add(data['path'])
+
+AbstractJob.register(ProcessUploadJob)
+
+class MediaNotificationJob(AbstractJob):
+    """
+    Email the admins about newly uploaded media.
+    """
+
+    type = 'media_notification'
+
+    def run(self):
+        if self.job.media is not None:
+            send_media_notification(self.job.media)
+
+AbstractJob.register(MediaNotificationJob)
+
+class StorageTransferJob(AbstractJob):
+    """
+    Send a spooled file to the storage engine that deferred it.
+
+    Engines whose ``store`` is slow, such as
+    :class:`~mediacore.lib.storage.ftp.FTPStorage`, can queue this job
+    instead of sending the file during the request. The job data must
+    include the ``media_file_id`` and the ``path`` and ``filename`` of a
+    file spooled with :func:`spool_upload`. The engine must implement a
+    ``transfer(media_file, file)`` method.
+    """
+
+    type = 'storage_transfer'
+
+    def run(self):
+        data = self.job.data
+        media_file = MediaFile.query.get(data['media_file_id'])
+        if media_file is not None:
+            file = SpooledUpload(data['filename'], open(data['path'], 'rb'),
+                                 data['path'])
+            try:
+                self.progress(10, u'Transferring the file')
+                media_file.storage.transfer(media_file, file)
+            finally:
+                file.file.close()
+        _remove_spooled_upload.add(data['path'])
+
+AbstractJob.register(StorageTransferJob)
+
+class UpdateSitemapsJob(AbstractJob):
+    """
+    Write the sitemap files for the months whose media have changed.
+
+    The job data must include the ``host_url`` and ``script_name`` of the
+    request that found the files out of date, so that the URLs in them
+    are for the site it was made to.
+    """
+
+    type = 'update_sitemaps'
+
+    def run(self):
+        data = self.job.data
+        update_sitemaps(config, data['host_url'], data.get('script_name', ''))
+
+AbstractJob.register(UpdateSitemapsJob)
+
+###############################################################################
+
+def enqueue(type, media=None, **data):
+    """Queue a job to run once the current transaction is committed.
+
+    :param type: The :attr:`AbstractJob.type` to run.
+    :param media: The optional :class:`~mediacore.model.media.Media`
+        that the job concerns.
+    :param \*\*data: Arguments for the job. They must be serializable
+        as JSON.
+    :rtype: :class:`~mediacore.model.jobs.Job`
+
+    """
+    job = Job()
+    job.type = unicode(type)
+    job.media = media
+    job.data = data
+    DBSession.add(job)
+    _wake_runner.add(job.type)
+    return job
+
+@after_commit_hook
+def _wake_runner(types):
+    runner = job_runner()
+    if runner is not None:
+        runner.wake()
+
+def _update_job(job_id, **values):
+    """Update the job row on a connection of its own."""
+    conn = DBSession.bind.connect()
+    try:
+        conn.execute(jobs.update().where(jobs.c.id == job_id).values(**values))
+    finally:
+        conn.close()
+
+def claim_job():
+    """Claim the oldest job that is waiting to be run.
+
+    :returns: The claimed job ID, or None if there is nothing to do.
+
+    """
+    now = datetime.now()
+    stale = sql.and_(jobs.c.status == RUNNING,
+                     jobs.c.started_on < now - _stale_after)
+    claimable = sql.and_(jobs.c.attempts < _max_attempts,
+                         sql.or_(jobs.c.status == QUEUED, stale))
+    conn = DBSession.bind.connect()
+    try:
+        conn.execute(jobs.update()\
+            .where(sql.and_(stale, jobs.c.attempts >= _max_attempts))\
+            .values(status=FAILED, finished_on=now,
+                    message=u'The job never finished.'))
+        candidates = conn.execute(sql.select([jobs.c.id], claimable)\
+            .order_by(jobs.c.id).limit(10)).fetchall()
+        for job_id, in candidates:
+            # Another runner may have claimed it since we looked
+            result = conn.execute(jobs.update()\
+                .where(sql.and_(jobs.c.id == job_id, claimable))\
+                .values(status=RUNNING, started_on=now, finished_on=None,
+                        attempts=jobs.c.attempts + 1, progress=0,
+                        message=None))
+            if result.rowcount == 1:
+                return job_id
+    finally:
+        conn.close()
+    return None
+
+def run_job(job_id):
+    """Run the given job, which must already be claimed.
+
+    :returns: True if the job succeeded, False if it failed.
+
+    """
+    try:
+        job = Job.query.get(job_id)
+        if job is None:
+            # Its media has been deleted
+            return False
+        for job_cls in AbstractJob:
+            if job_cls.type == job.type:
+                break
+        else:
+            raise JobError('Unrecognized job type: %r' % job.type)
+        job_cls(job).run()
+        job.status = DONE
+        job.progress = 100
+        job.message = None
+        job.finished_on = datetime.now()
+        DBSession.commit()
+        return True
+    except Exception, e:
+        DBSession.rollback()
+        log.exception('Job %r failed', job_id)
+        _update_job(job_id, status=FAILED, finished_on=datetime.now(),
+                    message=unicode(e) or unicode(e.__class__.__name__))
+        return False
+
+def run_pending_jobs(limit=None):
+    """Claim and run jobs until there are none left.
+
+    :param limit: The optional maximum number of jobs to run.
+    :returns: The number of jobs run.
+
+    """
+    count = 0
+    while limit is None or count < limit:
+        job_id = claim_job()
+        if job_id is None:
+            break
+        run_job(job_id)
+        count += 1
+    return count
+
+###############################################################################
+
+class SpooledUpload(object):
+    """
+    A file that was uploaded in an earlier request.
+
+    This stands in for the :class:`cgi.FieldStorage` that the storage
+    engines expect. Engines that store files on the same filesystem as
+    the spool may link the file at :attr:`path` into place rather than
+    copying it.
+    """
+
+    def __init__(self, filename, file, path=None):
+        self.filename = filename
+        self.file = file
+        self.path = path
+
+def spool_dir(config):
+    """Return the directory that uploaded files are kept in until stored."""
+    return config.get('upload_spool_dir', None) \
+        or os.path.join(config['cache_dir'], 'uploads')
+
+def spool_upload(file, config):
+    """Copy a freshly uploaded file to the spool, for a job to store later.
+
+    :param file: A :class:`cgi.FieldStorage` instance.
+    :param config: The app config dict.
+    :returns: The absolute path of the spooled copy.
+
+    """
+    directory = spool_dir(config)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    ext = os.path.splitext(os.path.basename(file.filename))[1]
+    fd, path = tempfile.mkstemp(suffix=ext, dir=directory)
+    spooled = os.fdopen(fd, 'wb')
+    try:
+        file.file.seek(0)
+        copyfileobj(file.file, spooled)
+    finally:
+        spooled.close()
+    return path
+
+@after_commit_hook
+def _remove_spooled_upload(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError, e:
+            log.warn('Could not remove the spooled upload %r: %s', path, e)
+
+###############################################################################
+
+class AbstractJobRunner(AbstractClass):
+    """
+    Run queued jobs as they become available.
+    """
+
+    name = abstractproperty()
+    """A string name for the class, as used in the ``job_runner`` config."""
+
+    def wake(self):
+        """Start running jobs, as new ones have just been committed.
+
+        This is called in the request that queued them.
+        """
+
+class WorkerJobRunner(AbstractJobRunner):
+    """
+    Leave all jobs for a separate worker process.
+
+    See ``batch-scripts/jobs/run_jobs.py``.
+    """
+
+    name = 'worker'
+
+AbstractJobRunner.register(WorkerJobRunner)
+
+class ThreadJobRunner(AbstractJobRunner):
+    """
+    Run jobs in a background thread of each web server process.
+
+    The thread runs jobs whenever a request commits new ones, and checks
+    for jobs left by other processes every ``poll_interval`` seconds.
+
+    Jobs use the Pylons globals, such as ``app_globals`` and ``url``,
+    which are only available to request threads. The runner borrows
+    those of the last request that woke it.
+    """
+
+    name = 'thread'
+
+    def __init__(self, poll_interval=60):
+        self.poll_interval = poll_interval
+        self._objects = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def wake(self):
+        self._objects = _request_objects()
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def _ensure_thread(self):
+        """Start the thread for this process if it isn't running.
+
+        The thread is started lazily so that it is created in each worker
+        of a forking server, rather than in the parent before the fork.
+        """
+        pid = os.getpid()
+        if self._pid == pid and self._thread.isAlive():
+            return
+        self._lock.acquire()
+        try:
+            if self._pid == pid and self._thread.isAlive():
+                return
+            thread = threading.Thread(target=self._run,
+                                      name='mediacore-job-runner')
+            thread.setDaemon(True)
+            thread.start()
+            self._thread = thread
+            self._pid = pid
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            objects = self._objects
+            if objects is None:
+                continue
+            for proxy, obj in objects:
+                proxy._push_object(obj)
+            try:
+                run_pending_jobs()
+            except Exception:
+                log.exception('Unexpected error while running jobs')
+            finally:
+                for proxy, obj in objects:
+                    proxy._pop_object(obj)
+                DBSession.remove()
+
+AbstractJobRunner.register(ThreadJobRunner)
+
+def _request_objects():
+    """Return the Pylons globals of the current thread, or None."""
+    import pylons
+    try:
+        return [(proxy, proxy._current_obj())
+                for proxy in (pylons.app_globals, pylons.translator,
+                              pylons.url)]
+    except TypeError:
+        return None
+
+_job_runner = None
+
+def init_jobs(config):
+    """Initialize the job runner specified in the given config.
+
+    Recognized options, shown here with their defaults::
+
+        job_runner = thread
+        job_runner.poll_interval = 60
+
+    :param config: The app config dict.
+    :rtype: :class:`AbstractJobRunner` instance
+    :raises JobError: If the config names an unknown runner.
+
+    """
+    global _job_runner
+    name = config.get('job_runner', 'thread')
+    for runner_cls in AbstractJobRunner:
+        if runner_cls.name == name:
+            break
+    else:
+        raise JobError('Unrecognized job_runner: %r' % name)
+
+    if runner_cls is ThreadJobRunner:
+        _job_runner = runner_cls(
+            poll_interval=asint(config.get('job_runner.poll_interval', 60)))
+    else:
+        _job_runner = runner_cls()
+    return _job_runner
+
+def job_runner():
+    """Return the job runner instantiated by :func:`init_jobs`, or None."""
+    return _job_runner
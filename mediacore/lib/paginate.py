@@ -13,16 +13,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import inspect
+import simplejson
 import warnings
 
+from datetime import datetime
+from itertools import izip
+
 from pylons import request, tmpl_context
+from sqlalchemy import sql
+from sqlalchemy.orm import Query
+from sqlalchemy.sql import expression, operators
 from webhelpers import paginate as _paginate
 from webhelpers.paginate import get_wrapper
 from webob.multidict import MultiDict
 from webhelpers.paginate import Page
 
 from mediacore.lib.compat import wraps
+from mediacore.lib.counts import cached_count
 
 # TODO: Move the paginate decorator to mediacore.lib.decorators,
 #       and rework it to use the decorators module. This whole
@@ -69,7 +78,8 @@ def partial(*args, **create_time_kwds):
         return func(*args, **kwds)
     return curried_function
 
-def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
+def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None,
+             keyset=False):
     """Paginate a given collection.
 
     Duplicates and extends the functionality of :func:`tg.decorators.paginate` to:
@@ -78,6 +88,8 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
           :mod:`sphinx.ext.autodoc` to read docstring.
         * Support our :class:`CustomPage` extension -- used any time
           ``items_first_page`` is provided.
+        * Support our :class:`KeysetPage` extension -- used for queries
+          when ``keyset`` is true.
 
     This decorator is mainly exposing the functionality
     of :func:`webhelpers.paginate`.
@@ -115,6 +127,9 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
       items_first_page
         the number of items to be rendered on the first page. Defaults to the
         value of ``items_per_page``
+      keyset
+        if True, queries are paged with a :class:`KeysetPage`, so that the
+        next and previous links carry a cursor rather than an offset.
 
     """
     prefix = ""
@@ -122,13 +137,15 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
         prefix = name + "_"
     own_parameters = dict(
         page="%spage" % prefix,
-        items_per_page="%sitems_per_page" % prefix
+        items_per_page="%sitems_per_page" % prefix,
+        cursor="%scursor" % prefix,
         )
     #@decorator
     def _d(f):
         @wraps(f)
         def _w(*args, **kwargs):
             page = int(kwargs.pop(own_parameters["page"], 1))
+            cursor = kwargs.pop(own_parameters["cursor"], None)
             real_items_per_page = int(
                     kwargs.pop(
                             own_parameters['items_per_page'],
@@ -164,16 +181,32 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
                 # Use CustomPage if our extra custom arg was provided
                 if items_first_page is not None:
                     page_class = CustomPage
+                elif keyset and isinstance(collection, Query):
+                    page_class = KeysetPage
                 else:
                     page_class = Page
 
-                page = page_class(
-                    collection,
-                    page,
-                    items_per_page=real_items_per_page,
-                    items_first_page=items_first_page,
-                    **additional_parameters.dict_of_lists()
-                    )
+                if page_class is KeysetPage:
+                    page = page_class(
+                        collection,
+                        page,
+                        items_per_page=real_items_per_page,
+                        cursor=cursor,
+                        **additional_parameters.dict_of_lists()
+                        )
+                else:
+                    if isinstance(collection, Query):
+                        item_count = cached_count(collection)
+                    else:
+                        item_count = None
+                    page = page_class(
+                        collection,
+                        page,
+                        items_per_page=real_items_per_page,
+                        items_first_page=items_first_page,
+                        item_count=item_count,
+                        **additional_parameters.dict_of_lists()
+                        )
                 # wrap the pager so that it will render
                 # the proper page-parameter
                 page.pager = partial(page.pager,
@@ -391,3 +424,252 @@ class CustomPage(Page):
         # This is a subclass of the 'list' type. Initialise the list now.
         list.__init__(self, self.items)
 
+
+
+class KeysetPage(Page):
+    """A page of an SQLAlchemy query, found by seeking past the last row of
+    the previous page rather than by counting rows with an OFFSET.
+
+    The query must be ordered by plain mapped columns. The primary key is
+    added as a final tie-breaker if it isn't there already. A query that
+    is ordered some other way, such as by search relevance, is paged with
+    an OFFSET just like :class:`webhelpers.paginate.Page`.
+
+    The links to the next and previous pages carry an opaque cursor, which
+    records the ordering values of the row to continue from, along with
+    the page number and the item count, so that neither has to be worked
+    out again. The item count is therefore only as fresh as the first page
+    the visitor loaded, which is close enough for the pager. A page that
+    is requested by number, without a cursor, is found with an OFFSET.
+
+    NULLs are sorted where the database puts them: before any other value
+    in MySQL and SQLite, and after them in PostgreSQL and Oracle. See
+    :data:`_nulls_high_dialects`.
+
+    Instance attributes, besides those of :class:`webhelpers.paginate.Page`:
+
+    next_cursor
+        The cursor for the next page, or None.
+
+    previous_cursor
+        The cursor for the previous page, or None.
+
+    """
+    def __init__(self, collection, page=1, items_per_page=20, cursor=None,
+                 item_count=None, **kwargs):
+        self.next_cursor = None
+        self.previous_cursor = None
+
+        order = _keyset_order(collection)
+        if order is None:
+            Page.__init__(self, collection, page, items_per_page,
+                          item_count=item_count, **kwargs)
+            return
+
+        self.kwargs = kwargs
+        self.original_collection = collection
+        self.items_per_page = items_per_page
+
+        signature = _order_signature(order)
+        state = _decode_cursor(cursor)
+        if state is not None and state['order'] != signature:
+            # The cursor was made for a different ordering
+            state = None
+        if state is not None:
+            page = state['page']
+            item_count = state['count']
+
+        query = collection.order_by(None).order_by(*[
+            descending and column.desc() or column.asc()
+            for column, descending in order
+        ])
+
+        try:
+            self.page = int(page)
+        except ValueError:
+            self.page = 1
+
+        if item_count is None:
+            item_count = cached_count(query.order_by(None))
+        self.item_count = item_count
+
+        if self.item_count <= 0:
+            self.first_page = None
+            self.page_count = 0
+            self.last_page = None
+            self.first_item = None
+            self.last_item = None
+            self.previous_page = None
+            self.next_page = None
+            self.items = []
+            list.__init__(self, self.items)
+            return
+
+        self.first_page = 1
+        self.page_count = ((self.item_count - 1) / items_per_page) + 1
+        self.last_page = self.first_page + self.page_count - 1
+        if self.page > self.last_page:
+            self.page = self.last_page
+        elif self.page < self.first_page:
+            self.page = self.first_page
+        self.first_item = (self.page - 1) * items_per_page + 1
+        self.last_item = min(self.first_item + items_per_page - 1,
+                             self.item_count)
+
+        if state is None:
+            items = query.offset(self.first_item - 1)\
+                .limit(items_per_page).all()
+        elif state['forward']:
+            nulls_high = _nulls_high(collection)
+            items = query.filter(_seek_clause(order, state['key'],
+                                              nulls_high))\
+                .limit(items_per_page).all()
+        else:
+            reverse = [(column, not descending) for column, descending in order]
+            items = query.order_by(None).order_by(*[
+                    descending and column.desc() or column.asc()
+                    for column, descending in reverse
+                ])\
+                .filter(_seek_clause(reverse, state['key'],
+                                     _nulls_high(collection)))\
+                .limit(items_per_page).all()
+            items.reverse()
+        self.items = items
+
+        if self.page > self.first_page:
+            self.previous_page = self.page - 1
+        else:
+            self.previous_page = None
+        if self.page < self.last_page:
+            self.next_page = self.page + 1
+        else:
+            self.next_page = None
+
+        if items:
+            if self.previous_page is not None:
+                self.previous_cursor = _encode_cursor(signature,
+                    self.previous_page, self.item_count, False,
+                    _row_key(order, items[0]))
+            if self.next_page is not None:
+                self.next_cursor = _encode_cursor(signature,
+                    self.next_page, self.item_count, True,
+                    _row_key(order, items[-1]))
+
+        list.__init__(self, self.items)
+
+def _keyset_order(query):
+    """Return the (column, descending) pairs that the query is ordered by,
+    ending with the primary key, or None if it can't be paged by keyset."""
+    try:
+        criteria = query._order_by
+        mapper = query._mapper_zero()
+    except AttributeError:
+        return None
+    if not criteria or len(mapper.primary_key) != 1:
+        return None
+    order = []
+    for criterion in criteria:
+        descending = False
+        if isinstance(criterion, expression._UnaryExpression):
+            if criterion.modifier is operators.desc_op:
+                descending = True
+            elif criterion.modifier is not operators.asc_op:
+                return None
+            criterion = criterion.element
+        if not isinstance(criterion, expression.ColumnClause) \
+        or not mapper.has_property(criterion.key):
+            return None
+        order.append((criterion, descending))
+    primary_key = mapper.primary_key[0]
+    for column, descending in order:
+        if column.key == primary_key.key \
+        and getattr(column, 'table', None) is primary_key.table:
+            break
+    else:
+        order.append((primary_key, order[0][1]))
+    return order
+
+def _order_signature(order):
+    return u','.join(u'%s%s' % (descending and u'-' or u'', column.key)
+                     for column, descending in order)
+
+def _row_key(order, item):
+    return [getattr(item, column.key) for column, descending in order]
+
+_nulls_high_dialects = frozenset(['oracle', 'postgres', 'postgresql'])
+"""Databases that sort NULLs as if they were higher than any other value.
+MySQL and SQLite sort them lower."""
+
+def _nulls_high(query):
+    """Return True if the query's database sorts NULLs after other values."""
+    try:
+        bind = query.session.get_bind(query._mapper_zero())
+    except AttributeError:
+        return False
+    return bind.dialect.name in _nulls_high_dialects
+
+def _seek_clause(order, key, nulls_high=False):
+    """Return a clause matching the rows that come after the given key.
+
+    :param order: The (column, descending) pairs from :func:`_keyset_order`.
+    :param key: The values of those columns for the last row seen.
+    :param nulls_high: True if the database sorts NULLs after all other
+        values in ascending order, as PostgreSQL does, rather than before
+        them, as MySQL and SQLite do.
+
+    """
+    clauses = []
+    equal = []
+    for (column, descending), value in izip(order, key):
+        # NULLs come last in one direction and first in the other
+        nulls_last = descending != nulls_high
+        if value is None:
+            beyond = None
+            if not nulls_last:
+                beyond = column != None
+            same = column == None
+        else:
+            if descending:
+                beyond = column < value
+            else:
+                beyond = column > value
+            if nulls_last:
+                beyond = sql.or_(beyond, column == None)
+            same = column == value
+        if beyond is not None:
+            clauses.append(sql.and_(*(equal + [beyond])))
+        equal.append(same)
+    return sql.or_(*clauses)
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        # strftime only supports microseconds (%f) from Python 2.6
+        return {'datetime': [value.year, value.month, value.day, value.hour,
+                             value.minute, value.second, value.microsecond]}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime(*[int(part) for part in value['datetime']])
+    return value
+
+def _encode_cursor(order, page, count, forward, key):
+    key = [_encode_value(value) for value in key]
+    data = simplejson.dumps([order, page, count, forward, key])
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def _decode_cursor(cursor):
+    """Return the state recorded in the cursor, or None if it's invalid."""
+    if not cursor:
+        return None
+    try:
+        cursor = str(cursor)
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        order, page, count, forward, key = simplejson.loads(data)
+        page = int(page)
+        count = int(count)
+        key = [_decode_value(value) for value in key]
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        return None
+    return dict(order=order, page=page, count=count, forward=bool(forward),
+                key=key)
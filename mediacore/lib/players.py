@@ -568,32 +568,27 @@ class AbstractPlayersManager(AbstractClass):
             uris.sort(key=lambda uri: priority_map.get(getattr(uri, attr), 1))
         return uris
 
-    def pick_players(self, sorted_uris, media, kwargs):
-        """Initialize the unique players best able to play the given URIs.
+    def choose_players(self, sorted_uris):
+        """Choose the unique players best able to play the given URIs.
 
         Players are given priority based first on their ability to play
         higher priority URIs, then by the preferred order as they were
         originally given. This means that a Flash player may jump ahead
         of an HTML5 player if the RTMP protocol is preferred over HTTP.
 
-        We attempt to instantiate only one player of each logical type.
-        In the simplest case, we want just one html5 player and one flash
-        player, but this logic could also handle other player types such
-        as java or silverlight. We make no assumptions about the types
-        here, we just instantiate the highest priority player for each
-        logical type provided by the able players.
+        We choose only one player of each logical type. In the simplest
+        case, we want just one html5 player and one flash player, but this
+        logic could also handle other player types such as java or
+        silverlight. We make no assumptions about the types here, we just
+        choose the highest priority player for each logical type provided
+        by the able players.
 
         :type sorted_uris: tuple
         :param sorted_uris: StorageURIs, ordered by the priority we want them
             to play in.
-        :type media: :class:`mediacore.model.media.Media`
-        :param media: The media object that is being rendered, to be passed
-            to all instantiated player objects.
-        :type kwargs: dict
-        :param kwargs: The options dict that is passed to the player class
-            at instantiation time.
         :rtype list:
-        :returns: Instantiated player objects.
+        :returns: ``(player_cls, uris)`` tuples, where `uris` are the
+            StorageURIs that the player class can play.
 
         """
         # Find all the players that can play any URI
@@ -611,18 +606,119 @@ class AbstractPlayersManager(AbstractClass):
         # Reorder those players by the priority of the first file they can play
         able_players.sort(key=itemgetter(2))
 
-        players = []
+        chosen = []
         covered_types = set()
 
-        # Instantiate the highest priority players for every logical type
+        # Choose the highest priority players for every logical type
         for player_cls, player_uris, priority in able_players:
             player_types = player_cls.logical_types
             if player_types.difference(covered_types):
                 covered_types.update(player_types)
-                player = player_cls(media, player_uris, **kwargs)
-                players.append(player)
+                chosen.append((player_cls, player_uris))
+
+        return chosen
+
+    def pick_players(self, sorted_uris, media, kwargs):
+        """Initialize the unique players best able to play the given URIs.
+
+        See :meth:`choose_players`.
+
+        :type sorted_uris: tuple
+        :param sorted_uris: StorageURIs, ordered by the priority we want them
+            to play in.
+        :type media: :class:`mediacore.model.media.Media`
+        :param media: The media object that is being rendered, to be passed
+            to all instantiated player objects.
+        :type kwargs: dict
+        :param kwargs: The options dict that is passed to the player class
+            at instantiation time.
+        :rtype list:
+        :returns: Instantiated player objects.
+
+        """
+        return [player_cls(media, player_uris, **kwargs)
+                for player_cls, player_uris in self.choose_players(sorted_uris)]
+
+    def _selection_stamp(self, media):
+        """Return the values that the player selection for a media depends on.
 
-        return players
+        The media's ``modified_on`` date changes whenever its slug does,
+        which is part of many URIs, and the files' dates change whenever
+        anything about them does.
+
+        """
+        return (
+            self.name,
+            tuple(player_cls.name for player_cls in self.players),
+            media.modified_on,
+            tuple((file.id, file.modified_on) for file in media.files),
+        )
+
+    def _select(self, media):
+        """Sort the URIs of the given media and choose players for them.
+
+        :returns: ``(uris, players)`` where `uris` are ``(file_id, scheme,
+            file_uri, server_uri)`` tuples, in sorted order, and `players`
+            are ``(player_cls, indexes)`` tuples, where the indexes are
+            positions in `uris` of the URIs that the player can play.
+
+        """
+        sorted_uris = self.sort_uris(media.get_uris())
+        positions = dict((id(uri), i) for i, uri in enumerate(sorted_uris))
+        return (
+            tuple((uri.file.id, uri.scheme, uri.file_uri, uri.server_uri)
+                  for uri in sorted_uris),
+            tuple((player_cls, tuple(positions[id(uri)] for uri in uris))
+                  for player_cls, uris in self.choose_players(sorted_uris)),
+        )
+
+    def selection(self, media):
+        """Return the sorted URIs and chosen players for the given media.
+
+        This is equivalent to calling :meth:`sort_uris` and then
+        :meth:`choose_players`, but the result is cached, so that the
+        storage engines only need to build the URIs for each media once.
+        Many URIs are qualified with the scheme and host they're generated
+        for, so the selection is kept separately for each of those. Media
+        with URIs that expire, see :func:`uris_expire`, aren't cached.
+
+        :type media: :class:`mediacore.model.media.Media`
+        :rtype: tuple
+        :returns: A list of sorted StorageURIs, and a list of
+            ``(player_cls, uris)`` tuples.
+
+        """
+        if uris_expire(media):
+            uri_tuples, chosen = self._select(media)
+            return self._selection_uris(media, uri_tuples, chosen)
+        cache = _selection_cache()
+        key = str(media.id)
+        stamp = self._selection_stamp(media)
+        base_url = url_for('/', qualified=True)
+        try:
+            cached_stamp, selections = cache.get_value(key)
+        except KeyError:
+            cached_stamp = None
+        if cached_stamp != stamp:
+            selections = {}
+            cache.set_value(key, (stamp, selections))
+        selection = selections.get(base_url, None)
+        if selection is None:
+            if len(selections) >= _selection_max_hosts:
+                # The host comes from the request, so don't let made up
+                # hosts fill the cache.
+                selections.clear()
+            selection = selections[base_url] = self._select(media)
+        uri_tuples, chosen = selection
+        return self._selection_uris(media, uri_tuples, chosen)
+
+    def _selection_uris(self, media, uri_tuples, chosen):
+        """Turn a selection from :meth:`_select` back into StorageURIs."""
+        files = dict((file.id, file) for file in media.files)
+        uris = [StorageURI(files[file_id], scheme, file_uri, server_uri)
+                for file_id, scheme, file_uri, server_uri in uri_tuples]
+        return uris, [(player_cls, [uris[i] for i in indexes])
+                      for player_cls, indexes in chosen]
 
     def render(self, media, **kwargs):
         """Return an XHTML literal with the player(s) of your choosing.
@@ -635,8 +731,9 @@ class AbstractPlayersManager(AbstractClass):
         :returns: XHTML or javascript that will not be escaped by Genshi.
 
         """
-        uris = self.sort_uris(media.get_uris())
-        players = self.pick_players(uris, media, kwargs)
+        uris, chosen = self.selection(media)
+        players = [player_cls(media, player_uris, **kwargs)
+                   for player_cls, player_uris in chosen]
 
         if not players:
             return None
@@ -767,6 +864,39 @@ def manager():
             raise PlayerError('Unrecognized player type, given %r', name)
     return cache.get(createfunc=init_manager, key=key)
 
+_selection_expire = 3600
+"""Seconds that the player selection for each media is cached for."""
+
+_selection_max_hosts = 4
+"""Base URLs that the player selection for each media is kept for."""
+
+def _selection_cache():
+    return app_globals.cache.get_cache('player_selection', type='memory',
+                                       expire=_selection_expire)
+
+def uris_expire(media):
+    """Return True if any of the media's URIs stop working after a while.
+
+    Anything that includes those URIs, such as the player, mustn't be
+    cached. See :attr:`mediacore.lib.storage.StorageEngine.uris_expire`.
+
+    """
+    return any(getattr(file.storage, 'uris_expire', False)
+               for file in media.files)
+
+def discard_player_selection(*media_ids):
+    """Discard the cached player selection for the given media IDs, or all."""
+    try:
+        cache = _selection_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup, and so
+        # nothing to discard.
+        return
+    if not media_ids:
+        cache.clear()
+    for media_id in media_ids:
+        cache.remove_value(str(media_id))
+
 def media_player(media, **kwargs):
     return manager().render(media, **kwargs)
 
@@ -782,7 +912,7 @@ def pick_any_media_file(media):
     :returns: A :class:`~mediacore.model.media.MediaFile` object or None
     """
     managerobj = manager()
-    uris = managerobj.sort_uris(media.get_uris())
+    uris, chosen = managerobj.selection(media)
     for player in managerobj.players:
         for i, plays in enumerate(player.can_play(uris)):
             if plays:
@@ -799,7 +929,7 @@ def pick_podcast_media_file(media):
     :param media: A :class:`~mediacore.model.media.Media` instance.
     :returns: A :class:`~mediacore.model.media.MediaFile` object or None
     """
-    uris = manager().sort_uris(media.get_uris())
+    uris, chosen = manager().selection(media)
     for i, plays in enumerate(iTunesPlayer.can_play(uris)):
         if plays:
             return uris[i]
@@ -822,3 +952,22 @@ def embed_iframe(media, width=400, height=225, frameborder=0, **kwargs):
     return tag
 
 embed_player = embed_iframe
+
+###############################################################################
+
+# XXX: Imported last because mediacore.model.media imports this module.
+from mediacore.model import after_commit_hook
+
+@after_commit_hook
+def _discard_committed(media_ids):
+    discard_player_selection(*media_ids)
+
+@observes(events.MediaFile.after_insert, events.MediaFile.after_update,
+          events.MediaFile.after_delete)
+def _media_file_changed(instance):
+    if instance.media_id is not None:
+        _discard_committed.add(instance.media_id)
+
+@observes(events.Media.after_delete)
+def _media_deleted(instance):
+    _discard_committed.add(instance.id)
@@ -0,0 +1,130 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Random Media Selection
+
+Picking a random row with ``ORDER BY random()`` sorts the entire media
+table on every request. Instead, we keep a pool of the IDs of all the
+media that are, or are scheduled to become, published. The pool is
+cached in memory and refreshed every few minutes, or as soon as this
+process changes the publish status of any media. Picking from it costs
+a single primary key lookup, no matter how large the library grows.
+
+"""
+import random
+
+from datetime import datetime
+
+from pylons import app_globals
+from sqlalchemy import sql
+from sqlalchemy.orm import attributes
+
+from mediacore.model.media import Media
+from mediacore.model.meta import DBSession
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+__all__ = ['clear_random_media_pool', 'random_published_media']
+
+_refresh_interval = 300
+"""Seconds until the pool is reloaded from the database."""
+
+_attempts = 5
+"""Random picks to try before looking for any media in the pool that
+is published right now."""
+
+_publishing_attrs = ('reviewed', 'encoded', 'publishable',
+                     'publish_on', 'publish_until')
+"""Media attributes which determine whether it is in the pool."""
+
+def _pool_cache():
+    return app_globals.cache.get_cache('random_media', type='memory',
+                                       expire=_refresh_interval)
+
+def _load_pool():
+    """Return ``(id, publish_on, publish_until)`` for each media item which
+    is published now, or will be once its publish_on date arrives."""
+    query = DBSession.query(Media.id, Media.publish_on, Media.publish_until)\
+        .filter(Media.reviewed == True)\
+        .filter(Media.encoded == True)\
+        .filter(Media.publishable == True)\
+        .filter(Media.publish_on != None)\
+        .filter(sql.or_(Media.publish_until == None,
+                        Media.publish_until >= datetime.now()))
+    return tuple(tuple(row) for row in query)
+
+def _is_live((media_id, publish_on, publish_until), now):
+    return publish_on <= now and (publish_until is None or publish_until >= now)
+
+def _pick(pool, now):
+    """Return the ID of a random pool entry that is published now, or None."""
+    for i in xrange(min(_attempts, len(pool))):
+        entry = random.choice(pool)
+        if _is_live(entry, now):
+            return entry[0]
+    # Much of the pool may be scheduled for the future, so don't rely on
+    # luck alone before giving up.
+    live = [entry for entry in pool if _is_live(entry, now)]
+    if live:
+        return random.choice(live)[0]
+    return None
+
+def random_published_media():
+    """Return a randomly selected published media item, or None.
+
+    Entries outside their publishing window are skipped without touching
+    the database. The chosen media is then loaded by its primary key,
+    which also confirms it is still published, in case another process
+    has changed it since our pool was loaded. If it hasn't, the pool is
+    reloaded and we try once more.
+
+    :rtype: :class:`~mediacore.model.media.Media` or None
+
+    """
+    cache = _pool_cache()
+    for attempt in xrange(2):
+        if attempt:
+            cache.clear()
+        pool = cache.get(createfunc=_load_pool, key=None)
+        media_id = _pick(pool, datetime.now())
+        if media_id is None:
+            return None
+        media = Media.query.published().filter(Media.id == media_id).first()
+        if media is not None:
+            return media
+    return None
+
+def clear_random_media_pool():
+    """Discard the pool in this process so that it is reloaded next time."""
+    try:
+        cache = _pool_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup, and so no
+        # pool to clear.
+        return
+    cache.clear()
+
+@observes(events.Media.after_insert, events.Media.after_delete)
+def _clear_for_media(instance):
+    clear_random_media_pool()
+
+@observes(events.Media.before_update)
+def _clear_for_media_update(instance):
+    for key in _publishing_attrs:
+        added, unchanged, deleted = attributes.get_history(instance, key,
+            passive=attributes.PASSIVE_NO_INITIALIZE)
+        if added or deleted:
+            clear_random_media_pool()
+            return
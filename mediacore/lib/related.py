@@ -0,0 +1,253 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Related Media
+
+Related media are found with a fulltext search for the title and tags
+of the media being viewed. That's the most expensive query on the page,
+and its results hardly ever change, so we cache the IDs it finds for
+each media item.
+
+Once the cached IDs are :data:`_refresh_interval` seconds old they are
+still used, but the search is queued to run again in a background thread
+so that new media show up eventually without anyone having to wait for
+it. Each process has one such thread, and at most :data:`_max_queued`
+searches waiting for it; stale IDs that don't fit are refreshed when
+they are next viewed.
+
+When the title or tags of a media item are changed, its IDs are
+discarded once the change has been committed.
+
+"""
+import logging
+import os
+import threading
+import time
+
+from Queue import Full, Queue
+
+from pylons import app_globals
+from sqlalchemy import orm
+from sqlalchemy.orm import attributes
+
+from mediacore.model import after_commit_hook
+from mediacore.model.media import Media, MediaFullText
+from mediacore.model.meta import DBSession
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+log = logging.getLogger(__name__)
+
+__all__ = ['discard_related_media', 'related_media', 'related_media_ids']
+
+_expire = 86400
+"""Seconds until cached IDs are thrown away entirely."""
+
+_refresh_interval = 21600
+"""Seconds until cached IDs are refreshed in the background."""
+
+_max_queued = 50
+"""The most searches waiting to be run by the background thread."""
+
+_max_results = 20
+"""The most related media IDs to store for each media item."""
+
+_searched_attrs = ('title', 'tags')
+"""Media attributes which the search for related media is based on."""
+
+def _related_cache():
+    return app_globals.cache.get_cache('related_media', type='memory',
+                                       expire=_expire)
+
+def _key(media_id):
+    return str(media_id)
+
+def _search_related(media_id):
+    """Search for media related to the given media ID.
+
+    :returns: A tuple of media IDs, most relevant first.
+
+    """
+    fulltext = DBSession.query(MediaFullText.title, MediaFullText.tags)\
+        .filter(MediaFullText.media_id == media_id)\
+        .first()
+    if fulltext is None:
+        return ()
+    title, tags = fulltext
+    query = Media.query.published()\
+        .filter(Media.id != media_id)\
+        .search(u'%s %s' % (title or u'', tags or u''), bool=False)
+    return tuple(m.id for m in query[:_max_results])
+
+class _BackgroundRefresher(object):
+    """
+    Run the searches for stale related media in a background thread.
+
+    The thread is started lazily so that it is created in each worker of
+    a forking server, rather than in the parent before the fork.
+    """
+
+    def __init__(self, max_queued, threaded=True):
+        self.max_queued = max_queued
+        self.threaded = threaded
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def refresh(self, cache, media_id):
+        """Queue a search for the given media, unless one is queued already.
+
+        The cache is passed in because app_globals is only available to
+        request threads.
+
+        :returns: False if the queue is full, and the search was dropped.
+
+        """
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            if media_id in self._queued:
+                return True
+            try:
+                self._queue.put_nowait((cache, media_id))
+            except Full:
+                return False
+            self._queued.add(media_id)
+            if self.threaded and not self._thread.isAlive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='mediacore-related')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            return True
+        finally:
+            self._lock.release()
+
+    def run_queued(self):
+        """Run the queued searches in this thread, until none are left."""
+        while True:
+            self._lock.acquire()
+            try:
+                self._check_pid()
+                if self._queue.empty():
+                    return
+                item = self._queue.get_nowait()
+            finally:
+                self._lock.release()
+            self._refresh(*item)
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # The queue and thread belong to the parent process
+            self._queue = Queue(self.max_queued)
+            self._queued = set()
+            self._thread = threading.Thread()
+            self._pid = os.getpid()
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            self._refresh(*queue.get())
+
+    def _refresh(self, cache, media_id):
+        try:
+            try:
+                ids = _search_related(media_id)
+                cache.set_value(_key(media_id), (time.time(), ids))
+            except Exception:
+                log.exception('Error refreshing the related media of %d',
+                              media_id)
+        finally:
+            DBSession.remove()
+            self._lock.acquire()
+            try:
+                self._queued.discard(media_id)
+            finally:
+                self._lock.release()
+
+_refresher = _BackgroundRefresher(_max_queued)
+
+def related_media_ids(media, limit=None):
+    """Return the IDs of media related to the given media.
+
+    The results are cached, so they may include media that have been
+    unpublished since. :func:`related_media` filters those out.
+
+    :param media: A :class:`~mediacore.model.media.Media` instance.
+    :param limit: The maximum number of IDs to return, up to
+        :data:`_max_results`.
+    :rtype: tuple
+
+    """
+    cache = _related_cache()
+    key = _key(media.id)
+    try:
+        computed_on, ids = cache.get_value(key)
+    except KeyError:
+        ids = _search_related(media.id)
+        cache.set_value(key, (time.time(), ids))
+    else:
+        if time.time() - computed_on > _refresh_interval:
+            _refresher.refresh(cache, media.id)
+    return ids[:limit]
+
+def related_media(media, limit=6):
+    """Return published media related to the given media.
+
+    :param media: A :class:`~mediacore.model.media.Media` instance.
+    :param limit: The maximum number of media to return.
+    :rtype: list of :class:`~mediacore.model.media.Media`, most
+        relevant first.
+
+    """
+    ids = related_media_ids(media)
+    if not ids:
+        return []
+    found = Media.query.published()\
+        .options(orm.undefer('comment_count_published'))\
+        .filter(Media.id.in_(ids))
+    found = dict((m.id, m) for m in found)
+    return [found[id] for id in ids if id in found][:limit]
+
+def discard_related_media(*media_ids):
+    """Discard the cached results for the given media IDs, or all of them."""
+    try:
+        cache = _related_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup, and so
+        # nothing to discard.
+        return
+    if not media_ids:
+        cache.clear()
+    for media_id in media_ids:
+        cache.remove_value(_key(media_id))
+
+@after_commit_hook
+def _discard_committed(media_ids):
+    discard_related_media(*media_ids)
+
+@observes(events.Media.before_update)
+def _media_updated(instance):
+    for key in _searched_attrs:
+        added, unchanged, deleted = attributes.get_history(instance, key,
+            passive=attributes.PASSIVE_NO_INITIALIZE)
+        if added or deleted:
+            _discard_committed.add(instance.id)
+            return
+
+@observes(events.Media.after_delete)
+def _media_deleted(instance):
+    _discard_committed.add(instance.id)
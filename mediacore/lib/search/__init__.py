@@ -0,0 +1,197 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Fulltext Search Engines
+
+:meth:`MediaQuery.search <mediacore.model.media.MediaQuery.search>` and
+:meth:`~mediacore.model.media.MediaQuery.admin_search` delegate to the
+search engine returned by :func:`search_engine`. Each engine searches the
+documents in the ``media_fulltext`` table, using whatever indexing the
+database (or lack thereof) provides, and orders the results by relevance.
+
+The engine is chosen with the ``search_engine`` config directive. By
+default, an engine is picked to suit the database in use.
+
+"""
+import logging
+import re
+
+from mediacore.plugin.abc import AbstractClass, abstractmethod, abstractproperty
+
+log = logging.getLogger(__name__)
+
+__all__ = ['AbstractSearchEngine', 'SearchError', 'init_search',
+           'parse_search', 'search_engine', 'tokenize']
+
+column_weights = {
+    'title': 4.0,
+    'tags': 3.0,
+    'categories': 2.0,
+    'subtitle': 2.0,
+    'description_plain': 1.0,
+    'notes': 1.0,
+}
+"""Relative weights of each media_fulltext column, for ranking results."""
+
+class SearchError(Exception):
+    """Base class for all search exceptions."""
+
+class AbstractSearchEngine(AbstractClass):
+    """
+    Base class for all fulltext search engine implementations.
+
+    The searchable text of each media item is maintained in the
+    ``media_fulltext`` table by :mod:`mediacore.model.fulltext`, which
+    passes every change along to :meth:`update`. Engines which don't
+    use that table directly must maintain their own index from it.
+
+    There are two indexes, each searching a different set of columns,
+    ``'public'`` and ``'admin'``. See ``_fulltext_indexes`` in
+    :mod:`mediacore.model.media`.
+
+    """
+
+    name = abstractproperty()
+    """A unique string name for the engine, to be used in the config."""
+
+    dialects = ()
+    """Database dialects this engine is automatically chosen for."""
+
+    def __init__(self, config, engine):
+        """Initialize the engine.
+
+        :param config: The app config dict.
+        :param engine: The SQLAlchemy engine the app is using.
+
+        """
+
+    @abstractmethod
+    def search(self, query, index, search, bool=False, order_by=True):
+        """Filter the given query to media that match the search.
+
+        :param query: A :class:`~mediacore.model.media.MediaQuery`.
+        :param index: ``'public'`` or ``'admin'``.
+        :param search: The user's input. In boolean mode, this may use
+            a subset of MySQL's boolean syntax, see :func:`parse_search`.
+        :param bool: Use boolean mode if True.
+        :param order_by: If True, replace the query's current ordering
+            with the relevance of each result.
+        :returns: The filtered query.
+
+        """
+
+    def update(self, media_ids, rows):
+        """Replace the documents for the given media IDs.
+
+        Called after the corresponding ``media_fulltext`` rows have been
+        rewritten, in the same transaction. Engines that keep their index
+        outside the database should wait for the transaction to commit
+        before writing it, see :class:`~mediacore.model.after_commit_hook`.
+
+        :param media_ids: All the media IDs that were reindexed.
+        :param rows: A list of ``media_fulltext`` rows as dicts. There is
+            no row for media that have been deleted.
+
+        """
+
+    def clear(self):
+        """Discard all documents, in preparation for a full rebuild."""
+
+def init_search(config, engine):
+    """Instantiate the search engine named by the config.
+
+    Called by :func:`mediacore.config.environment.load_environment`.
+    Recognized options::
+
+        # auto, mysql, postgresql, sqlite or inverted
+        search_engine = auto
+
+    :raises SearchError: If the config names an unknown engine.
+
+    """
+    global _search_engine
+    name = config.get('search_engine', 'auto')
+    dialect = engine.dialect.name
+    for engine_cls in AbstractSearchEngine:
+        if engine_cls.name == name \
+        or (name == 'auto' and dialect in engine_cls.dialects):
+            break
+    else:
+        if name != 'auto':
+            raise SearchError('Unrecognized search_engine: %r' % name)
+        # No engine specific to the database, use our own index
+        engine_cls = InvertedIndexSearchEngine
+    log.debug('Initializing the search engine %r', engine_cls)
+    _search_engine = engine_cls(config, engine)
+    return _search_engine
+
+_search_engine = None
+
+def search_engine():
+    """Return the search engine instantiated by :func:`init_search`.
+
+    :rtype: :class:`AbstractSearchEngine` instance
+    :raises SearchError: If the search engine has not been initialized.
+
+    """
+    if _search_engine is None:
+        raise SearchError('init_search must be called before searching.')
+    return _search_engine
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+_search_term_re = re.compile(r'([+-]?)(\w+)(\*?)', re.UNICODE)
+
+def tokenize(text):
+    """Split the given text into lowercase words."""
+    if not text:
+        return []
+    return _word_re.findall(text.lower())
+
+def parse_search(search, bool=False):
+    """Split the user's search input into terms.
+
+    In boolean mode, we support this subset of MySQL's boolean syntax:
+    a leading ``+`` marks a word as required; a leading ``-`` excludes
+    results that contain the word; and a trailing ``*`` matches any
+    word that begins with the given characters. All other punctuation,
+    including quotes, is ignored.
+
+    Outside of boolean mode, all words are optional and all punctuation
+    is ignored.
+
+    :returns: A ``(required, optional, excluded)`` tuple of lists of
+        ``(word, is_prefix)`` tuples. Words are lowercased.
+
+    """
+    required, optional, excluded = [], [], []
+    if not search:
+        return required, optional, excluded
+    if not bool:
+        optional = [(word, False) for word in tokenize(search)]
+        return required, optional, excluded
+    for op, word, star in _search_term_re.findall(search.lower()):
+        term = (word, star == '*')
+        if op == '+':
+            required.append(term)
+        elif op == '-':
+            excluded.append(term)
+        else:
+            optional.append(term)
+    return required, optional, excluded
+
+from mediacore.lib.search.mysql import MySQLSearchEngine
+from mediacore.lib.search.postgresql import PostgreSQLSearchEngine
+from mediacore.lib.search.sqlite import SQLiteSearchEngine
+from mediacore.lib.search.inverted import InvertedIndexSearchEngine
@@ -0,0 +1,368 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cPickle as pickle
+import math
+import os
+import tempfile
+import threading
+
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from paste.deploy.converters import asint
+from sqlalchemy import sql
+
+from mediacore.lib.search import (AbstractSearchEngine, SearchError,
+    column_weights, parse_search, search_engine, tokenize)
+from mediacore.model import after_commit_hook
+from mediacore.model.meta import DBSession
+from mediacore.model.media import Media, _fulltext_indexes, media_fulltext
+
+_batch_size = 500
+"""Media rows read at a time when applying committed changes."""
+
+class InvertedIndex(object):
+    """
+    An in-memory inverted index of media documents.
+
+    For each of the fulltext indexes (see ``_fulltext_indexes``) we map
+    each word to the media containing it, along with the weight of that
+    word in each media's document. The words of each document are kept
+    too, so that documents can be replaced.
+    """
+
+    def __init__(self):
+        self.postings = dict((index, {}) for index in _fulltext_indexes)
+        self.documents = {}
+        self._vocabulary = {}
+
+    def add(self, row):
+        """Add a ``media_fulltext`` row, replacing any existing one."""
+        media_id = row['media_id']
+        self.remove(media_id)
+        document = {}
+        for index, cols in _fulltext_indexes.iteritems():
+            weights = {}
+            for col in cols:
+                col_weight = column_weights.get(col.name, 1.0)
+                for word in tokenize(row.get(col.name)):
+                    weights[word] = weights.get(word, 0.0) + col_weight
+            postings = self.postings[index]
+            for word, weight in weights.iteritems():
+                postings.setdefault(word, {})[media_id] = weight
+            document[index] = weights.keys()
+        self.documents[media_id] = document
+        self._vocabulary.clear()
+
+    def remove(self, media_id):
+        """Remove the document for the given media ID, if it exists."""
+        document = self.documents.pop(media_id, None)
+        if not document:
+            return
+        for index, words in document.iteritems():
+            postings = self.postings[index]
+            for word in words:
+                matches = postings.get(word)
+                if matches is not None:
+                    matches.pop(media_id, None)
+                    if not matches:
+                        del postings[word]
+        self._vocabulary.clear()
+
+    def matches(self, index, (word, is_prefix)):
+        """Return a dict of media IDs to weights for the given term.
+
+        The weight of each word is scaled by its inverse document
+        frequency, so that rare words count for more. For prefixes, each
+        media is weighted by its best matching word. Prefixes are looked
+        up in a sorted vocabulary, without scanning all the words.
+
+        """
+        postings = self.postings[index]
+        if not is_prefix:
+            words = word in postings and [word] or []
+        else:
+            vocabulary = self._vocabulary.get(index)
+            if vocabulary is None:
+                vocabulary = self._vocabulary[index] = sorted(postings)
+            words = []
+            for i in xrange(bisect_left(vocabulary, word), len(vocabulary)):
+                if not vocabulary[i].startswith(word):
+                    break
+                words.append(vocabulary[i])
+        total = float(len(self.documents)) or 1.0
+        results = {}
+        for word in words:
+            matches = postings[word]
+            idf = math.log(1.0 + total / len(matches))
+            for media_id, weight in matches.iteritems():
+                score = weight * idf
+                if score > results.get(media_id, 0.0):
+                    results[media_id] = score
+        return results
+
+    def search(self, index, search, bool=False):
+        """Return media IDs matching the search, most relevant first."""
+        required, optional, excluded = parse_search(search, bool)
+        scores = None
+        for term in required:
+            matches = self.matches(index, term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict((media_id, score + matches[media_id])
+                              for media_id, score in scores.iteritems()
+                              if media_id in matches)
+        if required:
+            # Optional words only affect the ranking of required matches
+            for term in optional:
+                for media_id, score in self.matches(index, term).iteritems():
+                    if media_id in scores:
+                        scores[media_id] += score
+        else:
+            scores = {}
+            for term in optional:
+                for media_id, score in self.matches(index, term).iteritems():
+                    scores[media_id] = scores.get(media_id, 0.0) + score
+        for term in excluded:
+            for media_id in self.matches(index, term):
+                scores.pop(media_id, None)
+        return sorted(scores, key=scores.__getitem__, reverse=True)
+
+class InvertedIndexSearchEngine(AbstractSearchEngine):
+    """
+    Search using our own inverted index, stored in files on local disk.
+
+    This works with any database. Each process keeps a copy of the index
+    in memory and catches up when the files are changed by another
+    process. Changes are only written once the transaction that made them
+    has committed, reading the committed ``media_fulltext`` rows, so a
+    rolled back transaction never reaches the index.
+
+    The index is stored as a snapshot plus a journal of the changes made
+    since. Each commit appends its changes to the journal, so it costs
+    time in proportion to the change rather than the catalog. Once the
+    journal holds ``search_engine.journal_size`` changes, the snapshot is
+    rewritten and the journal started over. Writes are serialized with a
+    lock file. Recognized options::
+
+        # The directory to store the index in, by default the search
+        # directory inside cache_dir.
+        search_engine.index_dir = %(here)s/data/search
+        # The maximum number of results for any one search.
+        search_engine.max_results = 500
+        # Changes journaled before the snapshot is rewritten.
+        search_engine.journal_size = 200
+
+    """
+
+    name = 'inverted'
+
+    def __init__(self, config, engine):
+        if fcntl is None:
+            # Without file locks, processes could lose each other's changes
+            raise SearchError('The inverted search engine requires fcntl, '
+                              'which is only available on POSIX systems.')
+        index_dir = config.get('search_engine.index_dir') \
+            or os.path.join(config['cache_dir'], 'search')
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        self.path = os.path.join(index_dir, 'media.idx')
+        self.journal_path = self.path + '.journal'
+        self.max_results = asint(config.get('search_engine.max_results', 500))
+        self.journal_size = asint(config.get('search_engine.journal_size', 200))
+        self._index = InvertedIndex()
+        self._stamp = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        media_ids = self._current().search(index, search, bool)
+        media_ids = media_ids[:self.max_results]
+        if not media_ids:
+            return query.filter(Media.id == None)
+        query = query.filter(Media.id.in_(media_ids))
+        if order_by:
+            relevance = sql.case(
+                [(media_id, rank) for rank, media_id in enumerate(media_ids)],
+                value=Media.id,
+            )
+            query = query.order_by(None).order_by(relevance)
+        return query
+
+    def update(self, media_ids, rows):
+        _update_committed.add(*media_ids)
+
+    def clear(self):
+        # None stands for every document
+        _update_committed.add(None)
+
+    def apply_committed(self, media_ids, clear=False):
+        """Bring the documents for the given media up to date.
+
+        :param media_ids: The media IDs whose rows have changed.
+        :param clear: Discard all the other documents too.
+
+        """
+        change = (list(media_ids), _committed_rows(media_ids))
+        self._lock.acquire()
+        lock_file = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._sync()
+            if clear:
+                self._index = InvertedIndex()
+            _apply_change(self._index, change)
+            if clear or self._stamp is None \
+            or self._journal_entries >= self.journal_size:
+                self._write_snapshot()
+            else:
+                self._append_journal(change)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            self._lock.release()
+
+    def _current(self):
+        """Return the index, after catching up with changes on disk."""
+        if self._stale():
+            self._lock.acquire()
+            lock_file = open(self.path + '.lock', 'w')
+            try:
+                # Wait for any half-written change to be finished
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+                self._sync()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+                self._lock.release()
+        return self._index
+
+    def _stale(self):
+        try:
+            if _stamp_of(os.stat(self.path)) != self._stamp:
+                return True
+        except OSError:
+            return False
+        try:
+            return os.path.getsize(self.journal_path) != self._journal_offset
+        except OSError:
+            return self._journal_offset != 0
+
+    def _sync(self):
+        """Load the snapshot if it was replaced, then replay the journal.
+
+        The caller must hold the lock file.
+
+        """
+        try:
+            stamp = _stamp_of(os.stat(self.path))
+        except OSError:
+            return
+        if stamp != self._stamp:
+            f = open(self.path, 'rb')
+            try:
+                self._stamp = _stamp_of(os.fstat(f.fileno()))
+                self._index = pickle.load(f)
+            finally:
+                f.close()
+            self._journal_offset = 0
+            self._journal_entries = 0
+        try:
+            f = open(self.journal_path, 'rb')
+        except IOError:
+            return
+        try:
+            f.seek(self._journal_offset)
+            while True:
+                try:
+                    change = pickle.load(f)
+                except EOFError:
+                    break
+                _apply_change(self._index, change)
+                self._journal_entries += 1
+            self._journal_offset = f.tell()
+        finally:
+            f.close()
+
+    def _append_journal(self, change):
+        data = pickle.dumps(change, pickle.HIGHEST_PROTOCOL)
+        f = open(self.journal_path, 'ab')
+        try:
+            f.write(data)
+            f.flush()
+            self._journal_offset = f.tell()
+        finally:
+            f.close()
+        self._journal_entries += 1
+
+    def _write_snapshot(self):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        f = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump(self._index, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
+        # Everything in the journal is in the new snapshot
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+        self._stamp = _stamp_of(os.stat(self.path))
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+AbstractSearchEngine.register(InvertedIndexSearchEngine)
+
+def _apply_change(index, change):
+    media_ids, rows = change
+    for media_id in media_ids:
+        index.remove(media_id)
+    for row in rows:
+        index.add(row)
+
+def _committed_rows(media_ids):
+    """Read the committed ``media_fulltext`` rows on a connection of their own."""
+    media_ids = sorted(media_ids)
+    rows = []
+    conn = DBSession.bind.connect()
+    try:
+        for i in xrange(0, len(media_ids), _batch_size):
+            query = sql.select([media_fulltext], media_fulltext.c.media_id\
+                .in_(media_ids[i:i + _batch_size]))
+            for row in conn.execute(query):
+                rows.append(dict((key, row[key]) for key in row.keys()))
+    finally:
+        conn.close()
+    return rows
+
+@after_commit_hook
+def _update_committed(keys):
+    engine = search_engine()
+    if isinstance(engine, InvertedIndexSearchEngine):
+        engine.apply_committed([key for key in keys if key is not None],
+                               clear=None in keys)
+
+def _stamp_of(st):
+    # The file is always replaced, never modified, so a new inode means a
+    # new index even if the mtime resolution is too coarse to tell.
+    return (st.st_ino, st.st_mtime)
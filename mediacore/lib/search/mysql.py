@@ -0,0 +1,46 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mediacore.lib.search import AbstractSearchEngine
+from mediacore.model import MatchAgainstClause
+from mediacore.model.media import MediaFullText, _fulltext_indexes
+
+class MySQLSearchEngine(AbstractSearchEngine):
+    """
+    Search using the FULLTEXT indexes of the MyISAM media_fulltext table.
+
+    The indexes are created along with the table, and MySQL maintains
+    them as the rows change, so there is nothing else for us to do.
+    """
+
+    name = 'mysql'
+    dialects = ('mysql',)
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        search_cols = _fulltext_indexes[index]
+        filter = MatchAgainstClause(search_cols, search, bool)
+        query = query.join(MediaFullText).filter(filter)
+        if order_by:
+            # MySQL automatically orders natural lang searches by relevance,
+            # so override any existing ordering
+            query = query.order_by(None)
+            if bool:
+                # To mimic the same behaviour in boolean mode, we must do an
+                # extra natural language search on our boolean-filtered results
+                relevance = MatchAgainstClause(search_cols, search, bool=False)
+                query = query.order_by(relevance)
+        return query
+
+AbstractSearchEngine.register(MySQLSearchEngine)
@@ -0,0 +1,107 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import sql
+from sqlalchemy.schema import DDL
+
+from mediacore.lib.search import AbstractSearchEngine, parse_search
+from mediacore.model.media import Media, MediaFullText, media_fulltext
+from mediacore.model.meta import DBSession
+
+# Each index gets a tsvector column on media_fulltext, named like
+# admin_tsv, with a GIN index. Only PostgreSQL knows about these columns.
+_index_names = ('public', 'admin')
+
+for _name in _index_names:
+    DDL('ALTER TABLE %%(table)s ADD COLUMN %s_tsv tsvector' % _name,
+        on='postgresql').execute_at('after-create', media_fulltext)
+    DDL('CREATE INDEX %%(table)s_%s_tsv ON %%(table)s USING gin(%s_tsv)'
+        % (_name, _name),
+        on='postgresql').execute_at('after-create', media_fulltext)
+
+# The text of each index with its weights, from A (most relevant) to D.
+_public_vector = (
+    "setweight(to_tsvector(:language, coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector(:language, coalesce(tags, '') || ' ' || "
+                                     "coalesce(categories, '')), 'B') || "
+    "setweight(to_tsvector(:language, coalesce(subtitle, '')), 'C') || "
+    "setweight(to_tsvector(:language, coalesce(description_plain, '')), 'D')"
+)
+_admin_vector = _public_vector + (
+    " || setweight(to_tsvector(:language, coalesce(notes, '')), 'D')"
+)
+
+class PostgreSQLSearchEngine(AbstractSearchEngine):
+    """
+    Search using tsvector columns with GIN indexes.
+
+    The vectors are computed from the other media_fulltext columns
+    whenever a row is rewritten. Recognized options::
+
+        # The text search configuration used for stemming
+        search_engine.language = english
+
+    """
+
+    name = 'postgresql'
+    dialects = ('postgresql', 'postgres')
+
+    def __init__(self, config, engine):
+        self.language = config.get('search_engine.language', 'english')
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        tsquery = _tsquery(search, bool)
+        if not tsquery:
+            return query.filter(Media.id == None)
+        vector = sql.literal_column('%s.%s_tsv' % (media_fulltext.name, index))
+        tsquery = sql.func.to_tsquery(self.language, tsquery)
+        query = query.join(MediaFullText).filter(vector.op('@@')(tsquery))
+        if order_by:
+            relevance = sql.func.ts_rank(vector, tsquery)
+            query = query.order_by(None).order_by(relevance.desc())
+        return query
+
+    def update(self, media_ids, rows):
+        if not rows:
+            # The deleted media_fulltext rows took their vectors with them.
+            return
+        ids = ', '.join(str(int(row['media_id'])) for row in rows)
+        DBSession.execute(sql.text(
+            'UPDATE %s SET public_tsv = %s, admin_tsv = %s '
+            'WHERE media_id IN (%s)'
+            % (media_fulltext.name, _public_vector, _admin_vector, ids)
+        ), {'language': self.language})
+
+AbstractSearchEngine.register(PostgreSQLSearchEngine)
+
+def _tsquery(search, bool):
+    """Translate the user's search input into tsquery syntax.
+
+    Results must contain every required word. If there are none, they
+    must contain at least one of the optional words. Words consist of
+    alphanumerics only, so they can be embedded in the query safely.
+
+    """
+    required, optional, excluded = parse_search(search, bool)
+    def lexeme((word, is_prefix)):
+        return is_prefix and word + ':*' or word
+    if required:
+        terms = [lexeme(term) for term in required]
+    elif optional:
+        terms = ['(%s)' % ' | '.join(lexeme(term) for term in optional)]
+    else:
+        return None
+    terms.extend('!' + lexeme(term) for term in excluded)
+    return ' & '.join(terms)
@@ -0,0 +1,137 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+from sqlalchemy import sql
+from sqlalchemy.interfaces import PoolListener
+from sqlalchemy.schema import DDL
+
+from mediacore.lib.search import (AbstractSearchEngine, column_weights,
+    parse_search)
+from mediacore.model.media import Media, _fulltext_indexes, media_fulltext
+from mediacore.model.meta import DBSession
+
+def _fts_columns(index):
+    return [col.name for col in _fulltext_indexes[index]]
+
+# Each index is a separate FTS3 table, named like media_fulltext_fts_admin,
+# with the media ID as its docid.
+for _name in _fulltext_indexes:
+    DDL('CREATE VIRTUAL TABLE %%(table)s_fts_%s USING fts3(%s, tokenize=porter)'
+        % (_name, ', '.join(_fts_columns(_name))),
+        on='sqlite').execute_at('after-create', media_fulltext)
+    DDL('DROP TABLE IF EXISTS %%(table)s_fts_%s' % _name,
+        on='sqlite').execute_at('before-drop', media_fulltext)
+
+def _fts_table(index):
+    return sql.table('%s_fts_%s' % (media_fulltext.name, index),
+                     sql.column('docid'))
+
+class SQLiteSearchEngine(AbstractSearchEngine):
+    """
+    Search using SQLite's FTS3 extension.
+
+    SQLite doesn't provide a relevance function for FTS3, so we register
+    our own, ``mediacore_rank``, on each new connection. It scores each
+    result by the share of all occurrences of each term that appear in
+    that row, weighted by the column they appear in.
+    """
+
+    name = 'sqlite'
+    dialects = ('sqlite',)
+
+    def __init__(self, config, engine):
+        engine.pool.add_listener(_RankFunctionListener())
+
+    def search(self, query, index, search, bool=False, order_by=True):
+        required, optional, excluded = parse_search(search, bool)
+        if not required and not optional:
+            return query.filter(Media.id == None)
+        fts = _fts_table(index)
+        match = sql.literal_column(fts.name).op('MATCH')
+        if required:
+            terms = ' '.join(_fts_term(term) for term in required)
+        else:
+            terms = ' OR '.join(_fts_term(term) for term in optional)
+        relevance = sql.func.mediacore_rank(
+            sql.func.matchinfo(sql.literal_column(fts.name)),
+            ','.join(_fts_columns(index)),
+        ).label('relevance')
+        results = sql.select([fts.c.docid, relevance],
+                             match(sql.bindparam('fts_search', terms)))\
+            .alias('fts_results')
+        query = query.join((results, results.c.docid == Media.id))
+        if excluded:
+            # FTS3 only supports NOT in one of its two query syntaxes,
+            # so we exclude these results with a subquery instead.
+            terms = ' OR '.join(_fts_term(term) for term in excluded)
+            query = query.filter(~Media.id.in_(
+                sql.select([fts.c.docid],
+                           match(sql.bindparam('fts_exclude', terms)))
+            ))
+        if order_by:
+            query = query.order_by(None).order_by(results.c.relevance.desc())
+        return query
+
+    def update(self, media_ids, rows):
+        ids = ', '.join(str(int(media_id)) for media_id in media_ids)
+        for index in _fulltext_indexes:
+            table = _fts_table(index).name
+            columns = _fts_columns(index)
+            DBSession.execute('DELETE FROM %s WHERE docid IN (%s)'
+                              % (table, ids))
+            if rows:
+                DBSession.execute(sql.text(
+                    'INSERT INTO %s (docid, %s) VALUES (:media_id, %s)'
+                    % (table, ', '.join(columns),
+                       ', '.join(':' + col for col in columns))
+                ), rows)
+
+    def clear(self):
+        for index in _fulltext_indexes:
+            DBSession.execute('DELETE FROM %s' % _fts_table(index).name)
+
+AbstractSearchEngine.register(SQLiteSearchEngine)
+
+def _fts_term((word, is_prefix)):
+    return is_prefix and word + '*' or word
+
+def _rank(matchinfo, columns):
+    """Score a row from the default output of the FTS3 matchinfo function.
+
+    :param matchinfo: A blob of 32-bit unsigned ints: the number of
+        phrases and columns, and then for each phrase and column, the
+        number of hits in this row, the number of hits in all rows, and
+        the number of rows with at least one hit.
+    :param columns: The comma-separated column names of the FTS table.
+
+    """
+    matchinfo = str(matchinfo)
+    ints = struct.unpack('%dI' % (len(matchinfo) // 4), matchinfo)
+    phrase_count, column_count = ints[:2]
+    weights = [column_weights.get(col, 1.0) for col in columns.split(',')]
+    score = 0.0
+    for phrase in xrange(phrase_count):
+        for col in xrange(column_count):
+            offset = 2 + 3 * (phrase * column_count + col)
+            row_hits, all_hits = ints[offset:offset + 2]
+            if row_hits:
+                score += weights[col] * row_hits / float(all_hits)
+    return score
+
+class _RankFunctionListener(PoolListener):
+    def connect(self, dbapi_con, con_record):
+        dbapi_con.create_function('mediacore_rank', 2, _rank)
@@ -0,0 +1,523 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Sitemaps
+
+The Google video sitemap and the mRSS feed of the whole catalog are
+written to gzipped files on disk, to be served as they are by the
+:class:`~mediacore.controllers.sitemaps.SitemapsController`.
+
+The published media are split into shards by the month of their
+``publish_on`` date. Each month gets one or more sitemap files of up to
+:data:`_urls_per_file` URLs, and a fragment of the mRSS feed, which is
+stitched together with the others into ``mrss.xml.gz``. The sitemap
+index lists the shards, along with a shard of links to the main pages.
+
+A manifest records the number of published media in each month and the
+latest time one of them was modified. When a request finds the files
+older than the ``sitemaps_refresh`` config option (an hour by default),
+it queues a :class:`~mediacore.lib.jobs.UpdateSitemapsJob` and serves the
+files it has. The job compares the manifest with the database and only
+writes the months that differ again. Changes that don't touch the media
+row, like view counts, show up the next time their month is written.
+
+Each month is read in batches, paging by ``(publish_on, id)`` rather
+than by offset, and written out as it is read, so memory use doesn't
+depend on the size of the catalog.
+
+"""
+import gzip
+import logging
+import os
+import simplejson
+import tempfile
+import time
+
+from datetime import datetime
+from urlparse import urlsplit
+from xml.sax.saxutils import escape, quoteattr
+
+from paste.deploy.converters import asint
+from pylons import url
+from routes.util import URLGenerator
+from sqlalchemy import orm, sql
+
+from mediacore.lib.players import pick_any_media_file
+from mediacore.lib.thumbnails import thumb_url
+from mediacore.lib.util import url_for
+from mediacore.model import Media
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ['refresh_due', 'sitemap_file', 'sitemaps_written',
+           'update_sitemaps']
+
+_urls_per_file = 50000
+"""The most URLs a sitemap may list, according to sitemaps.org."""
+
+_batch_size = 500
+"""Media loaded from the database at a time."""
+
+_manifest_name = 'manifest.json'
+_queued_name = '.queued'
+_index_name = 'sitemap.xml.gz'
+_mrss_name = 'mrss.xml.gz'
+_links_page = '0'
+
+def sitemap_dir(config):
+    """Return the directory the sitemap files are written to."""
+    return config.get('sitemaps_dir') \
+        or os.path.join(config['cache_dir'], 'sitemaps')
+
+def sitemap_file(name, config):
+    """Return the path of the given sitemap file.
+
+    :param name: The file name, e.g. ``sitemap.xml.gz``.
+    :param config: The app config dict.
+    :returns: The absolute path, or None if there is no such file.
+
+    """
+    path = os.path.join(sitemap_dir(config), os.path.basename(name))
+    if not os.path.isfile(path):
+        return None
+    return path
+
+def sitemaps_written(config):
+    """Return True if the sitemaps have been written at least once."""
+    return os.path.exists(os.path.join(sitemap_dir(config), _manifest_name))
+
+def refresh_due(config):
+    """Return True if an update of the sitemaps should be queued now.
+
+    An update is due when the files are older than ``sitemaps_refresh``
+    and no update has been queued in that time. The time it's queued is
+    recorded, so that only one request in each period queues it.
+
+    :param config: The app config dict.
+    :rtype: bool
+
+    """
+    directory = sitemap_dir(config)
+    refresh = asint(config.get('sitemaps_refresh', 3600))
+    now = time.time()
+    for name in (_manifest_name, _queued_name):
+        try:
+            if now - os.path.getmtime(os.path.join(directory, name)) < refresh:
+                return False
+        except OSError:
+            pass
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    open(os.path.join(directory, _queued_name), 'w').close()
+    return True
+
+def update_sitemaps(config, host_url=None, script_name='', full=False,
+                    wait=False):
+    """Write the sitemap files for the months that have changed.
+
+    Only one process writes at a time. Unless ``wait`` is true, this
+    returns straight away if another process is already writing, and
+    the files it is replacing are served in the meantime.
+
+    :param config: The app config dict.
+    :param host_url: The scheme and host of the site, e.g.
+        ``http://example.com``, for the URLs in the files. By default the
+        URLs are generated for the current request.
+    :param script_name: The path the site is mounted at, if any.
+    :param full: Write every month, rather than those that changed.
+    :param wait: Wait for any other process to finish writing.
+
+    """
+    directory = sitemap_dir(config)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    lock = open(os.path.join(directory, '.lock'), 'w')
+    try:
+        if fcntl is not None:
+            flags = fcntl.LOCK_EX
+            if not wait:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock.fileno(), flags)
+            except IOError:
+                log.debug('The sitemaps are already being updated')
+                return
+        if host_url is None:
+            _update(directory, full)
+        else:
+            generator = URLGenerator(config['routes.map'],
+                                     _url_environ(host_url, script_name))
+            url._push_object(generator)
+            try:
+                _update(directory, full)
+            finally:
+                url._pop_object(generator)
+    finally:
+        # Also releases the lock
+        lock.close()
+
+def _url_environ(host_url, script_name):
+    """Return enough of a WSGI environ to generate URLs for the given site."""
+    scheme, host = urlsplit(host_url)[:2]
+    if ':' in host:
+        server_name, port = host.split(':', 1)
+    else:
+        server_name, port = host, scheme == 'https' and '443' or '80'
+    return {
+        'wsgi.url_scheme': scheme,
+        'HTTP_HOST': host,
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': port,
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': '/',
+    }
+
+def _update(directory, full):
+    manifest = _read_manifest(directory)
+    base_url = url_for('/', qualified=True)
+    if manifest.get('base_url') != base_url:
+        # Every URL in the files would be wrong
+        full = True
+    old_months = manifest.get('months', {})
+    months = {}
+    for month, fingerprint in _fingerprints().iteritems():
+        old = old_months.get(month)
+        fragment = os.path.join(directory, _fragment_name(month))
+        if full or old is None or old['fingerprint'] != fingerprint \
+        or not os.path.exists(fragment):
+            log.debug('Writing the sitemaps for %s', month)
+            pages = _write_month(directory, month)
+        else:
+            pages = old['pages']
+        months[month] = {'fingerprint': fingerprint, 'pages': pages}
+
+    changed = full or months != old_months
+    if changed or not os.path.exists(os.path.join(directory, _index_name)):
+        _write_links(directory)
+        _write_index(directory, months)
+        _write_mrss(directory, months)
+        for month, old in old_months.iteritems():
+            pages = months.get(month, {}).get('pages', [])
+            _remove_files(directory, [_sitemap_name(page)
+                                      for page in old['pages']
+                                      if page not in pages])
+            if month not in months:
+                _remove_files(directory, [_fragment_name(month)])
+
+    # Written even when nothing changed, to mark when we last looked
+    _write_file(os.path.join(directory, _manifest_name),
+                [simplejson.dumps({'base_url': base_url, 'months': months})])
+
+def _read_manifest(directory):
+    try:
+        fp = open(os.path.join(directory, _manifest_name), 'rb')
+    except IOError:
+        return {}
+    try:
+        try:
+            return simplejson.loads(fp.read())
+        except ValueError:
+            return {}
+    finally:
+        fp.close()
+
+def _fingerprints():
+    """Return the count and latest modification of each month's media."""
+    year = sql.extract('year', Media.publish_on)
+    month = sql.extract('month', Media.publish_on)
+    rows = Media.query.published().order_by(None)\
+        .group_by(year, month)\
+        .values(year, month, sql.func.count(Media.id),
+                sql.func.max(Media.modified_on))
+    fingerprints = {}
+    for year, month, count, modified_on in rows:
+        # Some databases return the parts of the date as floats
+        fingerprints['%04d%02d' % (int(year), int(month))] = \
+            [int(count), modified_on.strftime('%Y-%m-%dT%H:%M:%S')]
+    return fingerprints
+
+def _month_media(month):
+    """Yield the published media of the given month, newest first."""
+    start = datetime.strptime(month, '%Y%m')
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    query = Media.query.published()\
+        .filter(Media.publish_on >= start)\
+        .filter(Media.publish_on < end)\
+        .options(orm.subqueryload('files'),
+                 orm.subqueryload('tags'),
+                 orm.subqueryload('categories'))\
+        .order_by(Media.publish_on.desc(), Media.id.desc())
+    last = None
+    while True:
+        batch = query
+        if last is not None:
+            publish_on, media_id = last
+            batch = batch.filter(sql.or_(
+                Media.publish_on < publish_on,
+                sql.and_(Media.publish_on == publish_on,
+                         Media.id < media_id),
+            ))
+        batch = batch.limit(_batch_size).all()
+        for media in batch:
+            yield media
+        if len(batch) < _batch_size:
+            break
+        last = (batch[-1].publish_on, batch[-1].id)
+
+def _write_month(directory, month):
+    """Write the sitemaps and mRSS fragment for a month.
+
+    :returns: The sitemap page names that were written.
+
+    """
+    pages = []
+    part = 0
+    sitemap = None
+    fragment = _AtomicFile(os.path.join(directory, _fragment_name(month)))
+    try:
+        count = 0
+        for media in _month_media(month):
+            file = pick_any_media_file(media)
+            if file is None:
+                continue
+            if sitemap is None or count == _urls_per_file:
+                if sitemap is not None:
+                    sitemap.write(_urlset_end)
+                    sitemap.commit()
+                page = '%s%02d' % (month, part)
+                part += 1
+                count = 0
+                sitemap = _AtomicFile(
+                    os.path.join(directory, _sitemap_name(page)), gzipped=True)
+                sitemap.write(_urlset_start)
+                pages.append(page)
+            sitemap.write(_sitemap_url(media, file))
+            fragment.write(_mrss_item(media, file))
+            count += 1
+        if sitemap is not None:
+            sitemap.write(_urlset_end)
+            sitemap.commit()
+        fragment.commit()
+    finally:
+        if sitemap is not None:
+            sitemap.discard()
+        fragment.discard()
+    return pages
+
+def _write_links(directory):
+    links = [
+        url_for(controller='/', qualified=True),
+        url_for(controller='/media', show='popular', qualified=True),
+        url_for(controller='/media', show='latest', qualified=True),
+        url_for(controller='/categories', qualified=True),
+    ]
+    chunks = [_urlset_start]
+    chunks.extend('<url><loc>%s</loc></url>\n' % escape(link)
+                  for link in links)
+    chunks.append(_urlset_end)
+    _write_file(os.path.join(directory, _sitemap_name(_links_page)), chunks,
+                gzipped=True)
+
+def _write_index(directory, months):
+    chunks = ['<?xml version="1.0" encoding="utf-8"?>\n'
+              '<sitemapindex '
+              'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+              _index_entry(_links_page)]
+    for month in sorted(months, reverse=True):
+        lastmod = months[month]['fingerprint'][1][:10]
+        for page in months[month]['pages']:
+            chunks.append(_index_entry(page, lastmod))
+    chunks.append('</sitemapindex>\n')
+    _write_file(os.path.join(directory, _index_name), chunks, gzipped=True)
+
+def _write_mrss(directory, months):
+    mrss = _AtomicFile(os.path.join(directory, _mrss_name), gzipped=True)
+    try:
+        mrss.write(_mrss_start % {
+            'link': escape(url_for(controller='/media', qualified=True)),
+            'self': quoteattr(url_for(controller='/sitemaps', action='mrss',
+                                      qualified=True)),
+        })
+        for month in sorted(months, reverse=True):
+            fp = open(os.path.join(directory, _fragment_name(month)), 'rb')
+            try:
+                while True:
+                    data = fp.read(65536)
+                    if not data:
+                        break
+                    mrss.write(data)
+            finally:
+                fp.close()
+        mrss.write(_mrss_end)
+        mrss.commit()
+    finally:
+        mrss.discard()
+
+def _sitemap_name(page):
+    return 'sitemap%s.xml.gz' % page
+
+def _fragment_name(month):
+    return 'mrss-%s.part' % month
+
+def _remove_files(directory, names):
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+###############################################################################
+
+_urlset_start = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                 '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+                 'xmlns:video="http://www.google.com/schemas/sitemap-video/1.1">\n')
+_urlset_end = '</urlset>\n'
+
+_mrss_start = ('<?xml version="1.0" encoding="utf-8"?>\n'
+               '<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/" '
+               'xmlns:atom="http://www.w3.org/2005/Atom">\n'
+               '<channel>\n'
+               '<title>MediaRSS Sitemap</title>\n'
+               '<link>%(link)s</link>\n'
+               '<atom:link href=%(self)s rel="self" type="application/rss+xml" />\n')
+_mrss_end = '</channel>\n</rss>\n'
+
+def _date(value):
+    return value.strftime('%a, %d %b %Y %H:%M:%S') + ' +0000'
+
+def _element(name, value):
+    if value is None:
+        return u''
+    return u'<%s>%s</%s>' % (name, escape(unicode(value)), name)
+
+def _index_entry(page, lastmod=None):
+    loc = url_for(controller='/sitemaps', action='google', page=page,
+                  qualified=True)
+    entry = u'<sitemap>%s%s</sitemap>\n' % (
+        _element('loc', loc),
+        lastmod and _element('lastmod', lastmod) or u'',
+    )
+    return entry.encode('utf-8')
+
+def _sitemap_url(media, file):
+    parts = [
+        _element('video:content_loc', url_for(controller='/media',
+            action='serve', id=file.id, container=file.container,
+            slug=media.slug, qualified=True)),
+        _element('video:thumbnail_loc', thumb_url(media, 'l', qualified=True)),
+        _element('video:title', media.title),
+        _element('video:description', media.description_plain),
+        _element('video:view_count', media.views),
+        _element('video:publication_date', _date(media.publish_on)),
+    ]
+    if media.publish_until:
+        parts.append(_element('video:expiration_date',
+                              _date(media.publish_until)))
+    for tag in media.tags[:32]:
+        parts.append(_element('video:tag', tag.name))
+    for category in media.categories[:1]:
+        parts.append(_element('video:tag', category.name))
+    parts.append(_element('video:duration', media.duration))
+    loc = url_for(controller='/media', action='view', id=file.id,
+                  slug=media.slug, qualified=True)
+    url = u'<url>%s<video:video>%s</video:video></url>\n' % (
+        _element('loc', loc), u''.join(parts))
+    return url.encode('utf-8')
+
+def _mrss_item(media, file):
+    link = url_for(controller='/media', action='view', slug=media.slug,
+                   qualified=True)
+    serve_url = url_for(controller='/media', action='serve', id=file.id,
+                        container=file.container, slug=media.slug,
+                        qualified=True)
+    parts = [
+        _element('title', media.title),
+        _element('link', link),
+        _element('guid', link),
+        _element('pubDate', _date(media.publish_on)),
+        _element('description', media.description_plain),
+        u'<media:thumbnail url=%s />' % quoteattr(
+            thumb_url(media, 'l', qualified=True)),
+        u'<media:content url=%s%s />' % (quoteattr(serve_url),
+            media.duration and u' duration="%d"' % media.duration or u''),
+        u'<media:community><media:statistics views="%d" />%s'
+        u'</media:community>' % (media.views, media.tags and
+            _element('media:tags', u', '.join(t.name for t in media.tags))
+            or u''),
+    ]
+    for category in media.categories[:1]:
+        parts.append(_element('media:category', category.name))
+    item = u'<item>%s</item>\n' % u''.join(parts)
+    return item.encode('utf-8')
+
+###############################################################################
+
+class _AtomicFile(object):
+    """Write a file under a temporary name, then rename it into place."""
+
+    def __init__(self, path, gzipped=False):
+        self.path = path
+        fd, self.temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.tmp-')
+        self._fp = os.fdopen(fd, 'wb')
+        self._closed = False
+        if gzipped:
+            self._out = gzip.GzipFile(os.path.basename(path)[:-3], 'wb',
+                                      fileobj=self._fp)
+        else:
+            self._out = self._fp
+
+    def write(self, data):
+        self._out.write(data)
+
+    def commit(self):
+        self._close()
+        os.chmod(self.temp_path, 0644)
+        os.rename(self.temp_path, self.path)
+        self.temp_path = None
+
+    def discard(self):
+        """Remove the temporary file, unless it has been committed."""
+        if self.temp_path is not None:
+            self._close()
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
+            self.temp_path = None
+
+    def _close(self):
+        if not self._closed:
+            self._closed = True
+            if self._out is not self._fp:
+                self._out.close()
+            self._fp.close()
+
+def _write_file(path, chunks, gzipped=False):
+    out = _AtomicFile(path, gzipped)
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+        out.commit()
+    finally:
+        out.discard()
@@ -16,12 +16,15 @@
 import logging
 import os
 import re
+import socket
+import sys
 
 from cStringIO import StringIO
 from operator import attrgetter
-from urllib2 import URLError, urlopen
+from urllib2 import Request, URLError, urlopen
 
-from pylons import app_globals
+from paste.deploy.converters import asint
+from pylons import app_globals, config
 from pylons.i18n import _
 
 from mediacore.lib.compat import defaultdict
@@ -65,6 +68,11 @@ class StorageEngine(AbstractClass):
     settings_form_class = None
     """Your :class:`mediacore.forms.Form` class for changing :attr:`_data`."""
 
+    uris_expire = False
+    """A flag that indicates whether the URIs from :meth:`get_uris` stop
+    working after a while, for example because they are signed. If so,
+    they are built again for each page instead of being cached."""
+
     _default_data = {}
     """The default data dictionary to create from the start.
 
@@ -334,12 +342,9 @@ def add_new_media_file(media, file=None, url=None):
         stored with any of the registered storage engines.
 
     """
-    engines = DBSession.query(StorageEngine)\
-        .filter(StorageEngine.enabled == True)\
-        .all()
-    sorted_engines = list(sort_engines(engines))
+    sorted_engines = enabled_engines()
 
-    for engine in sorted_engines:
+    for engine in candidate_engines(sorted_engines, file, url):
         try:
             meta = engine.parse(file=file, url=url)
             log.debug('Engine %r returned meta %r', engine, meta)
@@ -391,9 +396,7 @@ def add_new_media_file(media, file=None, url=None):
 
             # Download the image to a buffer and wrap it as a file-like object
             try:
-                temp_img = urlopen(thumb_url)
-                thumb_file = StringIO(temp_img.read())
-                temp_img.close()
+                thumb_file = StringIO(fetch_url(thumb_url))
             except URLError, e:
                 log.exception(e)
 
@@ -417,6 +420,78 @@ def add_new_media_file(media, file=None, url=None):
 
     return mf
 
+_engines_expire = 600
+"""Seconds that the sorted list of enabled engines is cached for.
+
+Saving an engine discards the cached list straight away, but only in the
+process that saved it; this bounds how long the others may lag behind.
+
+"""
+
+def _engines_cache():
+    return app_globals.cache.get_cache('storage_engines', type='memory',
+                                       expire=_engines_expire)
+
+def _query_enabled_engines():
+    engines = DBSession.query(StorageEngine)\
+        .filter(StorageEngine.enabled == True)\
+        .all()
+    return list(sort_engines(engines))
+
+def enabled_engines():
+    """Return the enabled storage engines, in the order to try them in.
+
+    Only the IDs of the topologically sorted engines are cached, so the
+    instances returned always belong to the current session. Within a
+    session they come straight from the identity map, so a bulk import
+    only loads the engines once.
+
+    :rtype: list
+    :returns: :class:`StorageEngine` instances, as sorted by
+        :func:`sort_engines`.
+
+    """
+    try:
+        cache = _engines_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup.
+        return _query_enabled_engines()
+    def sorted_engine_ids():
+        return tuple(engine.id for engine in _query_enabled_engines())
+    engine_ids = cache.get(createfunc=sorted_engine_ids, key='enabled')
+    query = DBSession.query(StorageEngine)
+    engines = [query.get(engine_id) for engine_id in engine_ids]
+    # Another process may have disabled or deleted an engine since
+    return [engine for engine in engines
+            if engine is not None and engine.enabled]
+
+def discard_engines():
+    """Discard the cached list of enabled engines."""
+    try:
+        cache = _engines_cache()
+    except TypeError:
+        return
+    cache.clear()
+
+def candidate_engines(engines, file=None, url=None):
+    """Yield the engines that might be able to parse the given input.
+
+    An :class:`EmbedStorageEngine` only ever accepts a URL that matches
+    its :attr:`~EmbedStorageEngine.url_pattern`, so rather than calling
+    :meth:`~StorageEngine.parse` on each of them in turn, the URL is
+    routed straight to the one that matches. All other engines are
+    yielded as they are, keeping the order of ``engines``.
+
+    :type engines: list
+    :param engines: Sorted instances of :class:`StorageEngine`.
+
+    """
+    for engine in engines:
+        if isinstance(engine, EmbedStorageEngine):
+            if url is None or engine.url_pattern.match(url) is None:
+                continue
+        yield engine
+
 def sort_engines(engines):
     """Yield a topological sort of the given list of engines.
 
@@ -465,6 +540,68 @@ def sort_engines(engines):
         for engine in output_instances:
             yield engine
 
+def _fetch_cache():
+    data_dir = config.get('embed_cache_dir') \
+        or os.path.join(config['cache_dir'], 'embed')
+    expire = asint(config.get('embed_cache_expire', 86400))
+    return app_globals.cache.get_cache('embed_fetch', type='dbm',
+                                       data_dir=data_dir, expire=expire)
+
+def fetch_url(url, headers=None):
+    """Return the body of the given remote URL, from a cache on disk.
+
+    This is for the metadata APIs and thumbnails of embedded media, so
+    that adding the same video twice only fetches it once. Each request
+    gives up after ``embed_fetch_timeout`` seconds (10 by default), and
+    responses are kept for ``embed_cache_expire`` seconds (a day by
+    default). The cache is shared by all processes using the same
+    ``cache_dir``, and it holds a lock on each URL while fetching it,
+    so concurrent requests for the same URL only fetch it once.
+
+    :type url: unicode
+    :param url: A remote URL string.
+    :type headers: dict or None
+    :param headers: Any extra HTTP request headers.
+    :rtype: str
+    :returns: The response body.
+    :raises URLError: If the URL can't be fetched in time. Failures are
+        not cached.
+
+    """
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    def fetch():
+        timeout = asint(config.get('embed_fetch_timeout', 10))
+        try:
+            response = _urlopen(Request(url, headers=headers or {}), timeout)
+            try:
+                return response.read()
+            finally:
+                response.close()
+        except socket.error, e:
+            # Includes timeouts while reading the response
+            raise URLError(e)
+    try:
+        cache = _fetch_cache()
+    except TypeError:
+        # No app_globals outside of the app, e.g. in websetup.
+        return fetch()
+    return cache.get(createfunc=fetch, key=url)
+
+def _urlopen(request, timeout):
+    """Open the URL, giving up on connecting after the given seconds."""
+    if sys.version_info >= (2, 6):
+        return urlopen(request, timeout=timeout)
+    # Python 2.5's urlopen has no timeout argument. Sockets take the
+    # default timeout when they're created, so set it just for this one.
+    # Sockets opened by other threads in the meantime get it too.
+    default = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(timeout)
+    try:
+        return urlopen(request)
+    finally:
+        socket.setdefaulttimeout(default)
+
 def get_file_size(file):
     if hasattr(file, 'fileno'):
         size = os.fstat(file.fileno())[6]
@@ -522,4 +659,15 @@ from mediacore.lib.storage.youtube import YoutubeStorage
 from mediacore.lib.storage.vimeo import VimeoStorage
 from mediacore.lib.storage.bliptv import BlipTVStorage
 from mediacore.lib.storage.googlevideo import GoogleVideoStorage
-from mediacore.model import DBSession, MediaFile
+from mediacore.model import DBSession, MediaFile, after_commit_hook
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+@after_commit_hook
+def _discard_committed(keys):
+    discard_engines()
+
+@observes(events.StorageEngine.after_insert, events.StorageEngine.after_update,
+          events.StorageEngine.after_delete)
+def _engine_changed(instance):
+    _discard_committed.add(instance.id)
@@ -16,7 +16,7 @@
 import logging
 import re
 
-from urllib2 import Request, urlopen, URLError
+from urllib2 import URLError
 
 # FIXME: This does not exist in py2.4
 from xml.etree import ElementTree
@@ -25,7 +25,7 @@ from pylons.i18n import N_
 
 from mediacore.lib.filetypes import VIDEO
 from mediacore.lib.storage import (EmbedStorageEngine, StorageURI,
-    UnsuitableEngineError)
+    UnsuitableEngineError, fetch_url)
 
 log = logging.getLogger(__name__)
 
@@ -51,19 +51,13 @@ class BlipTVStorage(EmbedStorageEngine):
         :returns: Any extracted metadata.
 
         """
-        req = Request('http://blip.tv/file/%s?skin=api' % id)
-
         try:
-            temp_data = urlopen(req)
-            try:
-                xmltree = ElementTree.parse(temp_data)
-            finally:
-                temp_data.close()
+            data = fetch_url('http://blip.tv/file/%s?skin=api' % id)
         except URLError, e:
             log.exception(e)
             raise
 
-        root = xmltree.getroot()
+        root = ElementTree.fromstring(data)
         asset = root.find('payload/asset')
         log.debug('xml %r', root)
         meta = {'type': VIDEO}
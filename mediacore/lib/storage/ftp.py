@@ -13,14 +13,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import ftplib
 import logging
 import os
+import posixpath
+import threading
+import time
 
 from ftplib import FTP
 from urllib2 import URLError, urlopen
 
 from formencode import Invalid
-from pylons.i18n import N_
+from paste.deploy.converters import asbool
+from pylons import config
+from pylons.i18n import N_, _
 
 from mediacore.lib.compat import sha1
 from mediacore.lib.storage import (safe_file_name, StorageURI,
@@ -33,15 +39,110 @@ FTP_USERNAME = 'ftp_username'
 FTP_PASSWORD = 'ftp_password'
 FTP_UPLOAD_DIR = 'ftp_upload_dir'
 FTP_MAX_INTEGRITY_RETRIES = 'ftp_max_integrity_retries'
+FTP_BACKGROUND_TRANSFER = 'ftp_background_transfer'
 
 HTTP_DOWNLOAD_URI = 'http_download_uri'
 RTMP_SERVER_URI = 'rtmp_server_uri'
 
+_block_size = 65536
+"""Bytes sent or hashed at a time."""
+
+_first_retry_delay = 1
+"""Seconds to wait before the first retry of the integrity check.
+
+The delay doubles with each retry, up to :data:`_max_retry_delay`.
+Akamai, for example, usually takes 3-15 seconds to make an uploaded
+file available over HTTP."""
+
+_max_retry_delay = 30
+
 from mediacore.forms.admin.storage.ftp import FTPStorageForm
 
 class FTPUploadError(Invalid):
     pass
 
+class FTPConnectionPool(object):
+    """
+    Keep logged in FTP sessions for reuse.
+
+    Logging in can take longer than sending a small file, so sessions are
+    kept open between transfers, up to ``max_idle`` per server and user.
+    A session that has been idle for more than ``max_idle_time`` seconds
+    is checked with a NOOP before it is reused, since the server may have
+    timed it out.
+
+    Sessions are only ever used by one thread at a time. After a fork,
+    the child process opens sessions of its own.
+    """
+
+    def __init__(self, max_idle=4, max_idle_time=60):
+        self.max_idle = max_idle
+        self.max_idle_time = max_idle_time
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def acquire(self, login):
+        """Return a logged in session, reusing an idle one if possible.
+
+        :param login: A ``(server, user, password)`` tuple.
+
+        """
+        while True:
+            idle = self._pop(login)
+            if idle is None:
+                return FTP(*login)
+            ftp, released_on = idle
+            if time.time() - released_on < self.max_idle_time:
+                return ftp
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except ftplib.all_errors:
+                self._close(ftp)
+
+    def release(self, login, ftp, reuse=True):
+        """Return a session to the pool, or close it.
+
+        :param login: The ``(server, user, password)`` it was acquired for.
+        :param reuse: False if the session may be in a bad state, for
+            example after an error.
+
+        """
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            idle = self._idle.setdefault(login, [])
+            if reuse and len(idle) < self.max_idle:
+                idle.append((ftp, time.time()))
+                return
+        finally:
+            self._lock.release()
+        self._close(ftp)
+
+    def _pop(self, key):
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            idle = self._idle.get(key, None)
+            return idle and idle.pop() or None
+        finally:
+            self._lock.release()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # The sockets belong to the parent process
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def _close(self, ftp):
+        try:
+            ftp.quit()
+        except ftplib.all_errors:
+            ftp.close()
+
+_pool = FTPConnectionPool()
+
 class FTPStorage(FileStorageEngine):
 
     engine_type = u'FTPStorage'
@@ -58,6 +159,7 @@ class FTPStorage(FileStorageEngine):
         FTP_PASSWORD: '',
         FTP_UPLOAD_DIR: '',
         FTP_MAX_INTEGRITY_RETRIES: 0,
+        FTP_BACKGROUND_TRANSFER: False,
         HTTP_DOWNLOAD_URI: '',
         RTMP_SERVER_URI: '',
     }
@@ -65,6 +167,10 @@ class FTPStorage(FileStorageEngine):
     def store(self, media_file, file=None, url=None, meta=None):
         """Store the given file or URL and return a unique identifier for it.
 
+        If background transfers are enabled, the file is spooled and sent
+        by a :class:`~mediacore.lib.jobs.StorageTransferJob` once the
+        request is over. Until then, its URLs will not work.
+
         :type media_file: :class:`~mediacore.model.media.MediaFile`
         :param media_file: The associated media file object.
 
@@ -83,28 +189,60 @@ class FTPStorage(FileStorageEngine):
         :raises FTPUploadError: If storing the file fails.
 
         """
-        file_name = safe_file_name(media_file, file.filename)
+        if not asbool(self._data.get(FTP_BACKGROUND_TRANSFER, False)):
+            return self.transfer(media_file, file)
+
+        from mediacore.lib.jobs import StorageTransferJob, enqueue, spool_upload
+        path = spool_upload(file, config)
+        enqueue(StorageTransferJob.type, media_file.media,
+                media_file_id=media_file.id, path=path,
+                filename=file.filename)
+        return safe_file_name(media_file, file.filename)
+
+    def transfer(self, media_file, file):
+        """Upload the given file to the FTP server.
+
+        The file is hashed as it is sent, and if an integrity check is
+        configured, the copy on the HTTP server is hashed as it downloads.
 
+        :type media_file: :class:`~mediacore.model.media.MediaFile`
+        :param media_file: The associated media file object.
+
+        :type file: :class:`cgi.FieldStorage`
+        :param file: The file to upload.
+
+        :rtype: unicode
+        :returns: The unique ID string.
+
+        :raises FTPUploadError: If storing the file fails.
+
+        """
+        file_name = safe_file_name(media_file, file.filename)
         file_url = os.path.join(self._data[HTTP_DOWNLOAD_URI], file_name)
-        upload_dir = self._data[FTP_UPLOAD_DIR]
-        stor_cmd = 'STOR ' + file_name
+        digest = sha1()
 
         ftp = self._connect()
+        reuse = False
         try:
-            if upload_dir:
-                ftp.cwd(upload_dir)
-            ftp.storbinary(stor_cmd, file)
-
-            # Raise a FTPUploadError if the file integrity check fails
-            # TODO: Delete the file if the integrity check fails
-            self._verify_upload_integrity(file, file_url)
-        except FTP.all_errors, e:
+            file.file.seek(0)
+            ftp.storbinary('STOR ' + self._remote_path(file_name),
+                           file.file, _block_size, digest.update)
+            reuse = True
+        except ftplib.all_errors, e:
             log.exception(e)
             msg = _('Could not upload the file from your FTP server: %s')\
-                % e.message
+                % e
             raise FTPUploadError(msg, None, None)
         finally:
-            ftp.quit()
+            self._disconnect(ftp, reuse)
+
+        # Raise a FTPUploadError if the file integrity check fails
+        try:
+            self._verify_upload_integrity(digest.hexdigest(), file_url)
+        except FTPUploadError:
+            self._delete(file_name)
+            raise
+        return file_name
 
     def delete(self, media_file):
         """Delete the stored file represented by the given unique ID.
@@ -119,18 +257,7 @@ class FTPStorage(FileStorageEngine):
         :returns: True if successful, False if an error occurred.
 
         """
-        upload_dir = self._data[FTP_UPLOAD_DIR]
-        ftp = self._connect()
-        try:
-            if upload_dir:
-                ftp.cwd(upload_dir)
-            ftp.delete(media_file.unique_id)
-            return True
-        except FTP.all_errors, e:
-            log.exception(e)
-            return False
-        finally:
-            ftp.quit()
+        return self._delete(media_file.unique_id)
 
     def get_uris(self, file):
         """Return a list of URIs from which the stored file can be accessed.
@@ -146,17 +273,45 @@ class FTPStorage(FileStorageEngine):
             uris.append(StorageURI(file, 'rtmp', file.unique_id, rtmp_server))
         return uris
 
-    def _connect(self):
-        """Open a connection to the FTP server."""
+    def _login(self):
         data = self._data
-        return FTP(data[FTP_SERVER], data[FTP_USERNAME], data[FTP_PASSWORD])
+        return data[FTP_SERVER], data[FTP_USERNAME], data[FTP_PASSWORD]
+
+    def _connect(self):
+        """Get a session with the FTP server from the pool."""
+        return _pool.acquire(self._login())
 
-    def _verify_upload_integrity(self, file, file_url):
+    def _disconnect(self, ftp, reuse=True):
+        """Return the session to the pool."""
+        _pool.release(self._login(), ftp, reuse)
+
+    def _remote_path(self, file_name):
+        upload_dir = self._data[FTP_UPLOAD_DIR]
+        if upload_dir:
+            return posixpath.join(upload_dir, file_name)
+        return file_name
+
+    def _delete(self, file_name):
+        ftp = self._connect()
+        reuse = False
+        try:
+            ftp.delete(self._remote_path(file_name))
+            reuse = True
+            return True
+        except ftplib.all_errors, e:
+            log.exception(e)
+            return False
+        finally:
+            self._disconnect(ftp, reuse)
+
+    def _verify_upload_integrity(self, orig_hash, file_url):
         """Download the given file from the URL and compare the SHA1s.
 
-        :type file: :class:`cgi.FieldStorage`
-        :param file: A freshly uploaded file object, that has just been
-            sent to the FTP server.
+        The file is hashed as it downloads, so memory use doesn't depend
+        on its size. Failed downloads are retried with exponential backoff.
+
+        :type orig_hash: str
+        :param orig_hash: The hex SHA1 of the file that was uploaded.
 
         :type file_url: str
         :param file_url: A publicly accessible URL where the uploaded file
@@ -169,25 +324,19 @@ class FTPStorage(FileStorageEngine):
             doesn't match the original.
 
         """
-        max_tries = int(self._data[FTP_MAX_INTEGRITY_RETRIES])
+        max_tries = int(self._data[FTP_MAX_INTEGRITY_RETRIES] or 0)
         if max_tries < 1:
             return True
 
-        file.seek(0)
-        orig_hash = sha1(file.read()).hexdigest()
-
-        # Try to download the file. Increase the number of retries, or the
-        # timeout duration, if the server is particularly slow.
-        # eg: Akamai usually takes 3-15 seconds to make an uploaded file
-        #     available over HTTP.
+        delay = _first_retry_delay
         for i in xrange(max_tries):
             try:
-                temp_file = urlopen(file_url)
-                dl_hash = sha1(temp_file.read()).hexdigest()
-                temp_file.close()
-            except HTTPError, http_err:
+                dl_hash = _download_hash(file_url)
+            except URLError, http_err:
                 # Don't raise the exception now, wait until all attempts fail
-                time.sleep(3)
+                if i + 1 < max_tries:
+                    time.sleep(delay)
+                    delay = min(delay * 2, _max_retry_delay)
             else:
                 # If the downloaded file matches, success! Otherwise, we can
                 # be pretty sure that it got corrupted during FTP transfer.
@@ -200,7 +349,21 @@ class FTPStorage(FileStorageEngine):
 
         # Raise the exception from the last download attempt
         msg = _('Could not download the file from your FTP server: %s')\
-            % http_err.message
+            % http_err
         raise FTPUploadError(msg, None, None)
 
+def _download_hash(url):
+    """Return the hex SHA1 of the file at the given URL."""
+    digest = sha1()
+    remote = urlopen(url)
+    try:
+        while True:
+            data = remote.read(_block_size)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        remote.close()
+    return digest.hexdigest()
+
 FileStorageEngine.register(FTPStorage)
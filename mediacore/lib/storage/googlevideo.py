@@ -17,7 +17,7 @@ import logging
 import re
 import simplejson
 
-from urllib2 import Request, urlopen, URLError
+from urllib2 import URLError
 
 from pylons.i18n import N_
 
@@ -26,7 +26,7 @@ from mediacore.lib.compat import max
 from mediacore.lib.filetypes import VIDEO
 from mediacore.lib.xhtml import decode_entities
 from mediacore.lib.storage import (EmbedStorageEngine, StorageURI,
-    UnsuitableEngineError)
+    UnsuitableEngineError, fetch_url)
 
 log = logging.getLogger(__name__)
 
@@ -68,9 +68,7 @@ class GoogleVideoStorage(EmbedStorageEngine):
 
         # Fetch the video title from the main video player page
         try:
-            temp_data = urlopen(google_play_url)
-            data = temp_data.read()
-            temp_data.close()
+            data = fetch_url(google_play_url)
         except URLError, e:
             log.exception(e)
         else:
@@ -80,9 +78,7 @@ class GoogleVideoStorage(EmbedStorageEngine):
 
         # Fetch the meta data from a MediaRSS feed for this video
         try:
-            temp_data = urlopen(google_data_url)
-            data = temp_data.read()
-            temp_data.close()
+            data = fetch_url(google_data_url)
         except URLError, e:
             log.exception(e)
         else:
@@ -59,6 +59,13 @@ class LocalFileStorage(FileStorageEngine):
         file_name = safe_file_name(media_file, file.filename)
         file_path = self._get_path(media_file, file_name)
 
+        # Files that were spooled for a background job can be linked into
+        # place, so that large files aren't written to disk a second time.
+        spooled_path = getattr(file, 'path', None)
+        if spooled_path and _link(spooled_path, file_path):
+            file.file.close()
+            return file_name
+
         temp_file = file.file
         temp_file.seek(0)
         permanent_file = open(file_path, 'wb')
@@ -125,3 +132,15 @@ class LocalFileStorage(FileStorageEngine):
         return os.path.join(basepath, unique_id or media_file.unique_id)
 
 FileStorageEngine.register(LocalFileStorage)
+
+def _link(src, dst):
+    """Hard link src to dst, returning False if that isn't possible.
+
+    Linking fails when the paths are on different filesystems, or on
+    platforms without hard links, in which case the file must be copied.
+    """
+    try:
+        os.link(src, dst)
+    except (AttributeError, OSError):
+        return False
+    return True
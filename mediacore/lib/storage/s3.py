@@ -12,12 +12,65 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Amazon S3 Storage
 
-from pylons.i18n import N_
+Files are streamed to an S3 bucket, or any service with an S3-compatible
+API such as MinIO, using the optional `boto <http://boto.cloudhackers.com/>`_
+library. Files larger than one part are sent as a multipart upload, with
+several parts in flight at once. Only those parts are held in memory, so
+memory use doesn't depend on the size of the file.
 
-from mediacore.lib.filetypes import guess_container_format, guess_media_type
-from mediacore.lib.storage import (get_file_size, StorageURI, FileStorageEngine,
-    UnsuitableEngineError)
+"""
+import logging
+import threading
+
+from cStringIO import StringIO
+from urllib import quote
+
+from pylons.i18n import N_, _
+
+from mediacore.lib.compat import ThreadPool
+from mediacore.lib.filetypes import guess_mimetype
+from mediacore.lib.storage import (safe_file_name, StorageError, StorageURI,
+    FileStorageEngine, UnsuitableEngineError)
+
+try:
+    from boto.exception import BotoClientError, BotoServerError
+    from boto.s3.connection import OrdinaryCallingFormat, S3Connection
+    from boto.s3.multipart import MultiPartUpload
+except ImportError:
+    S3Connection = None
+
+log = logging.getLogger(__name__)
+
+S3_ACCESS_KEY = 's3_access_key'
+S3_SECRET_KEY = 's3_secret_key'
+S3_BUCKET = 's3_bucket'
+S3_HOST = 's3_host'
+S3_PORT = 's3_port'
+S3_SECURE = 's3_secure'
+S3_KEY_PREFIX = 's3_key_prefix'
+S3_URL_EXPIRES = 's3_url_expires'
+CLOUDFRONT_HTTP = 'cloudfront_http'
+CLOUDFRONT_RTMP = 'cloudfront_rtmp'
+
+DEFAULT_HOST = 's3.amazonaws.com'
+
+MIN_URL_EXPIRES = 7200
+"""The shortest time signed URLs are made to last, in seconds. Signed URLs
+are never cached, but players request them again to seek, so they have
+to outlast playback."""
+
+_part_size = 8 * 1024 * 1024
+"""Bytes per part of a multipart upload. S3 requires at least 5MB."""
+
+_parts_in_flight = 4
+"""How many parts of a multipart upload are sent at once."""
+
+_connections = threading.local()
+
+from mediacore.forms.admin.storage.s3 import AmazonS3StorageForm
 
 class AmazonS3Storage(FileStorageEngine):
 
@@ -26,6 +79,21 @@ class AmazonS3Storage(FileStorageEngine):
 
     default_name = N_(u'Amazon S3')
 
+    settings_form_class = AmazonS3StorageForm
+
+    _default_data = {
+        S3_ACCESS_KEY: '',
+        S3_SECRET_KEY: '',
+        S3_BUCKET: '',
+        S3_HOST: '',
+        S3_PORT: None,
+        S3_SECURE: True,
+        S3_KEY_PREFIX: '',
+        S3_URL_EXPIRES: 0,
+        CLOUDFRONT_HTTP: '',
+        CLOUDFRONT_RTMP: '',
+    }
+
     def parse(self, file=None, url=None):
         """Return metadata for the given file or raise an error.
 
@@ -38,9 +106,10 @@ class AmazonS3Storage(FileStorageEngine):
         :raises UnsuitableEngineError: If file information cannot be parsed.
 
         """
-        if file is None:
+        if S3Connection is None:
+            log.warn('Amazon S3 Storage requires boto, which is not installed.')
             raise UnsuitableEngineError
-        raise NotImplementedError
+        return FileStorageEngine.parse(self, file=file, url=url)
 
     def store(self, media_file, file=None, url=None, meta=None):
         """Store the given file or URL and return a unique identifier for it.
@@ -55,9 +124,66 @@ class AmazonS3Storage(FileStorageEngine):
         :param meta: The metadata returned by :meth:`parse`.
         :rtype: unicode or None
         :returns: The unique ID string. Return None if not generating it here.
+        :raises StorageError: If the upload fails.
+
+        """
+        key_name = self._data.get(S3_KEY_PREFIX, '') \
+            + safe_file_name(media_file, file.filename)
+        headers = {}
+        if media_file.container:
+            headers['Content-Type'] = guess_mimetype(media_file.container)
+
+        fp = file.file
+        fp.seek(0)
+        try:
+            first_part = fp.read(_part_size)
+            if len(first_part) < _part_size:
+                key = self._bucket().new_key(key_name)
+                key.set_contents_from_string(first_part, headers=headers)
+            else:
+                self._multipart_upload(key_name, first_part, fp, headers)
+        except (BotoClientError, BotoServerError), e:
+            log.exception(e)
+            msg = _('Could not upload the file to Amazon S3: %s') % e
+            raise StorageError(msg)
+        return key_name
+
+    def _multipart_upload(self, key_name, first_part, fp, headers):
+        """Upload the file in parts, several at a time.
+
+        The next part is only read once there is room for it in flight,
+        so no more than :data:`_parts_in_flight` parts are in memory.
 
         """
-        raise NotImplementedError
+        mp = self._bucket().initiate_multipart_upload(key_name,
+                                                      headers=headers)
+        pool = ThreadPool(_parts_in_flight)
+        try:
+            try:
+                pending = []
+                part, part_num = first_part, 1
+                while part:
+                    if len(pending) >= _parts_in_flight:
+                        # Raises the exception if the part failed
+                        pending.pop(0).get()
+                    pending.append(pool.apply_async(self._upload_part,
+                        (mp.id, key_name, part_num, part)))
+                    part, part_num = fp.read(_part_size), part_num + 1
+                for result in pending:
+                    result.get()
+                mp.complete_upload()
+            except:
+                mp.cancel_upload()
+                raise
+        finally:
+            pool.close()
+            pool.join()
+
+    def _upload_part(self, upload_id, key_name, part_num, data):
+        mp = MultiPartUpload(self._bucket())
+        mp.id = upload_id
+        mp.key_name = key_name
+        mp.upload_part_from_file(StringIO(data), part_num, size=len(data))
 
     def delete(self, media_file):
         """Delete the stored file represented by the given unique ID.
@@ -68,25 +194,86 @@ class AmazonS3Storage(FileStorageEngine):
         :returns: True if successful, False if an error occurred.
 
         """
-        raise NotImplementedError
+        try:
+            self._bucket().delete_key(media_file.unique_id)
+            return True
+        except (BotoClientError, BotoServerError), e:
+            log.exception(e)
+            return False
 
     def get_uris(self, file):
         """Return a list of URIs from which the stored file can be accessed.
 
+        Files are served from the CloudFront distribution if one is set.
+        Otherwise the URL is signed to expire after the configured number
+        of seconds, if any, or else it's the plain S3 URL, which requires
+        that the bucket be public. Signed URLs last at least
+        :data:`MIN_URL_EXPIRES` seconds, see :attr:`uris_expire`.
+
         :type file: :class:`~mediacore.model.media.MediaFile`
         :param file: The associated media file object.
         :rtype: list
         :returns: All :class:`StorageURI` tuples for this file.
 
         """
-        cloudfront_http = self._data.get('cloudfront_http', None)
-        cloudfront_rtmp = self._data.get('cloudfront_rtmp', None)
-        if cloudfront_rtmp:
-            uris.append(StorageURI(file, 'rtmp', file.unique_id, cloudfront_rtmp))
+        uris = []
+        cloudfront_http = self._data.get(CLOUDFRONT_HTTP, None)
+        cloudfront_rtmp = self._data.get(CLOUDFRONT_RTMP, None)
         if cloudfront_http:
-            uris.append(StorageURI(file, 'http', file.unique_id, cloudfront_http))
+            url = '%s/%s' % (cloudfront_http.rstrip('/'),
+                             quote(file.unique_id.encode('utf-8')))
         else:
-            uris = [StorageURI(file, 'http', file.unique_id, self._data['s3_url'])]
+            url = self._url(file.unique_id)
+        uris.append(StorageURI(file, 'http', url, None))
+        if cloudfront_rtmp:
+            uris.append(StorageURI(file, 'rtmp', file.unique_id, cloudfront_rtmp))
         return uris
 
+    @property
+    def uris_expire(self):
+        """True if the HTTP URLs are signed, and so mustn't be cached."""
+        return bool(int(self._data.get(S3_URL_EXPIRES, None) or 0)) \
+            and not self._data.get(CLOUDFRONT_HTTP, None)
+
+    def _url(self, key_name):
+        expires = int(self._data.get(S3_URL_EXPIRES, None) or 0)
+        if expires:
+            expires = max(expires, MIN_URL_EXPIRES)
+        return self._connection().generate_url(expires, 'GET',
+            self._data[S3_BUCKET], key_name, query_auth=bool(expires))
+
+    def _connection(self):
+        """Return a connection for the current thread.
+
+        Connections can't be shared between threads, but each thread
+        reuses its own so that requests can be sent over the same socket.
+
+        """
+        if S3Connection is None:
+            raise StorageError('Amazon S3 Storage requires boto.')
+        data = self._data
+        host = data.get(S3_HOST, None) or DEFAULT_HOST
+        params = (data[S3_ACCESS_KEY], data[S3_SECRET_KEY], host,
+                  data.get(S3_PORT, None) or None,
+                  bool(data.get(S3_SECURE, True)))
+        cache = getattr(_connections, 'cache', None)
+        if cache is None:
+            cache = _connections.cache = {}
+        conn = cache.get(params, None)
+        if conn is None:
+            access_key, secret_key, host, port, secure = params
+            kwargs = dict(host=host, is_secure=secure)
+            if port:
+                kwargs['port'] = int(port)
+            if host != DEFAULT_HOST:
+                # Most S3-compatible services don't support bucket subdomains
+                kwargs['calling_format'] = OrdinaryCallingFormat()
+            conn = cache[params] = S3Connection(access_key, secret_key,
+                                                **kwargs)
+        return conn
+
+    def _bucket(self):
+        return self._connection().get_bucket(self._data[S3_BUCKET],
+                                             validate=False)
+
 FileStorageEngine.register(AmazonS3Storage)
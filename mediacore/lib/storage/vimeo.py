@@ -17,7 +17,7 @@ import logging
 import re
 import simplejson
 
-from urllib2 import Request, urlopen, URLError
+from urllib2 import URLError
 
 from pylons.i18n import N_
 
@@ -25,7 +25,7 @@ from mediacore import USER_AGENT
 from mediacore.lib.compat import max
 from mediacore.lib.filetypes import VIDEO
 from mediacore.lib.storage import (EmbedStorageEngine, StorageURI,
-    UnsuitableEngineError)
+    UnsuitableEngineError, fetch_url)
 
 log = logging.getLogger(__name__)
 
@@ -55,14 +55,9 @@ class VimeoStorage(EmbedStorageEngine):
 
         # Vimeo API requires us to give a user-agent, to avoid 403 errors.
         headers = {'User-Agent': USER_AGENT}
-        req = Request(vimeo_data_url, headers=headers)
 
         try:
-            temp_data = urlopen(req)
-            try:
-                data = simplejson.loads(temp_data.read())[0]
-            finally:
-                temp_data.close()
+            data = simplejson.loads(fetch_url(vimeo_data_url, headers))[0]
         except URLError, e:
             log.exception(e)
             data = {}
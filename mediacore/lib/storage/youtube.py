@@ -19,7 +19,6 @@ from operator import attrgetter
 from urllib import urlencode
 
 import gdata.youtube
-import gdata.youtube.service
 
 from pylons.i18n import N_
 
@@ -27,7 +26,7 @@ from mediacore.forms.admin.storage.youtube import YoutubeStorageForm
 from mediacore.lib.compat import max
 from mediacore.lib.filetypes import VIDEO
 from mediacore.lib.storage import (EmbedStorageEngine, StorageURI,
-    UnsuitableEngineError)
+    UnsuitableEngineError, fetch_url)
 
 class YoutubeStorage(EmbedStorageEngine):
 
@@ -67,9 +66,10 @@ class YoutubeStorage(EmbedStorageEngine):
         :returns: Any extracted metadata.
 
         """
-        yt_service = gdata.youtube.service.YouTubeService()
-        yt_service.ssl = False
-        entry = yt_service.GetYouTubeVideoEntry(video_id=id)
+        # The same feed that YouTubeService.GetYouTubeVideoEntry reads,
+        # fetched with a timeout and cached.
+        data = fetch_url('http://gdata.youtube.com/feeds/api/videos/%s' % id)
+        entry = gdata.youtube.YouTubeVideoEntryFromString(data)
         thumb = max(entry.media.thumbnail, key=attrgetter('width'))
 
         return {
@@ -14,21 +14,52 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import filecmp
+import glob
 import os
+import re
 import shutil
+import tempfile
+import time
 import urllib2
+
+from cStringIO import StringIO
+
 from PIL import Image
 # XXX: note that pylons.url is imported here. Make sure to only use it with
 #      absolute paths (ie. those starting with a /) to avoid differences in
 #      behavior from mediacore.lib.helpers.url_for
 from pylons import config, app_globals, url as url_for
 
+from mediacore.lib.compat import Pool, ThreadPool, sha1
+from mediacore.lib.util import delete_files
+
 __all__ = [
     'ThumbDict', 'create_default_thumbs_for', 'create_thumbs_for',
-    'has_thumbs', 'has_default_thumbs',
-    'thumb', 'thumb_path', 'thumb_paths', 'thumb_url',
+    'default_thumbs', 'delete_thumbs', 'has_thumbs', 'has_default_thumbs',
+    'init_thumbs', 'regenerate_thumbs', 'remove_unused_thumbs', 'render_thumbs',
+    'resize_thumbs', 'store_thumb', 'stored_thumb_path',
+    'thumb', 'thumb_path', 'thumb_paths', 'thumb_store_dir', 'thumb_url',
 ]
 
+_save_threads = 4
+"""Threads that encode and write the thumbnails of one image in parallel."""
+
+_unused_grace_period = 3600
+"""Seconds before an unreferenced file in the store may be removed.
+
+This gives the request that stored it time to commit its mapping."""
+
+_default_check_interval = 10
+"""Seconds between checks for new default thumbs, eg. from another process
+running :func:`regenerate_thumbs`."""
+
+_default_thumbs = {}
+
+_manifest = None
+_manifest_root = None
+
+_stored_name_re = re.compile(r'^[0-9a-f]{40}_(\d+)x(\d+)\.')
+
 def _normalize_thumb_item(item):
     """Pass back the image subdir and id when given a media or podcast."""
     try:
@@ -36,6 +67,226 @@ def _normalize_thumb_item(item):
     except AttributeError:
         return item
 
+def thumb_store_dir():
+    """Return the directory of the content-addressed thumbnail store."""
+    return os.path.join(config['image_dir'], 'thumbs')
+
+def stored_thumb_path(name, store_dir=None):
+    """Return the path of a file in the thumbnail store.
+
+    :param name: The file name, as returned by :func:`store_thumb`.
+    :param store_dir: The store directory, if not :func:`thumb_store_dir`.
+
+    """
+    return os.path.join(store_dir or thumb_store_dir(), name[:2], name)
+
+def store_thumb(data, store_dir, ext='jpg', dimensions=None):
+    """Add an image to the thumbnail store, unless it's already there.
+
+    Files in the store are named for the SHA-1 of their contents, so the
+    same image is only ever stored once and never changes once written.
+    The dimensions are included in the name so they can be known without
+    opening the file.
+
+    :param data: The image file contents.
+    :type data: str
+    :param store_dir: The store directory, see :func:`thumb_store_dir`.
+    :param ext: The file extension.
+    :param dimensions: The width and height of the image, if known.
+    :returns: The file name.
+
+    """
+    name = sha1(data).hexdigest()
+    if dimensions:
+        name += '_%dx%d' % tuple(dimensions)
+    name = '%s.%s' % (name, ext)
+    path = stored_thumb_path(name, store_dir)
+    if os.path.exists(path):
+        return name
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    # Write to a temp file first so the file is never seen half-written
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        os.write(fd, data)
+        os.close(fd)
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+    return name
+
+def default_thumbs(image_dir):
+    """Return the thumbs that all items without an image share.
+
+    The defaults are the files with an ID of 'new', eg. ``news.jpg``.
+    They're added to the store the first time they're needed, and again
+    whenever the files are modified.
+
+    :param image_dir: The subdir name, eg. ``media`` or ``podcasts``.
+    :returns: A dict of size keys to file names in the store.
+
+    """
+    cache_key = (config['image_dir'], image_dir)
+    checked, stamp, thumbs = _default_thumbs.get(cache_key, (0, None, None))
+    now = time.time()
+    if now - checked >= _default_check_interval:
+        new_stamp = _default_stamp(image_dir)
+        if new_stamp != stamp:
+            stamp, thumbs = new_stamp, None
+        _default_thumbs[cache_key] = (now, stamp, thumbs)
+    if thumbs is None:
+        thumbs = {}
+        for key in config['thumb_sizes'][image_dir].iterkeys():
+            default_file = open(thumb_path((image_dir, 'new'), key), 'rb')
+            try:
+                data = default_file.read()
+            finally:
+                default_file.close()
+            dimensions = Image.open(StringIO(data)).size
+            thumbs[key] = store_thumb(data, thumb_store_dir(),
+                                      dimensions=dimensions)
+            _register_thumb(thumbs[key], dimensions)
+        _default_thumbs[cache_key] = (now, stamp, thumbs)
+    return thumbs
+
+def _default_stamp(image_dir):
+    """Return the modification times and sizes of the default thumbs."""
+    stamp = []
+    for key in sorted(config['thumb_sizes'][image_dir].iterkeys()):
+        try:
+            info = os.stat(thumb_path((image_dir, 'new'), key))
+        except OSError:
+            stamp.append(None)
+        else:
+            stamp.append((info.st_mtime, info.st_size))
+    return tuple(stamp)
+
+def _defaults_current(image_dir, sizes, keep_aspect_ratio):
+    """Return True if the default thumbs were rendered at the given sizes.
+
+    Resized images are always the configured width, and the configured
+    height too unless the aspect ratio was kept.
+
+    """
+    manifest = _get_manifest()
+    for key, (width, height) in sizes.iteritems():
+        dimensions = manifest.get('%s/new%s.jpg' % (image_dir, key), None)
+        if dimensions is None or dimensions[0] != width \
+        or (dimensions[1] != height and not keep_aspect_ratio):
+            return False
+    return True
+
+def _read_dimensions(path):
+    try:
+        return Image.open(path).size
+    except IOError:
+        return None
+
+def _scan_thumbs(image_dir, thumb_dirs):
+    """Index the thumbnail files that exist, and their dimensions."""
+    manifest = {}
+    for subdir in thumb_dirs:
+        directory = os.path.join(image_dir, subdir)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                manifest['%s/%s' % (subdir, name)] = \
+                    _read_dimensions(os.path.join(directory, name))
+    store_dir = os.path.join(image_dir, 'thumbs')
+    if os.path.isdir(store_dir):
+        for subdir in os.listdir(store_dir):
+            directory = os.path.join(store_dir, subdir)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    manifest[name] = _stored_dimensions(name) or \
+                        _read_dimensions(os.path.join(directory, name))
+    return manifest
+
+def init_thumbs(config):
+    """Build the thumbnail manifest.
+
+    The manifest is an in-memory index of which thumbnail files exist and
+    what their dimensions are, so that rendering a thumb never has to touch
+    the filesystem. It's kept up to date as thumbs are created and deleted
+    in this process. Other processes only ever add files to the store, and
+    the dimensions of those are in their names.
+
+    :param config: The app config dict.
+
+    """
+    global _manifest, _manifest_root
+    _manifest = _scan_thumbs(config['image_dir'], config['thumb_sizes'])
+    _manifest_root = config['image_dir']
+
+def _get_manifest():
+    if _manifest is None or _manifest_root != config['image_dir']:
+        init_thumbs(config)
+    return _manifest
+
+def _register_thumb(key, dimensions):
+    _get_manifest()[key] = dimensions
+
+def _stored_dimensions(name):
+    match = _stored_name_re.match(name)
+    return match and (int(match.group(1)), int(match.group(2))) or None
+
+def _thumb_dimensions(stored, name):
+    """Return the real dimensions of a thumb, if they're known."""
+    manifest = _get_manifest()
+    dimensions = manifest.get(name, None)
+    if dimensions is None and stored and name not in manifest:
+        # Stored by another process since the manifest was built
+        dimensions = _stored_dimensions(name)
+        if dimensions is None:
+            dimensions = _read_dimensions(stored_thumb_path(name))
+        manifest[name] = dimensions
+    return dimensions
+
+def _stored_thumb(item, size, exists=False):
+    """Return the name of the given thumb in the store.
+
+    ``False`` is returned if the item's thumbs haven't been moved into
+    the store yet, and they're still named for the item's ID.
+
+    """
+    thumbs = getattr(item, 'thumbs', None)
+    if thumbs is None:
+        return False
+    name = thumbs.get(size, None)
+    if name is None and not exists:
+        image_dir, item_id = _normalize_thumb_item(item)
+        name = default_thumbs(image_dir).get(size, None)
+    return name
+
+def _find_thumb(item, size, exists=False, ext='jpg'):
+    """Find the file for the given thumb, without touching the filesystem.
+
+    :returns: A ``(stored, name)`` tuple. If stored is True the name is
+        a file in the thumbnail store, otherwise it is a path relative to
+        the ``image_dir``. ``None`` if exists is True and there is no
+        such thumb.
+
+    """
+    if not item:
+        return None
+
+    name = _stored_thumb(item, size, exists)
+    if name is not False:
+        if not name:
+            return None
+        return True, name
+
+    image_dir, item_id = _normalize_thumb_item(item)
+    name = '%s/%s%s.%s' % (image_dir, item_id, size, ext)
+    if exists and name not in _get_manifest():
+        return None
+    return False, name
+
 def thumb_path(item, size, exists=False, ext='jpg'):
     """Get the thumbnail path for the given item and size.
 
@@ -58,17 +309,21 @@ def thumb_path(item, size, exists=False, ext='jpg'):
     if not item:
         return None
 
-    image_dir, item_id = _normalize_thumb_item(item)
-    image = '%s/%s%s.%s' % (image_dir, item_id, size, ext)
-    image_path = os.path.join(config['image_dir'], image)
-
-    if exists and not os.path.isfile(image_path):
+    found = _find_thumb(item, size, exists, ext)
+    if not found:
         return None
-    return image_path
+    stored, name = found
+    if stored:
+        return stored_thumb_path(name)
+    return os.path.join(config['image_dir'], name)
 
 def thumb_paths(item, **kwargs):
     """Return a list of paths to all sizes of thumbs for a given item.
 
+    Only thumbs named for the item's ID are included, since files in the
+    thumbnail store may be shared with other items. Those are deleted
+    by :func:`remove_unused_thumbs` once nothing refers to them.
+
     :param item: A 2-tuple with a subdir name and an ID. If given a
         ORM mapped class with _thumb_dir and id attributes, the info
         can be extracted automatically.
@@ -78,12 +333,15 @@ def thumb_paths(item, **kwargs):
 
     """
     image_dir, item_id = _normalize_thumb_item(item)
-    return dict((key, thumb_path(item, key, **kwargs))
+    return dict((key, thumb_path((image_dir, item_id), key, **kwargs))
                 for key in config['thumb_sizes'][image_dir].iterkeys())
 
 def thumb_url(item, size, qualified=False, exists=False):
     """Get the thumbnail url for the given item and size.
 
+    Thumbs in the store never change, so their URLs can be cached
+    indefinitely.
+
     :param item: A 2-tuple with a subdir name and an ID. If given a
         ORM mapped class with _thumb_dir and id attributes, the info
         can be extracted automatically.
@@ -100,15 +358,16 @@ def thumb_url(item, size, qualified=False, exists=False):
     :rtype: str
 
     """
-    if not item:
-        return None
-
-    image_dir, item_id = _normalize_thumb_item(item)
-    image = '%s/%s%s.jpg' % (image_dir, item_id, size)
+    return _found_thumb_url(_find_thumb(item, size, exists), qualified)
 
-    if exists and not os.path.isfile(os.path.join(config['image_dir'], image)):
+def _found_thumb_url(found, qualified=False):
+    if not found:
         return None
-    return url_for('/images/%s' % image, qualified=qualified)
+    stored, name = found
+    if stored:
+        return url_for('/images/thumbs/%s/%s' % (name[:2], name),
+                       qualified=qualified)
+    return url_for('/images/%s' % name, qualified=qualified)
 
 class ThumbDict(dict):
     """Dict wrapper with convenient attribute access"""
@@ -135,21 +394,22 @@ def thumb(item, size, qualified=False, exists=False):
     :param exists: If enabled, checks to see if the file actually exists.
         If it doesn't exist, ``None`` is returned.
     :type exists: bool
-    :returns: The url, width (x) and height (y).
+    :returns: The url, width (x) and height (y). The dimensions are
+        those of the actual image if they're known, otherwise the
+        configured size.
     :rtype: :class:`ThumbDict` with keys url, x, y OR ``None``
 
     """
-    if not item:
+    found = _find_thumb(item, size, exists)
+    if not found:
         return None
 
     image_dir, item_id = _normalize_thumb_item(item)
-    url = thumb_url(item, size, qualified, exists)
-
-    if not url:
-        return None
-    return ThumbDict(url, config['thumb_sizes'][image_dir][size])
+    dimensions = _thumb_dimensions(*found) \
+        or config['thumb_sizes'][image_dir][size]
+    return ThumbDict(_found_thumb_url(found, qualified), dimensions)
 
-def resize_thumb(img, size, filter=Image.ANTIALIAS):
+def resize_thumb(img, size, filter=Image.ANTIALIAS, keep_aspect_ratio=None):
     """Resize an image without any stretching by cropping when necessary.
 
     If the given image has a different aspect ratio than the requested
@@ -164,11 +424,17 @@ def resize_thumb(img, size, filter=Image.ANTIALIAS):
     :type size: tuple
     :param filter: The downsampling filter to use when resizing.
         Defaults to PIL.Image.ANTIALIAS, the highest possible quality.
+    :param keep_aspect_ratio: Whether to adjust the height to keep the
+        aspect ratio of images that aren't cropped. Defaults to the
+        ``keep_aspect_ratio`` setting.
     :returns: A new, resized image instance
 
     """
     X, Y, X2, Y2 = 0, 1, 2, 3 # aliases for readability
 
+    if keep_aspect_ratio is None:
+        keep_aspect_ratio = app_globals.settings['keep_aspect_ratio']
+
     src_ratio = float(img.size[X]) / img.size[Y]
     dst_ratio = float(size[X]) / size[Y]
 
@@ -189,53 +455,159 @@ def resize_thumb(img, size, filter=Image.ANTIALIAS):
 
         img = img.crop(crop_rect)
 
-    elif app_globals.settings['keep_aspect_ratio']:
+    elif keep_aspect_ratio:
         # resize height acording to our src_ratio
         size = (size[X], int(size[X]/float(src_ratio)))
 
     return img.resize(size, filter)
 
+def _decode_thumb_source(image_file, sizes):
+    """Open and decode an image, only as large as the given sizes need.
+
+    JPEG images can be decoded at 1/2, 1/4 or 1/8 scale for a fraction
+    of the cost of decoding them in full. We use the smallest scale that
+    is still at least as large as the largest thumbnail.
+
+    """
+    img = Image.open(image_file)
+    if img.format == 'JPEG' and sizes:
+        img.draft('RGB', (max([x for x, y in sizes]),
+                          max([y for x, y in sizes])))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    else:
+        img.load()
+    return img
+
+def _can_downscale_from(img, previous, size):
+    """Return True if the previous thumbnail is a good source for size.
+
+    It must have been scaled down from the original, and it must already
+    have the target aspect ratio, or we'd crop away more than we should.
+
+    """
+    px, py = previous.size
+    return (px <= img.size[0] and py <= img.size[1]
+            and px >= size[0] and py >= size[1]
+            and abs(float(px) / py - float(size[0]) / size[1]) < 0.01)
+
+def resize_thumbs(img, sizes, keep_aspect_ratio=None):
+    """Resize an image to each of the given sizes.
+
+    The sizes are done largest first, and each is resized from the one
+    before it where possible, which is much faster than resizing each
+    from the original.
+
+    :param img: The decoded source image.
+    :type img: :class:`PIL.Image`
+    :param sizes: The ``(width, height)`` tuples to resize to.
+    :param keep_aspect_ratio: See :func:`resize_thumb`.
+    :returns: A dict of sizes to resized images.
+
+    """
+    resized = {}
+    previous = None
+    for size in sorted(set(sizes), key=lambda (x, y): x * y, reverse=True):
+        source = img
+        if previous is not None and _can_downscale_from(img, previous, size):
+            source = previous
+        previous = resize_thumb(source, size,
+                                keep_aspect_ratio=keep_aspect_ratio)
+        resized[size] = previous
+    return resized
+
+def _store_thumb_image((img, store_dir)):
+    buf = StringIO()
+    img.save(buf, 'JPEG')
+    return store_thumb(buf.getvalue(), store_dir, dimensions=img.size)
+
+_save_pool = None
+_save_pool_pid = None
+
+def _get_save_pool():
+    """Return the thread pool for this process, creating it if need be."""
+    global _save_pool, _save_pool_pid
+    if _save_pool is None or _save_pool_pid != os.getpid():
+        _save_pool = ThreadPool(_save_threads)
+        _save_pool_pid = os.getpid()
+    return _save_pool
+
+def render_thumbs(image_file, sizes, store_dir, keep_aspect_ratio=None):
+    """Add thumbnails of an image to the thumbnail store.
+
+    The image is decoded once, resized progressively by
+    :func:`resize_thumbs`, and the results are encoded and written in
+    parallel. This does not depend on the request, so it can be run in
+    any process.
+
+    :param image_file: An open file handle or path for the source image.
+    :param sizes: A dict of size keys to ``(width, height)`` tuples.
+    :param store_dir: The store directory, see :func:`thumb_store_dir`.
+    :param keep_aspect_ratio: See :func:`resize_thumb`.
+    :returns: A dict of size keys to file names in the store.
+
+    """
+    keys = sizes.keys()
+    dimensions = [tuple(sizes[key]) for key in keys]
+    img = _decode_thumb_source(image_file, dimensions)
+    resized = resize_thumbs(img, dimensions, keep_aspect_ratio)
+    names = _get_save_pool().map(_store_thumb_image,
+        [(resized[xy], store_dir) for xy in dimensions])
+    return dict(zip(keys, names))
+
+def _image_ext(filename):
+    ext = os.path.splitext(filename)[1].lower()[1:]
+    if not re.match(r'^\w{1,10}$', ext):
+        ext = 'img'
+    return ext
+
 def create_thumbs_for(item, image_file, image_filename):
     """Creates thumbnails in all sizes for a given Media or Podcast object.
 
+    The thumbs are added to the thumbnail store and recorded in the
+    item's :attr:`thumbs` mapping, along with the original image.
+
     Side effects: Closes the open file handle passed in as image_file.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
-    :type item: ``tuple`` or mapped class instance
+    :param item: A Media or Podcast instance.
     :param image_file: An open file handle for the original image file.
     :type image_file: file
     :param image_filename: The original filename of the thumbnail image.
     :type image_filename: unicode
     """
     image_dir, item_id = _normalize_thumb_item(item)
-    img = Image.open(image_file)
+    store_dir = thumb_store_dir()
 
     # TODO: Allow other formats?
-    for key, xy in config['thumb_sizes'][item._thumb_dir].iteritems():
-        path = thumb_path(item, key)
-        thumb_img = resize_thumb(img, xy)
-        if thumb_img.mode != "RGB":
-            thumb_img = thumb_img.convert("RGB")
-        thumb_img.save(path)
+    thumbs = render_thumbs(image_file, config['thumb_sizes'][image_dir],
+                           store_dir)
 
     # Backup the original image just for kicks
-    backup_type = os.path.splitext(image_filename)[1].lower()[1:]
-    backup_path = thumb_path(item, 'orig', ext=backup_type)
-    backup_file = open(backup_path, 'w+b')
     image_file.seek(0)
-    shutil.copyfileobj(image_file, backup_file)
+    thumbs['orig'] = store_thumb(image_file.read(), store_dir,
+                                 _image_ext(image_filename))
     image_file.close()
-    backup_file.close()
+    for name in thumbs.itervalues():
+        _register_thumb(name, _stored_dimensions(name))
+    item.thumbs = thumbs
 
 def create_default_thumbs_for(item):
-    """Create copies of the default thumbs for the given item.
+    """Give the given item the default thumbs.
+
+    The default thumbs are shared by every item that uses them, so this
+    doesn't write any files.
+
+    :param item: A Media or Podcast instance.
+
+    """
+    image_dir, item_id = _normalize_thumb_item(item)
+    item.thumbs = dict(default_thumbs(image_dir))
+
+def delete_thumbs(item):
+    """Delete the thumbs that are named for the given item's ID.
 
-    This copies the default files (all named with an id of 'new') to
-    use the given item's id. This means there could be lots of duplicate
-    copies of the default thumbs, but at least we can always use the
-    same url when rendering.
+    Files in the thumbnail store may be shared, so they're left for
+    :func:`remove_unused_thumbs`.
 
     :param item: A 2-tuple with a subdir name and an ID. If given a
         ORM mapped class with _thumb_dir and id attributes, the info
@@ -244,10 +616,10 @@ def create_default_thumbs_for(item):
 
     """
     image_dir, item_id = _normalize_thumb_item(item)
+    delete_files(thumb_paths(item).values(), image_dir)
+    manifest = _get_manifest()
     for key in config['thumb_sizes'][image_dir].iterkeys():
-        src_file = thumb_path((image_dir, 'new'), key)
-        dst_file = thumb_path(item, key)
-        shutil.copyfile(src_file, dst_file)
+        manifest.pop('%s/%s%s.jpg' % (image_dir, item_id, key), None)
 
 def has_thumbs(item):
     """Return True if a thumb exists for this item.
@@ -268,5 +640,155 @@ def has_default_thumbs(item):
     :type item: ``tuple`` or mapped class instance
     """
     image_dir, item_id = _normalize_thumb_item(item)
+    name = _stored_thumb(item, 's', exists=True)
+    if name is not False:
+        return name == default_thumbs(image_dir).get('s', None)
     return filecmp.cmp(thumb_path((image_dir, item_id), 's'),
                        thumb_path((image_dir, 'new'), 's'))
+
+def _thumb_source(item):
+    """Return the path of the best image to regenerate thumbs from.
+
+    The original image is used if it was kept, otherwise the largest
+    existing thumbnail. The second value is True for originals.
+
+    """
+    original = thumb_path(item, 'orig', exists=True)
+    if _stored_thumb(item, 'orig') is False:
+        image_dir, item_id = _normalize_thumb_item(item)
+        originals = glob.glob(thumb_path((image_dir, item_id), 'orig', ext='*'))
+        original = originals and originals[0] or None
+    if original:
+        return original, True
+    return thumb_path(item, 'l', exists=True), False
+
+def _render_thumbs_task((source, is_original, sizes, store_dir,
+                         keep_aspect_ratio)):
+    try:
+        thumbs = render_thumbs(source, sizes, store_dir, keep_aspect_ratio)
+        if is_original:
+            source_file = open(source, 'rb')
+            try:
+                thumbs['orig'] = store_thumb(source_file.read(), store_dir,
+                                             _image_ext(source))
+            finally:
+                source_file.close()
+    except (IOError, OSError), e:
+        return None, '%s: %s' % (source, e)
+    return thumbs, None
+
+def regenerate_thumbs(items, processes=None):
+    """Regenerate the thumbs of the given items at the configured sizes.
+
+    This is for when ``thumb_sizes`` has changed, and it also moves any
+    thumbs that are still named for their item's ID into the store.
+    Items that use the default thumbs are given the new defaults, which
+    are themselves regenerated first if their sizes have changed. Items
+    with their own thumbs are rendered in a pool of worker processes,
+    from the original image where it was kept.
+
+    :param items: :class:`~mediacore.model.media.Media` and
+        :class:`~mediacore.model.podcasts.Podcast` instances.
+    :param processes: The number of worker processes. Defaults to the
+        number of CPUs.
+    :returns: A list of error messages for the images that failed.
+
+    """
+    keep_aspect_ratio = app_globals.settings['keep_aspect_ratio']
+    store_dir = thumb_store_dir()
+    defaults, custom, tasks = [], [], []
+
+    # Sort the items before any of the thumbs change
+    for item in items:
+        if not has_thumbs(item):
+            continue
+        if has_default_thumbs(item):
+            defaults.append(item)
+            continue
+        source, is_original = _thumb_source(item)
+        if source:
+            sizes = config['thumb_sizes'][item._thumb_dir]
+            custom.append(item)
+            tasks.append((source, is_original, sizes, store_dir,
+                          keep_aspect_ratio))
+
+    errors = []
+    for image_dir, sizes in config['thumb_sizes'].iteritems():
+        if _defaults_current(image_dir, sizes, keep_aspect_ratio):
+            # Rendering them again would only change their hashes
+            continue
+        source = thumb_path((image_dir, 'new'), 'l', exists=True)
+        if source:
+            # Other processes hand out the old defaults until they notice
+            # the new ones, so give them the grace period of new files.
+            for name in default_thumbs(image_dir).itervalues():
+                try:
+                    os.utime(stored_thumb_path(name, store_dir), None)
+                except OSError:
+                    pass
+            thumbs, error = _render_thumbs_task((source, False, sizes,
+                                                 store_dir, keep_aspect_ratio))
+            errors.append(error)
+            for key, name in (thumbs or {}).iteritems():
+                shutil.copyfile(stored_thumb_path(name, store_dir),
+                                thumb_path((image_dir, 'new'), key))
+                _register_thumb('%s/new%s.jpg' % (image_dir, key),
+                                _stored_dimensions(name))
+    _default_thumbs.clear()
+
+    if tasks:
+        pool = Pool(processes)
+        try:
+            results = pool.map(_render_thumbs_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for item, (thumbs, error) in zip(custom, results):
+            errors.append(error)
+            if thumbs:
+                orig = (item.thumbs or {}).get('orig', None)
+                if orig and 'orig' not in thumbs:
+                    thumbs['orig'] = orig
+                item.thumbs = thumbs
+
+    for item in defaults:
+        create_default_thumbs_for(item)
+
+    return [e for e in errors if e]
+
+def remove_unused_thumbs(items):
+    """Delete the files in the thumbnail store that nothing refers to.
+
+    Files that were only just stored are kept, in case the item that
+    refers to them hasn't been committed yet.
+
+    :param items: Every :class:`~mediacore.model.media.Media` and
+        :class:`~mediacore.model.podcasts.Podcast`.
+    :returns: The number of files deleted.
+
+    """
+    used = set()
+    for item in items:
+        used.update((getattr(item, 'thumbs', None) or {}).itervalues())
+    for image_dir in config['thumb_sizes'].iterkeys():
+        used.update(default_thumbs(image_dir).itervalues())
+
+    store_dir = thumb_store_dir()
+    if not os.path.isdir(store_dir):
+        return 0
+    cutoff = time.time() - _unused_grace_period
+    removed = 0
+    for subdir in os.listdir(store_dir):
+        subdir = os.path.join(store_dir, subdir)
+        if not os.path.isdir(subdir):
+            continue
+        for name in os.listdir(subdir):
+            path = os.path.join(subdir, name)
+            try:
+                if name not in used and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    _get_manifest().pop(name, None)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
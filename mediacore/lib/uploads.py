@@ -0,0 +1,207 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Chunked Uploads
+
+Large files can be uploaded as a series of fixed-size chunks, which are
+appended to a part file in the upload spool as they arrive. Each chunk
+is sent with the offset it begins at and its SHA-1 checksum, so a chunk
+that was corrupted or sent twice is rejected rather than appended. If
+the connection drops, the client asks for the current offset and
+carries on from there.
+
+Only one chunk is handled at a time, and it is streamed to disk in small
+blocks, so memory use doesn't depend on the size of the file. Once the
+upload is complete, the part file is renamed within the spool, to be
+picked up by the :class:`~mediacore.lib.jobs.ProcessUploadJob` like any
+other upload.
+
+"""
+import os
+import re
+import time
+import uuid
+
+from shutil import copyfileobj
+
+from paste.deploy.converters import asint
+
+from mediacore.lib.compat import sha1
+from mediacore.lib.jobs import spool_dir
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = [
+    'ChunkError',
+    'append_chunk',
+    'begin_upload',
+    'chunk_size',
+    'finish_upload',
+    'upload_offset',
+]
+
+_block_size = 65536
+"""Bytes read at a time when checking and appending chunks."""
+
+_stale_after = 86400
+"""Seconds after its last chunk that an unfinished upload is removed,
+unless ``upload_stale_after`` is set in the config."""
+
+_upload_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+class ChunkError(Exception):
+    """Raised when a chunk or upload ID is unacceptable.
+
+    .. attribute:: offset
+
+        The offset that the next chunk must begin at, if it is known.
+
+    """
+    def __init__(self, message, offset=None):
+        Exception.__init__(self, message)
+        self.offset = offset
+
+def chunk_size(config):
+    """Return the size that every chunk but the last must be, in bytes."""
+    return asint(config.get('upload_chunk_size', 4194304))
+
+def _chunk_dir(config):
+    return os.path.join(spool_dir(config), 'chunks')
+
+def _part_path(upload_id, config):
+    if not upload_id or not _upload_id_re.match(upload_id):
+        raise ChunkError('Invalid upload ID.')
+    return os.path.join(_chunk_dir(config), upload_id + '.part')
+
+def _remove_stale_parts(directory, config):
+    cutoff = time.time() - asint(config.get('upload_stale_after',
+                                            _stale_after))
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            # Another process got to it first
+            pass
+
+def begin_upload(config):
+    """Start a new chunked upload.
+
+    :param config: The app config dict.
+    :returns: The new upload ID, a string.
+
+    """
+    directory = _chunk_dir(config)
+    if os.path.isdir(directory):
+        # Abandoned uploads are cleared out as new ones are begun
+        _remove_stale_parts(directory, config)
+    else:
+        os.makedirs(directory)
+    upload_id = uuid.uuid4().hex
+    open(_part_path(upload_id, config), 'wb').close()
+    return upload_id
+
+def upload_offset(upload_id, config):
+    """Return the number of bytes received so far for the given upload.
+
+    :raises ChunkError: If there is no such upload.
+
+    """
+    try:
+        return os.path.getsize(_part_path(upload_id, config))
+    except OSError:
+        raise ChunkError('No such upload.')
+
+def append_chunk(upload_id, offset, chunk, checksum, config, max_size=None):
+    """Append a chunk to the given upload.
+
+    :param upload_id: The ID returned by :func:`begin_upload`.
+    :param offset: The offset in the file that the chunk begins at.
+    :param chunk: A file-like object containing the chunk.
+    :param checksum: The hex SHA-1 digest of the chunk.
+    :param config: The app config dict.
+    :param max_size: The largest the whole file may be, in bytes.
+    :returns: The offset that the next chunk must begin at.
+    :raises ChunkError: If the chunk or the file would be too large,
+        the chunk doesn't match the checksum, or it doesn't begin where
+        the last chunk ended.
+
+    """
+    path = _part_path(upload_id, config)
+    size = chunk_size(config)
+
+    digest = sha1()
+    length = 0
+    chunk.seek(0)
+    while True:
+        data = chunk.read(_block_size)
+        if not data:
+            break
+        length += len(data)
+        if length > size:
+            raise ChunkError('Chunks must not be larger than %d bytes.' % size)
+        digest.update(data)
+    if not checksum or digest.hexdigest() != checksum.lower():
+        raise ChunkError('The chunk does not match its checksum.')
+
+    try:
+        part = open(path, 'r+b')
+    except IOError:
+        raise ChunkError('No such upload.')
+    try:
+        if fcntl is not None:
+            # Released when the file is closed
+            fcntl.flock(part.fileno(), fcntl.LOCK_EX)
+        part.seek(0, 2)
+        current = part.tell()
+        if offset != current:
+            raise ChunkError('Expected a chunk at offset %d.' % current,
+                             current)
+        if current % size:
+            # Only the last chunk may be smaller than the chunk size
+            raise ChunkError('The upload is already complete.', current)
+        if max_size is not None and current + length > max_size:
+            raise ChunkError('Files must not be larger than %d bytes.'
+                             % max_size, current)
+        chunk.seek(0)
+        copyfileobj(chunk, part, _block_size)
+        return part.tell()
+    finally:
+        part.close()
+
+def finish_upload(upload_id, filename, config):
+    """Mark the given upload as complete.
+
+    :param upload_id: The ID returned by :func:`begin_upload`.
+    :param filename: The name of the file on the client's computer.
+    :param config: The app config dict.
+    :returns: The path of the assembled file, within the upload spool.
+    :raises ChunkError: If there is no such upload.
+
+    """
+    path = _part_path(upload_id, config)
+    ext = os.path.splitext(os.path.basename(filename or ''))[1]
+    if not re.match(r'^\.\w*$', ext):
+        ext = ''
+    final_path = os.path.join(_chunk_dir(config), upload_id + ext)
+    try:
+        os.rename(path, final_path)
+    except OSError:
+        raise ChunkError('No such upload.')
+    return final_path
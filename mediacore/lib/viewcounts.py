@@ -0,0 +1,316 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+View Count Accumulators
+
+Incrementing ``media.views`` with an UPDATE on every page view takes a
+write lock on the request path. The accumulators defined here let the
+page view cost no more than a dict update, and write the aggregated
+deltas back to the database in batches.
+
+The accumulator to use is chosen with the ``view_counter`` config
+directive, see :func:`view_counter_from_config`.
+
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from paste.deploy.converters import asint
+from sqlalchemy import sql
+from sqlalchemy.exc import OperationalError
+
+from mediacore.plugin.abc import AbstractClass, abstractmethod, abstractproperty
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'AbstractViewCounter',
+    'BufferedViewCounter',
+    'DirectViewCounter',
+    'view_counter_from_config',
+]
+
+class AbstractViewCounter(AbstractClass):
+    """
+    Record media views and eventually persist them to ``media.views``.
+    """
+
+    name = abstractproperty()
+    """A string name for the class, as used in the ``view_counter`` config."""
+
+    @abstractmethod
+    def increment(self, media_id, count=1):
+        """Record ``count`` new views for the given media ID."""
+
+    def flush(self):
+        """Write any views that have not yet been persisted.
+
+        Accumulators that write immediately don't need to do anything.
+        """
+
+    def pending(self, media_id):
+        """Return the number of views recorded but not yet persisted."""
+        return 0
+
+    def _write(self, deltas):
+        """Add the given view counts to the ``media.views`` column.
+
+        All rows are updated with a single executemany statement in
+        one transaction, on a connection of its own so that it never
+        interferes with the request's session.
+
+        :param deltas: A dict of media IDs to the views to add.
+        :raises OperationalError: If the database refused the update,
+            for example because of a lock wait timeout.
+
+        """
+        from mediacore.model.media import media
+        from mediacore.model.meta import DBSession
+        if not deltas:
+            return
+        update = media.update()\
+            .where(media.c.id == sql.bindparam('media_id'))\
+            .values(views=media.c.views + sql.bindparam('delta'))
+        params = [{'media_id': media_id, 'delta': delta}
+                  for media_id, delta in deltas.iteritems()]
+        conn = DBSession.bind.connect()
+        try:
+            trans = conn.begin()
+            try:
+                conn.execute(update, params)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        finally:
+            conn.close()
+
+class DirectViewCounter(AbstractViewCounter):
+    """
+    Write every view to the database as soon as it is recorded.
+
+    This is the behaviour MediaCore has always had. It is only
+    recommended for low traffic sites or for debugging.
+    """
+
+    name = 'direct'
+
+    def increment(self, media_id, count=1):
+        try:
+            self._write({media_id: count})
+        except OperationalError, e:
+            # (OperationalError) (1205, 'Lock wait timeout exceeded, try restarting the transaction')
+            # Losing a view is relatively unimportant compared to
+            # rendering the page for the user.
+            if not '1205' in e.message:
+                raise
+            log.warn('Dropped a view for media %r: %s', media_id, e)
+
+AbstractViewCounter.register(DirectViewCounter)
+
+class BufferedViewCounter(AbstractViewCounter):
+    """
+    Aggregate views in process memory and write them in batches.
+
+    Deltas are written by a background thread every ``flush_interval``
+    seconds, or sooner once ``flush_threshold`` views are waiting. The
+    buffer is also flushed when the interpreter exits.
+
+    Should the database be unavailable, the unwritten deltas are kept
+    and retried on the next flush. To keep memory bounded under such
+    conditions, at most ``max_pending`` distinct media IDs are held
+    in the buffer. What happens beyond that depends on ``overflow``:
+
+        ``'flush'``
+            The request that overflows the buffer writes it out
+            synchronously. No views are lost unless that write fails.
+        ``'drop'``
+            New views for media not already in the buffer are discarded
+            until it drains. The request path never touches the database.
+
+    """
+
+    name = 'buffered'
+
+    overflow_policies = ('flush', 'drop')
+
+    def __init__(self, flush_interval=60, flush_threshold=1000,
+                 max_pending=10000, overflow='flush'):
+        if overflow not in self.overflow_policies:
+            raise ValueError('Unrecognized view counter overflow policy: %r'
+                             % overflow)
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.dropped = 0
+        self._deltas = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def increment(self, media_id, count=1):
+        self._ensure_thread()
+        if not self._add(media_id, count, self.overflow):
+            # Make room and then record this view in the emptied buffer.
+            # If the buffer is still full, the flush failed and the view
+            # is dropped rather than retried indefinitely.
+            self.flush()
+            self._add(media_id, count, 'drop')
+
+    def _add(self, media_id, count, overflow):
+        """Add the count to the buffer, returning False if it is full."""
+        self._lock.acquire()
+        try:
+            if media_id not in self._deltas \
+            and len(self._deltas) >= self.max_pending:
+                if overflow == 'drop':
+                    self.dropped += count
+                    return True
+                return False
+            self._deltas[media_id] = self._deltas.get(media_id, 0) + count
+            self._total += count
+            threshold_reached = self._total >= self.flush_threshold
+        finally:
+            self._lock.release()
+        if threshold_reached:
+            self._wakeup.set()
+        return True
+
+    def pending(self, media_id):
+        return self._deltas.get(media_id, 0)
+
+    def flush(self):
+        """Write all buffered deltas to the database.
+
+        Concurrent calls are serialized, so that each delta is written
+        exactly once. If the write fails, the deltas are merged back
+        into the buffer to be retried later.
+
+        """
+        self._flush_lock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                deltas, self._deltas = self._deltas, {}
+                self._total = 0
+            finally:
+                self._lock.release()
+            if not deltas:
+                return
+            try:
+                self._write(deltas)
+            except Exception, e:
+                log.warn('Failed to write %d view counts, will retry: %s',
+                         len(deltas), e)
+                self._requeue(deltas)
+            else:
+                log.debug('Wrote view counts for %d media', len(deltas))
+            if self.dropped:
+                log.warn('Dropped %d views while the view counter buffer '
+                         'was full', self.dropped)
+                self.dropped = 0
+        finally:
+            self._flush_lock.release()
+
+    def _requeue(self, deltas):
+        self._lock.acquire()
+        try:
+            for media_id, delta in deltas.iteritems():
+                self._deltas[media_id] = self._deltas.get(media_id, 0) + delta
+                self._total += delta
+        finally:
+            self._lock.release()
+
+    def _ensure_thread(self):
+        """Start the flushing thread for this process if it isn't running.
+
+        The thread is started lazily so that it is created in each worker
+        of a forking server, rather than in the parent before the fork.
+        """
+        pid = os.getpid()
+        if self._pid == pid and self._thread.isAlive():
+            return
+        self._lock.acquire()
+        try:
+            if self._pid == pid and self._thread.isAlive():
+                return
+            if self._pid != pid:
+                # Forget anything inherited from the parent process,
+                # the parent is responsible for writing it.
+                self._deltas = {}
+                self._total = 0
+            thread = threading.Thread(target=self._run,
+                                      name='mediacore-view-counter')
+            thread.setDaemon(True)
+            thread.start()
+            self._thread = thread
+            self._pid = pid
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Unexpected error while flushing view counts')
+            # Don't spin when the database keeps rejecting writes.
+            time.sleep(1)
+
+AbstractViewCounter.register(BufferedViewCounter)
+
+def view_counter_from_config(config):
+    """Return a new view counter as specified in the given config.
+
+    Recognized options, shown here with their defaults::
+
+        view_counter = buffered
+        view_counter.flush_interval = 60
+        view_counter.flush_threshold = 1000
+        view_counter.max_pending = 10000
+        view_counter.overflow = flush
+
+    Only the ``buffered`` counter accepts these options.
+
+    :param config: The app config dict.
+    :rtype: :class:`AbstractViewCounter` instance
+    :raises ValueError: If the config names an unknown counter.
+
+    """
+    name = config.get('view_counter', 'buffered')
+    for counter_cls in AbstractViewCounter:
+        if counter_cls.name == name:
+            break
+    else:
+        raise ValueError('Unrecognized view_counter: %r' % name)
+
+    if counter_cls is not BufferedViewCounter:
+        return counter_cls()
+    return counter_cls(
+        flush_interval=asint(config.get('view_counter.flush_interval', 60)),
+        flush_threshold=asint(config.get('view_counter.flush_threshold', 1000)),
+        max_pending=asint(config.get('view_counter.max_pending', 10000)),
+        overflow=config.get('view_counter.overflow', 'flush'),
+    )
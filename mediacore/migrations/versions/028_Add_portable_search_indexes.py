@@ -0,0 +1,45 @@
+from sqlalchemy import *
+from migrate import *
+
+# The search engines for PostgreSQL and SQLite keep their own indexes
+# alongside media_fulltext. New databases get them when the table is
+# created, see mediacore.lib.search. Existing media must be indexed with
+# batch-scripts/search/rebuild_fulltext_index.py after this migration.
+
+POSTGRESQL_UPGRADE = [
+    'ALTER TABLE media_fulltext ADD COLUMN public_tsv tsvector',
+    'ALTER TABLE media_fulltext ADD COLUMN admin_tsv tsvector',
+    'CREATE INDEX media_fulltext_public_tsv ON media_fulltext USING gin(public_tsv)',
+    'CREATE INDEX media_fulltext_admin_tsv ON media_fulltext USING gin(admin_tsv)',
+]
+POSTGRESQL_DOWNGRADE = [
+    'DROP INDEX media_fulltext_public_tsv',
+    'DROP INDEX media_fulltext_admin_tsv',
+    'ALTER TABLE media_fulltext DROP COLUMN public_tsv',
+    'ALTER TABLE media_fulltext DROP COLUMN admin_tsv',
+]
+
+SQLITE_UPGRADE = [
+    'CREATE VIRTUAL TABLE media_fulltext_fts_public USING fts3(title, subtitle, tags, categories, description_plain, tokenize=porter)',
+    'CREATE VIRTUAL TABLE media_fulltext_fts_admin USING fts3(title, subtitle, tags, categories, description_plain, notes, tokenize=porter)',
+]
+SQLITE_DOWNGRADE = [
+    'DROP TABLE media_fulltext_fts_public',
+    'DROP TABLE media_fulltext_fts_admin',
+]
+
+def _execute(migrate_engine, statements):
+    for statement in statements.get(migrate_engine.dialect.name, ()):
+        migrate_engine.execute(statement)
+
+def upgrade(migrate_engine):
+    _execute(migrate_engine, {
+        'postgresql': POSTGRESQL_UPGRADE,
+        'sqlite': SQLITE_UPGRADE,
+    })
+
+def downgrade(migrate_engine):
+    _execute(migrate_engine, {
+        'postgresql': POSTGRESQL_DOWNGRADE,
+        'sqlite': SQLITE_DOWNGRADE,
+    })
@@ -0,0 +1,48 @@
+from sqlalchemy import *
+from migrate import *
+
+# Tags and categories now store the number of published media they contain.
+# The counts are calculated by the app the first time they're needed, see
+# mediacore.model.published_counts, when it finds there is no setting for
+# WATERMARK_KEY yet.
+
+WATERMARK_KEY = u'published_counts_updated_on'
+
+metadata = MetaData()
+
+tags = Table('tags', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+categories = Table('categories', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+settings = Table('settings', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('key', Unicode(255), nullable=False, unique=True),
+    Column('value', UnicodeText),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for table in (tags, categories):
+        col = Column('media_count_published', Integer, nullable=False,
+                     server_default='0')
+        col.create(table)
+        Index('ix_%s_media_count_published' % table.name, col).create()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for table in (tags, categories):
+        Index('ix_%s_media_count_published' % table.name,
+              table.c.media_count_published).drop()
+        table.c.media_count_published.drop()
+    migrate_engine.execute(settings.delete()\
+        .where(settings.c.key == WATERMARK_KEY))
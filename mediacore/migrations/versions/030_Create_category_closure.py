@@ -0,0 +1,46 @@
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+categories = Table('categories', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('parent_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE')),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True, index=True),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    connection = migrate_engine.connect()
+    category_closure.create()
+
+    # Every ancestor of each category, including itself at depth 0
+    parents = dict(connection.execute(
+        select([categories.c.id, categories.c.parent_id])))
+    rows = []
+    for id in parents:
+        anc, depth, seen = id, 0, set()
+        while anc in parents and anc not in seen:
+            rows.append({'ancestor_id': anc, 'descendant_id': id,
+                         'depth': depth})
+            seen.add(anc)
+            anc, depth = parents[anc], depth + 1
+    if rows:
+        transaction = connection.begin()
+        connection.execute(category_closure.insert(), rows)
+        transaction.commit()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    category_closure.drop()
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+jobs = Table('jobs', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('type', Unicode(50), nullable=False),
+    Column('status', Unicode(10), nullable=False, default=u'queued', index=True),
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'), index=True),
+    Column('data', Text, nullable=False),
+    Column('progress', Integer, nullable=False, default=0),
+    Column('message', UnicodeText),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('created_on', DateTime, nullable=False, default=datetime.now),
+    Column('started_on', DateTime),
+    Column('finished_on', DateTime),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    jobs.create()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    jobs.drop()
@@ -0,0 +1,33 @@
+from sqlalchemy import *
+from migrate import *
+
+# Media and podcasts now map each thumbnail size to a file in the
+# content-addressed thumbnail store. Existing rows are left NULL, which
+# means their thumbs are still named for their ID. They're moved into the
+# store by batch-scripts/thumbnails/regenerate_thumbs.py.
+
+metadata = MetaData()
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('thumbs', Text),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+podcasts = Table('podcasts', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('thumbs', Text),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for table in (media, podcasts):
+        table.c.thumbs.create()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for table in (media, podcasts):
+        table.c.thumbs.drop()
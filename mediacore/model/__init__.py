@@ -16,10 +16,12 @@
 
 import re
 import simplejson
+import weakref
 
 import webob.exc
 from sqlalchemy import sql, orm
 from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.interfaces import SessionExtension
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import bindparam, ClauseList, ColumnElement
 from sqlalchemy.types import FLOAT, MutableType, Text, TypeDecorator
@@ -40,7 +42,7 @@ SLUG_LENGTH = 100
 
 def init_model(engine, table_prefix=None):
     """Call me before using any of the tables or classes in the model."""
-    DBSession.configure(bind=engine)
+    DBSession.configure(bind=engine, extension=[CommitHookExtension()])
     from mediacore.model import meta
     meta.metadata.bind = engine
     meta.engine = engine
@@ -53,6 +55,80 @@ def init_model(engine, table_prefix=None):
             table.name = table_prefix + table.name
 
 
+class commit_hook(object):
+    """Defer some work until the current transaction is about to commit.
+
+    Decorate a function that accepts a set of keys. During the
+    transaction, keys are collected with :meth:`add`; just before the
+    transaction commits, the function is called once with all of them::
+
+        @commit_hook
+        def reindex(media_ids):
+            ...
+
+        reindex.add(media.id)
+
+    This allows a batch of changes (made over any number of flushes)
+    to be processed with a few statements, rather than a few
+    statements per change. Since the work happens within the same
+    transaction, it is rolled back along with everything else.
+
+    Keys collected in a transaction that is rolled back are kept for
+    the next commit of the same session, so the decorated function
+    must treat its keys as hints: it should recompute whatever it needs
+    from the database rather than assume the keys reflect saved changes.
+
+    """
+    hooks = []
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self._pending = weakref.WeakKeyDictionary()
+        self.hooks.append(self)
+
+    def add(self, *keys):
+        """Queue the given keys for processing in the current session."""
+        session = DBSession()
+        self._pending.setdefault(session, set()).update(keys)
+
+    def __call__(self, keys):
+        return self.func(keys)
+
+    def run(self, session):
+        """Process all the keys queued in the given session, if any."""
+        keys = self._pending.pop(session, None)
+        if keys:
+            self.func(keys)
+
+class after_commit_hook(commit_hook):
+    """Defer some work until the current transaction has committed.
+
+    This works just like :class:`commit_hook`, except that the function
+    is called after the commit, so it cannot use the database. It is
+    meant for discarding cached copies of the data that was changed,
+    which must wait until the change is visible to everyone else.
+
+    """
+    hooks = []
+
+class CommitHookExtension(SessionExtension):
+    """Run all :class:`commit_hook` functions before each commit, and all
+    :class:`after_commit_hook` functions after it."""
+
+    def before_commit(self, session):
+        # Flush now, rather than after this, so that all the observers
+        # queuing work for our hooks have been called.
+        session.flush()
+        for hook in commit_hook.hooks:
+            hook.run(session)
+
+    def after_commit(self, session):
+        for hook in after_commit_hook.hooks:
+            hook.run(session)
+
+
 def fetch_row(mapped_class, pk=None, extra_filter=None, **kwargs):
     """Fetch a single row from the database or else trigger a 404.
 
@@ -259,9 +335,13 @@ class JsonType(MutableType, TypeDecorator):
     impl = Text
 
     def process_bind_param(self, value, dialect, dumps=simplejson.dumps):
+        if value is None:
+            return None
         return dumps(value)
 
     def process_result_value(self, value, dialect, loads=simplejson.loads):
+        if value is None:
+            return None
         return loads(value)
 
     def copy_value(self, value, loads=simplejson.loads, dumps=simplejson.dumps):
@@ -277,6 +357,7 @@ __all__ = [
     'Category',
     'Media', 'MediaFile',
     'Podcast',
+    'Job',
 ]
 
 from mediacore.model.auth import User, Group, Permission
@@ -287,5 +368,6 @@ from mediacore.model.tags import Tag
 from mediacore.model.categories import Category
 from mediacore.model.media import Media, MediaFile
 from mediacore.model.podcasts import Podcast
+from mediacore.model.jobs import Job
 
-from mediacore.model import storage
+from mediacore.model import fulltext, published_counts, storage
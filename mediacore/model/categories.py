@@ -17,12 +17,17 @@ from datetime import datetime
 from sqlalchemy import Table, ForeignKey, Column, sql
 from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, Float
 from sqlalchemy.orm import mapper, relation, backref, synonym, interfaces, validates, Query
+from sqlalchemy.orm import attributes
 from sqlalchemy.orm.attributes import set_committed_value
+from paste.deploy.converters import asbool
+from pylons import app_globals, config
 
 from mediacore.lib.compat import defaultdict
-from mediacore.model import SLUG_LENGTH, slugify
+from mediacore.model import (SLUG_LENGTH, after_commit_hook, commit_hook,
+    slugify)
 from mediacore.model.meta import DBSession, metadata
 from mediacore.plugin import events
+from mediacore.plugin.events import observes
 
 
 categories = Table('categories', metadata,
@@ -30,10 +35,31 @@ categories = Table('categories', metadata,
     Column('name', Unicode(50), nullable=False, index=True),
     Column('slug', Unicode(SLUG_LENGTH), nullable=False, unique=True),
     Column('parent_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE')),
+    Column('media_count_published', Integer, default=0, nullable=False, index=True),
     mysql_engine='InnoDB',
     mysql_charset='utf8'
 )
 
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True, index=True),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+"""Every ancestor of each category, including itself at depth 0.
+
+This is maintained by :func:`update_category_closure`, and is used for
+hierarchy queries when the ``category_closure_index`` config directive
+is enabled.
+"""
+
+def closure_enabled():
+    """Return True if hierarchy queries should use the category_closure table."""
+    return asbool(config.get('category_closure_index', 'false'))
+
 class CategoryNestingException(Exception):
     pass
 
@@ -144,6 +170,16 @@ class Category(object):
 
     def descendants(self):
         """Return a list of descendants in depth-first order."""
+        if self.id is not None and closure_enabled():
+            # Fetch them all at once, and let populated_tree arrange them
+            descendants = Category.query\
+                .join((category_closure,
+                       category_closure.c.descendant_id == Category.id))\
+                .filter(category_closure.c.ancestor_id == self.id)\
+                .filter(category_closure.c.depth > 0)\
+                .order_by(Category.name)\
+                .all()
+            populated_tree([self] + descendants)
         return [desc for desc, depth in self.traverse()]
 
     def ancestors(self):
@@ -162,7 +198,17 @@ class Category(object):
              <Category: grand-parent>,
              <Category: parent>]
 
+        With the ``category_closure_index`` enabled, the ancestors are
+        fetched with a single query instead.
+
         """
+        if self.id is not None and closure_enabled():
+            return CategoryList(Category.query\
+                .join((category_closure,
+                       category_closure.c.ancestor_id == Category.id))\
+                .filter(category_closure.c.descendant_id == self.id)\
+                .filter(category_closure.c.depth > 0)\
+                .order_by(category_closure.c.depth.desc()))
         ancestors = CategoryList()
         anc = self.parent
         while anc:
@@ -175,6 +221,11 @@ class Category(object):
 
     def depth(self):
         """Return this category's distance from the root of the tree."""
+        if self.id is not None and closure_enabled():
+            return DBSession.execute(sql.select(
+                [sql.func.max(category_closure.c.depth)],
+                category_closure.c.descendant_id == self.id,
+            )).scalar() or 0
         return len(self.ancestors())
 
 
@@ -185,3 +236,210 @@ mapper(Category, categories, order_by=categories.c.name, extension=events.Mapper
         collection_class=CategoryList,
         join_depth=2),
 })
+
+def update_category_closure(category_ids):
+    """Rewrite the category_closure rows of the given categories and
+    everything beneath them.
+
+    The rows are calculated from the parent_id of every category, which
+    are loaded with one query. Categories which no longer exist have
+    their rows removed.
+
+    :param category_ids: IDs of categories that were created, moved
+        or deleted.
+
+    """
+    parents = dict(DBSession.execute(
+        sql.select([categories.c.id, categories.c.parent_id])))
+    children = defaultdict(list)
+    for id, parent_id in parents.iteritems():
+        children[parent_id].append(id)
+    subtree = set()
+    pending = list(category_ids)
+    while pending:
+        id = pending.pop()
+        if id not in subtree:
+            subtree.add(id)
+            pending.extend(children[id])
+    subtree = sorted(subtree)
+    for i in xrange(0, len(subtree), 500):
+        DBSession.execute(category_closure.delete(
+            category_closure.c.descendant_id.in_(subtree[i:i + 500])))
+    rows = []
+    for id in subtree:
+        anc, depth, seen = id, 0, set()
+        # Stop at the root, or at circular nesting
+        while anc in parents and anc not in seen:
+            rows.append({'ancestor_id': anc, 'descendant_id': id,
+                         'depth': depth})
+            seen.add(anc)
+            anc, depth = parents[anc], depth + 1
+    if rows:
+        DBSession.execute(category_closure.insert(), rows)
+
+def rebuild_category_closure():
+    """Rewrite the category_closure rows for all categories."""
+    DBSession.execute(category_closure.delete())
+    update_category_closure(
+        [row[0] for row in DBSession.execute(sql.select([categories.c.id]))])
+
+@commit_hook
+def _update_category_closure(category_ids):
+    update_category_closure(category_ids)
+
+@observes(events.Category.after_insert, events.Category.before_delete)
+def _category_added_or_deleted(instance):
+    _update_category_closure.add(instance.id)
+
+@observes(events.Category.before_update)
+def _category_updated(instance):
+    for key in ('parent', 'parent_id'):
+        added, unchanged, deleted = attributes.get_history(instance, key,
+            passive=attributes.PASSIVE_NO_INITIALIZE)
+        if added or deleted:
+            _update_category_closure.add(instance.id)
+            return
+
+class CategoryNode(object):
+    """
+    A read-only copy of a category, as part of a :class:`CategoryTree`.
+
+    This has the same attributes as :class:`Category`, but the
+    relations are plain lists that can be shared between threads.
+    """
+    def __init__(self, id, name, slug, parent_id, media_count_published):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.media_count_published = media_count_published
+        self.parent = None
+        self.children = CategoryList()
+        self.subtree_ids = frozenset()
+        """The IDs of this category and all its descendants."""
+        self.subtree_count = 0
+        """The sum of the published counts of this category and all its
+        descendants."""
+
+    def __repr__(self):
+        return '<CategoryNode: %s>' % self.name
+
+    def __unicode__(self):
+        return self.name
+
+    def traverse(self):
+        """Iterate over all nested categories in depth-first order."""
+        return traverse(self.children)
+
+    def descendants(self):
+        """Return a list of descendants in depth-first order."""
+        return [desc for desc, depth in self.traverse()]
+
+    def ancestors(self):
+        """Return a list of ancestors, starting with the root node."""
+        ancestors = CategoryList()
+        anc = self.parent
+        while anc:
+            ancestors.insert(0, anc)
+            anc = anc.parent
+        return ancestors
+
+class CategoryTree(object):
+    """
+    A snapshot of the entire category hierarchy.
+
+    It's built with a single query and the subtree of each category is
+    worked out once, so that the tree can be shared by every request. Use
+    :func:`category_tree` to get the current one.
+
+    NOTE: As with :func:`populated_tree`, categories nested inside
+          themselves are silently omitted.
+
+    """
+    def __init__(self, rows):
+        """Build the tree from (id, name, slug, parent_id,
+        media_count_published) rows, in the order the children should be
+        listed."""
+        nodes = [CategoryNode(*row) for row in rows]
+        by_id = dict((node.id, node) for node in nodes)
+        self.roots = CategoryList()
+        for node in nodes:
+            parent = by_id.get(node.parent_id)
+            if parent is None:
+                self.roots.append(node)
+            else:
+                node.parent = parent
+                parent.children.append(node)
+        self.nodes = {}
+        for root in self.roots:
+            self._add_subtree(root)
+        self.by_slug = dict((node.slug, node) for node in self.nodes.itervalues())
+        self.counts = dict((node.id, node.subtree_count)
+                           for node in self.nodes.itervalues())
+        """A dict of category IDs to their :attr:`CategoryNode.subtree_count`."""
+
+    def _add_subtree(self, node):
+        self.nodes[node.id] = node
+        ids = set([node.id])
+        count = node.media_count_published
+        for child in node.children:
+            self._add_subtree(child)
+            ids.update(child.subtree_ids)
+            count += child.subtree_count
+        node.subtree_ids = frozenset(ids)
+        node.subtree_count = count
+
+    def get(self, id):
+        return self.nodes.get(id)
+
+    def traverse(self):
+        """Iterate over all categories in depth-first order."""
+        return traverse(self.roots)
+
+_tree_expire = 300
+"""Seconds until the tree is rebuilt, to pick up changes made by other
+processes. Changes made by this process discard it right away."""
+
+def _build_category_tree():
+    query = sql.select([
+        categories.c.id,
+        categories.c.name,
+        categories.c.slug,
+        categories.c.parent_id,
+        categories.c.media_count_published,
+    ]).order_by(categories.c.name)
+    return CategoryTree(DBSession.execute(query))
+
+def _tree_cache():
+    return app_globals.cache.get_cache('category_tree', type='memory',
+                                       expire=_tree_expire)
+
+def category_tree():
+    """Return the current :class:`CategoryTree`, building it if needed.
+
+    Outside of the app, such as in websetup, the tree is never cached.
+
+    """
+    try:
+        cache = _tree_cache()
+    except TypeError:
+        return _build_category_tree()
+    return cache.get(createfunc=_build_category_tree, key=None)
+
+def clear_category_tree():
+    """Discard the cached category tree in this process."""
+    try:
+        cache = _tree_cache()
+    except TypeError:
+        return
+    cache.clear()
+
+@after_commit_hook
+def discard_category_tree(reasons):
+    """Discard the category tree once the changes to it are committed."""
+    clear_category_tree()
+
+@observes(events.Category.after_insert, events.Category.after_update,
+          events.Category.after_delete)
+def _category_changed(instance):
+    discard_category_tree.add('categories')
@@ -0,0 +1,214 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Fulltext Index Maintenance
+
+The ``media_fulltext`` table holds a denormalized copy of the searchable
+text of each media item, including the names of its tags and categories.
+It is kept up to date here by observing changes to media, tags and
+categories, replacing the MySQL triggers we used to depend on.
+
+Only changes to indexed attributes cause any work: view counts, ratings
+and so on never touch the index. The affected media are collected over
+the course of a transaction and their rows rewritten in one batch just
+before it commits.
+
+"""
+from sqlalchemy import sql
+from sqlalchemy.orm import attributes
+
+from mediacore.lib.search import search_engine
+from mediacore.model import commit_hook
+from mediacore.model.meta import DBSession
+from mediacore.model.categories import categories
+from mediacore.model.media import (media, media_categories, media_fulltext,
+    media_tags)
+from mediacore.model.tags import tags
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+__all__ = ['rebuild_fulltext_index', 'update_fulltext_index']
+
+_indexed_media_attrs = (
+    'title', 'subtitle', 'description_plain', 'notes', 'author',
+    'tags', 'categories',
+)
+"""Media attributes which are copied into the fulltext index."""
+
+_batch_size = 500
+"""The maximum number of media to (re)index in a single statement."""
+
+def _changed(instance, keys):
+    """Return True if any of the given attributes have been modified.
+
+    Unloaded collections are not loaded to check, since they can't
+    have been modified.
+
+    """
+    for key in keys:
+        added, unchanged, deleted = attributes.get_history(instance, key,
+            passive=attributes.PASSIVE_NO_INITIALIZE)
+        if added or deleted:
+            return True
+    return False
+
+def _chunks(ids, size=_batch_size):
+    ids = sorted(ids)
+    for i in xrange(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _grouped_names(assoc_table, fk_col, names_table, media_ids):
+    """Return a dict of media IDs to a comma-separated list of names."""
+    query = sql.select(
+        [assoc_table.c.media_id, names_table.c.name],
+        sql.and_(
+            assoc_table.c.media_id.in_(media_ids),
+            fk_col == names_table.c.id,
+        ),
+    ).order_by(names_table.c.name)
+    names = {}
+    for media_id, name in DBSession.execute(query):
+        names.setdefault(media_id, []).append(name)
+    return dict((media_id, u', '.join(names))
+                for media_id, names in names.iteritems())
+
+def _fulltext_rows(media_ids):
+    """Build the ``media_fulltext`` rows for the given media IDs.
+
+    Media which no longer exist are silently skipped.
+    """
+    tag_names = _grouped_names(media_tags, media_tags.c.tag_id,
+                               tags, media_ids)
+    category_names = _grouped_names(media_categories,
+                                    media_categories.c.category_id,
+                                    categories, media_ids)
+    query = sql.select([
+        media.c.id, media.c.title, media.c.subtitle,
+        media.c.description_plain, media.c.notes, media.c.author_name,
+    ], media.c.id.in_(media_ids))
+    rows = []
+    for row in DBSession.execute(query):
+        rows.append({
+            'media_id': row.id,
+            'title': row.title,
+            'subtitle': row.subtitle,
+            'description_plain': row.description_plain,
+            'notes': row.notes,
+            'author_name': row.author_name,
+            'tags': tag_names.get(row.id, u''),
+            'categories': category_names.get(row.id, u''),
+        })
+    return rows
+
+def update_fulltext_index(media_ids):
+    """Rewrite the fulltext rows for the given media IDs.
+
+    Rows for media that have since been deleted are removed. The work
+    is done in batches of a few hundred media, each batch costing one
+    DELETE and one multi-row INSERT regardless of its size. Each batch
+    is then passed on to the search engine, see :mod:`mediacore.lib.search`.
+
+    :param media_ids: Media IDs
+    :type media_ids: iterable of ints
+    :returns: The number of rows written.
+
+    """
+    written = 0
+    for chunk in _chunks(media_ids):
+        rows = _fulltext_rows(chunk)
+        DBSession.execute(media_fulltext.delete(
+            media_fulltext.c.media_id.in_(chunk)))
+        if rows:
+            DBSession.execute(media_fulltext.insert(), rows)
+        search_engine().update(chunk, rows)
+        written += len(rows)
+    return written
+
+def rebuild_fulltext_index():
+    """Discard and recreate the fulltext rows for all media.
+
+    This is intended for initializing the index of an existing site,
+    or for repairing it after the database was edited by hand. It runs
+    in the current transaction, so the caller must commit.
+
+    :returns: The number of rows written.
+
+    """
+    DBSession.execute(media_fulltext.delete())
+    search_engine().clear()
+    media_ids = [row[0] for row in DBSession.execute(sql.select([media.c.id]))]
+    return update_fulltext_index(media_ids)
+
+@commit_hook
+def reindex_media(media_ids):
+    """Reindex all media that were modified in the committing transaction."""
+    update_fulltext_index(media_ids)
+
+@observes(events.Media.after_insert)
+def _media_inserted(instance):
+    reindex_media.add(instance.id)
+
+@observes(events.Media.before_update)
+def _media_updated(instance):
+    if _changed(instance, _indexed_media_attrs):
+        reindex_media.add(instance.id)
+
+@observes(events.Media.before_delete)
+def _media_deleted(instance):
+    # media_fulltext has a foreign key to the media row, so this can't wait.
+    DBSession.execute(media_fulltext.delete(
+        media_fulltext.c.media_id == instance.id))
+    # Let the search engine forget about it when the transaction commits
+    reindex_media.add(instance.id)
+
+def _reindex_tagged(assoc_table, fk_col, instance):
+    """Queue media using the given tag or category for reindexing."""
+    query = sql.select([assoc_table.c.media_id], fk_col == instance.id)
+    media_ids = [row[0] for row in DBSession.execute(query)]
+    if media_ids:
+        reindex_media.add(*media_ids)
+
+def _reindex_matching(fulltext_col, instance):
+    """Queue media whose index mentions the given tag or category name.
+
+    When a tag or category is deleted, its association rows may already
+    be gone by the time we're called, so we find the affected media by
+    name instead. This may match some extra media, which is harmless.
+
+    """
+    query = sql.select([media_fulltext.c.media_id],
+                       fulltext_col.like(u'%' + instance.name + u'%'))
+    media_ids = [row[0] for row in DBSession.execute(query)]
+    if media_ids:
+        reindex_media.add(*media_ids)
+
+@observes(events.Tag.before_update)
+def _tag_updated(instance):
+    if _changed(instance, ['name']):
+        _reindex_tagged(media_tags, media_tags.c.tag_id, instance)
+
+@observes(events.Tag.before_delete)
+def _tag_deleted(instance):
+    _reindex_matching(media_fulltext.c.tags, instance)
+
+@observes(events.Category.before_update)
+def _category_updated(instance):
+    if _changed(instance, ['name']):
+        _reindex_tagged(media_categories, media_categories.c.category_id,
+                        instance)
+
+@observes(events.Category.before_delete)
+def _category_deleted(instance):
+    _reindex_matching(media_fulltext.c.categories, instance)
@@ -0,0 +1,88 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Background Jobs
+
+Work that is too slow to do during a request is recorded as a row in
+the ``jobs`` table, to be picked up by a job runner. See
+:mod:`mediacore.lib.jobs`.
+
+"""
+from datetime import datetime
+
+from sqlalchemy import Table, ForeignKey, Column
+from sqlalchemy.types import DateTime, Integer, Unicode, UnicodeText
+from sqlalchemy.orm import backref, mapper, relation
+
+from mediacore.model import JsonType
+from mediacore.model.media import Media
+from mediacore.model.meta import DBSession, metadata
+
+QUEUED = u'queued'
+RUNNING = u'running'
+DONE = u'done'
+FAILED = u'failed'
+
+jobs = Table('jobs', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('type', Unicode(50), nullable=False),
+    Column('status', Unicode(10), nullable=False, default=QUEUED, index=True),
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'), index=True),
+    Column('data', JsonType, nullable=False, default=dict),
+    Column('progress', Integer, nullable=False, default=0),
+    Column('message', UnicodeText),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('created_on', DateTime, nullable=False, default=datetime.now),
+    Column('started_on', DateTime),
+    Column('finished_on', DateTime),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+class Job(object):
+    """
+    Background Job
+
+    .. attribute:: type
+
+        The :attr:`~mediacore.lib.jobs.AbstractJob.type` of job to run.
+
+    .. attribute:: status
+
+        One of ``queued``, ``running``, ``done`` or ``failed``.
+
+    .. attribute:: data
+
+        A dict of arguments for the job.
+
+    .. attribute:: progress
+
+        An estimate of how much of the job is complete, in percent.
+
+    .. attribute:: message
+
+        What the job is currently doing, or why it failed.
+
+    """
+    query = DBSession.query_property()
+
+    def __repr__(self):
+        return '<Job: %r %s %s>' % (self.id, self.type, self.status)
+
+mapper(Job, jobs, order_by=jobs.c.id, properties={
+    'media': relation(Media,
+        backref=backref('jobs', lazy='dynamic', passive_deletes=True),
+    ),
+})
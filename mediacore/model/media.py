@@ -34,7 +34,6 @@ import os.path
 from datetime import datetime
 
 from sqlalchemy import Table, ForeignKey, Column, sql
-from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import (attributes, backref, class_mapper, column_property,
     composite, dynamic_loader, mapper, Query, relation, validates)
@@ -48,10 +47,12 @@ from mediacore.lib.compat import any
 from mediacore.lib.filetypes import AUDIO, AUDIO_DESC, CAPTIONS, VIDEO, guess_mimetype
 from mediacore.lib.players import pick_any_media_file, pick_podcast_media_file
 from mediacore.lib.xhtml import line_break_xhtml, strip_xhtml
-from mediacore.model import SLUG_LENGTH, _mtm_count_property, _properties_dict_from_labels, MatchAgainstClause
+from mediacore.model import (SLUG_LENGTH, JsonType, _mtm_count_property,
+    _properties_dict_from_labels)
 from mediacore.model.meta import DBSession, metadata
 from mediacore.model.authors import Author
-from mediacore.model.categories import Category, CategoryList, categories
+from mediacore.model.categories import (Category, CategoryList, categories,
+    category_closure, category_tree, closure_enabled)
 from mediacore.model.comments import Comment, CommentQuery, comments
 from mediacore.model.tags import Tag, TagList, tags, extract_tags, fetch_and_create_tags
 from mediacore.plugin import events
@@ -85,6 +86,8 @@ media = Table('media', metadata,
     Column('author_name', Unicode(50), nullable=False),
     Column('author_email', Unicode(255), nullable=False),
 
+    Column('thumbs', JsonType),
+
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -231,34 +234,41 @@ class MediaQuery(Query):
         return self.order_by(Media.popularity_points.desc())
 
     def search(self, search, bool=False, order_by=True):
-        search_cols = _fulltext_indexes['public']
-        return self._search(search_cols, search, bool, order_by)
+        return self._search('public', search, bool, order_by)
 
     def admin_search(self, search, bool=False, order_by=True):
-        search_cols = _fulltext_indexes['admin']
-        return self._search(search_cols, search, bool, order_by)
-
-    def _search(self, search_cols, search, bool=False, order_by=True):
-        if self.session.connection().dialect.name != 'mysql':
-            # TODO: Use this fallback when triggers haven't been installed
-            return self.filter(Media.title.like(search))
-        filter = MatchAgainstClause(search_cols, search, bool)
-        query = self.join(MediaFullText).filter(filter)
-        if order_by:
-            # MySQL automatically orders natural lang searches by relevance,
-            # so override any existing ordering
-            query = query.order_by(None)
-            if bool:
-                # To mimic the same behaviour in boolean mode, we must do an
-                # extra natural language search on our boolean-filtered results
-                relevance = MatchAgainstClause(search_cols, search, bool=False)
-                query = query.order_by(relevance)
-        return query
+        return self._search('admin', search, bool, order_by)
+
+    def _search(self, index, search, bool=False, order_by=True):
+        # XXX: Import here to avoid a circular import, the search engines
+        #      depend on the tables defined in this module.
+        from mediacore.lib.search import search_engine
+        return search_engine().search(self, index, search, bool, order_by)
 
     def in_category(self, cat):
-        all_cats = [cat]
-        all_cats.extend(cat.descendants())
-        all_ids = [c.id for c in all_cats]
+        """Filter for media in the given category or any of its descendants.
+
+        With the ``category_closure_index`` enabled, the descendants are
+        found by the database, using the category_closure table.
+
+        :param cat: A :class:`~mediacore.model.categories.Category` or
+            :class:`~mediacore.model.categories.CategoryNode`.
+
+        """
+        if closure_enabled():
+            return self.filter(sql.exists(sql.select(
+                [media_categories.c.media_id],
+                sql.and_(media_categories.c.media_id == Media.id,
+                         media_categories.c.category_id ==
+                             category_closure.c.descendant_id,
+                         category_closure.c.ancestor_id == cat.id)
+            )))
+        node = category_tree().get(cat.id)
+        if node is not None:
+            all_ids = sorted(node.subtree_ids)
+        else:
+            # The category is newer than the cached tree
+            all_ids = [cat.id] + [desc.id for desc in cat.descendants()]
         return self.filter(sql.exists(sql.select(
             [media_categories.c.media_id],
             sql.and_(media_categories.c.media_id == Media.id,
@@ -396,6 +406,12 @@ class Media(object):
         This was decision was made to make it easier to integrate with
         :class:`mediacore.model.auth.User` down the road.
 
+    .. attribute:: thumbs
+
+        A dict of thumbnail size keys to file names in the thumbnail
+        store, see :mod:`mediacore.lib.thumbnails`. This is ``None`` if
+        the thumbs are still named for the media ID.
+
     **Relations**
 
     .. attribute:: podcast_id
@@ -509,33 +525,19 @@ class Media(object):
     def increment_views(self):
         """Increment the number of views in the database.
 
-        We avoid concurrency issues by incrementing JUST the views and
-        not allowing modified_on to be updated automatically.
+        The view is handed off to the configured view counter, which
+        normally buffers it and writes it along with many others later.
+        This avoids taking a write lock on the media table for every
+        page view.
+
+        See :mod:`mediacore.lib.viewcounts`.
 
         """
         if self.id is None:
             self.views += 1
             return self.views
 
-        # Don't raise an exception should concurrency problems occur.
-        # Views will not actually be incremented in this case, but thats
-        # relatively unimportant compared to rendering the page for the user.
-        # We may be able to remove this after we improve our triggers to not
-        # issue an UPDATE on media_fulltext unless one of its columns are
-        # actually changed. Even when just media.views is updated, all the
-        # columns in the corresponding media_fulltext row are updated, and
-        # media_fulltext's MyISAM engine must lock the whole table to do so.
-        transaction = DBSession.begin_nested()
-        try:
-            DBSession.query(self.__class__)\
-                .filter(self.__class__.id == self.id)\
-                .update({self.__class__.views: self.__class__.views + 1})
-            transaction.commit()
-        except OperationalError, e:
-            transaction.rollback()
-            # (OperationalError) (1205, 'Lock wait timeout exceeded, try restarting the transaction')
-            if not '1205' in e.message:
-                raise
+        app_globals.view_counter.increment(self.id)
 
         # Increment the views by one for the rest of the request,
         # but don't allow the ORM to increment the views too.
@@ -704,34 +706,16 @@ _media_mapper = mapper(
         ),
 })
 
-# Add properties for counting how many media items have a given Tag
+# Add properties for counting how many media items have a given Tag.
+# The published count is stored, see mediacore.model.published_counts
 _tags_mapper = class_mapper(Tag, compile=False)
 _tags_mapper.add_properties(_properties_dict_from_labels(
     _mtm_count_property('media_count', media_tags),
-    _mtm_count_property('media_count_published', media_tags, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= datetime.now(),
-        sql.or_(
-            media.c.publish_until == None,
-            media.c.publish_until >= datetime.now(),
-        ),
-    ]),
 ))
 
-# Add properties for counting how many media items have a given Category
+# Add properties for counting how many media items have a given Category.
+# The published count is stored, see mediacore.model.published_counts
 _categories_mapper = class_mapper(Category, compile=False)
 _categories_mapper.add_properties(_properties_dict_from_labels(
     _mtm_count_property('media_count', media_categories),
-    _mtm_count_property('media_count_published', media_categories, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= datetime.now(),
-        sql.or_(
-            media.c.publish_until == None,
-            media.c.publish_until >= datetime.now(),
-        ),
-    ]),
 ))
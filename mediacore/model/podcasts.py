@@ -29,7 +29,8 @@ from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, F
 from sqlalchemy.orm import mapper, relation, backref, synonym, composite, validates, dynamic_loader, column_property
 from pylons import request
 
-from mediacore.model import Author, SLUG_LENGTH, slugify, get_available_slug
+from mediacore.model import (Author, JsonType, SLUG_LENGTH, slugify,
+    get_available_slug)
 from mediacore.model.meta import DBSession, metadata
 from mediacore.model.media import Media, MediaQuery, media
 from mediacore.plugin import events
@@ -50,6 +51,7 @@ podcasts = Table('podcasts', metadata,
     Column('copyright', Unicode(50)),
     Column('itunes_url', Unicode(80)),
     Column('feedburner_url', Unicode(80)),
+    Column('thumbs', JsonType),
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -107,6 +109,12 @@ class Podcast(object):
         be forwarded to this address -- unless, of course, the request is
         coming from Feedburner.
 
+    .. attribute:: thumbs
+
+        A dict of thumbnail size keys to file names in the thumbnail
+        store, see :mod:`mediacore.lib.thumbnails`. This is ``None`` if
+        the thumbs are still named for the podcast ID.
+
     .. attribute:: media
 
         A dynamic loader for :class:`mediacore.model.media.Media` episodes:
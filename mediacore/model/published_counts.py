@@ -0,0 +1,284 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Published Media Counts
+
+Tags and categories store the number of published media they contain in
+their ``media_count_published`` columns, so that listing them never has
+to count anything.
+
+The counts change in two ways. When media are edited, the tags and
+categories involved are recounted just before the transaction commits.
+When a publish_on or publish_until date passes, nothing is written to
+the database at all, so :func:`update_scheduled_counts` must be called
+to catch up. It is cheap to call: it only touches the database once the
+next scheduled change is due, and then only recounts the tags and
+categories of the media whose publishing window opened or closed.
+
+"""
+import logging
+import threading
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import sql
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import attributes
+
+from mediacore.model import commit_hook
+from mediacore.model.meta import DBSession
+from mediacore.model.categories import (categories, clear_category_tree,
+    discard_category_tree)
+from mediacore.model.media import media, media_categories, media_tags
+from mediacore.model.settings import settings
+from mediacore.model.tags import tags
+from mediacore.plugin import events
+from mediacore.plugin.events import observes
+
+log = logging.getLogger(__name__)
+
+__all__ = ['update_published_counts', 'update_scheduled_counts']
+
+_publishing_attrs = ('reviewed', 'encoded', 'publishable',
+                     'publish_on', 'publish_until', 'tags', 'categories')
+"""Media attributes which can change the counts of its tags and categories."""
+
+_counted = (
+    (tags, media_tags, media_tags.c.tag_id),
+    (categories, media_categories, media_categories.c.category_id),
+)
+
+_watermark_key = u'published_counts_updated_on'
+"""The setting which records when the scheduled changes were last applied."""
+
+_watermark_format = '%Y-%m-%d %H:%M:%S'
+
+_max_check_interval = timedelta(minutes=10)
+"""How long to go without checking the database for newly scheduled media,
+which may have been added by another process."""
+
+_retry_interval = timedelta(minutes=1)
+"""How long to wait before trying again after an error."""
+
+def _publishable():
+    """Criteria for published media, except for the publishing window."""
+    return sql.and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+        media.c.publish_on != None,
+    )
+
+def _published(now):
+    return sql.and_(
+        _publishable(),
+        media.c.publish_on <= now,
+        sql.or_(media.c.publish_until == None,
+                media.c.publish_until >= now),
+    )
+
+def update_published_counts(tag_ids=None, category_ids=None, now=None,
+                            connection=None):
+    """Recount the published media of the given tags and categories.
+
+    Each table is updated with a single statement.
+
+    :param tag_ids: Tag IDs, or a select that returns them. ``None``
+        recounts all tags.
+    :param category_ids: Category IDs, or a select that returns them.
+        ``None`` recounts all categories.
+    :param now: The time to count as of, by default the current time.
+    :param connection: The connection to use, by default the DBSession.
+
+    """
+    if now is None:
+        now = datetime.now()
+    if connection is None:
+        connection = DBSession
+    for (table, assoc_table, fk_col), ids \
+    in zip(_counted, (tag_ids, category_ids)):
+        if ids is not None and not isinstance(ids, sql.expression.Select):
+            ids = list(ids)
+            if not ids:
+                continue
+        count = sql.select(
+            [sql.func.count(sql.text('*'))],
+            sql.and_(
+                fk_col == table.c.id,
+                assoc_table.c.media_id == media.c.id,
+                _published(now),
+            ),
+        ).as_scalar()
+        update = table.update().values(media_count_published=count)
+        if ids is not None:
+            update = update.where(table.c.id.in_(ids))
+        connection.execute(update)
+
+def _recount_for_media(media_ids, now=None, connection=None):
+    """Recount the tags and categories of the given media IDs.
+
+    :param media_ids: Media IDs, or a select that returns them.
+
+    """
+    tag_ids = sql.select([media_tags.c.tag_id],
+                         media_tags.c.media_id.in_(media_ids))
+    category_ids = sql.select([media_categories.c.category_id],
+                              media_categories.c.media_id.in_(media_ids))
+    update_published_counts(tag_ids, category_ids, now, connection)
+
+@commit_hook
+def recount_published(keys):
+    """Recount everything affected by the committing transaction.
+
+    Keys are ``('media', id)`` for media whose current tags and categories
+    need recounting, or ``(table_name, id)`` for a specific tag or category.
+
+    """
+    ids = dict((table.name, []) for table, assoc_table, fk_col in _counted)
+    ids['media'] = []
+    for kind, id in keys:
+        ids[kind].append(id)
+    if ids['media']:
+        _recount_for_media(ids['media'])
+    update_published_counts(ids[tags.name], ids[categories.name])
+    if ids['media'] or ids[categories.name]:
+        discard_category_tree.add('counts')
+
+def _collection_ids(instance, key):
+    """Return the IDs of every tag or category in the collection's history.
+
+    This includes those removed in the current transaction. The collection
+    is not loaded if it hasn't been already.
+
+    """
+    added, unchanged, deleted = attributes.get_history(instance, key,
+        passive=attributes.PASSIVE_NO_INITIALIZE)
+    return [obj.id for obj in (added or []) + (unchanged or []) + (deleted or [])
+            if obj.id is not None]
+
+@observes(events.Media.after_insert)
+def _media_inserted(instance):
+    recount_published.add(('media', instance.id))
+
+@observes(events.Media.before_update)
+def _media_updated(instance):
+    for key in _publishing_attrs:
+        added, unchanged, deleted = attributes.get_history(instance, key,
+            passive=attributes.PASSIVE_NO_INITIALIZE)
+        if added or deleted:
+            break
+    else:
+        return
+    recount_published.add(('media', instance.id))
+    # The media won't be associated with removed tags after the flush
+    recount_published.add(*[(tags.name, id)
+                            for id in _collection_ids(instance, 'tags')])
+    recount_published.add(*[(categories.name, id)
+                            for id in _collection_ids(instance, 'categories')])
+
+@observes(events.Media.before_delete)
+def _media_deleted(instance):
+    # Deleting the media deletes its association rows first, which loads
+    # both collections, so we can tell what it belonged to from them.
+    recount_published.add(*[(tags.name, id)
+                            for id in _collection_ids(instance, 'tags')])
+    recount_published.add(*[(categories.name, id)
+                            for id in _collection_ids(instance, 'categories')])
+
+_next_check = None
+_check_lock = threading.Lock()
+
+def update_scheduled_counts(now=None):
+    """Apply any changes to the counts caused by the passage of time.
+
+    Media whose publish_on or publish_until date has passed since the
+    last time this was called, by any process, have their tags and
+    categories recounted. The first time, everything is recounted.
+
+    This commits its own transaction on a separate connection, so it is
+    safe to call at any point in a request. Until the next publish_on or
+    publish_until date arrives, calls return without touching the database.
+
+    """
+    global _next_check
+    if now is None:
+        now = datetime.now()
+    if _next_check is not None and now < _next_check:
+        return
+    if not _check_lock.acquire(False):
+        # Another thread is already doing the work
+        return
+    try:
+        connection = DBSession.bind.connect()
+        transaction = connection.begin()
+        try:
+            next_change = _apply_scheduled_changes(connection, now)
+            transaction.commit()
+        except SQLAlchemyError:
+            # The counts are not worth failing the request over. This is
+            # most likely another process racing us to the watermark.
+            transaction.rollback()
+            log.exception('Error updating the scheduled published counts')
+            _next_check = now + _retry_interval
+            return
+        finally:
+            connection.close()
+        clear_category_tree()
+        _next_check = now + _max_check_interval
+        if next_change is not None and next_change < _next_check:
+            _next_check = next_change
+    finally:
+        _check_lock.release()
+
+def _apply_scheduled_changes(connection, now):
+    """Recount for changes between the stored watermark and now.
+
+    :returns: The next time a publishing window opens or closes, or None.
+
+    """
+    watermark = connection.execute(sql.select(
+        [settings.c.value], settings.c.key == _watermark_key,
+        for_update=True,
+    )).scalar()
+    if watermark is None:
+        update_published_counts(now=now, connection=connection)
+        connection.execute(settings.insert().values(
+            key=_watermark_key, value=unicode(now.strftime(_watermark_format))))
+    else:
+        last = datetime.strptime(watermark, _watermark_format)
+        if last < now:
+            changed_media = sql.select([media.c.id], sql.and_(
+                _publishable(),
+                sql.or_(
+                    sql.and_(media.c.publish_on > last,
+                             media.c.publish_on <= now),
+                    sql.and_(media.c.publish_until >= last,
+                             media.c.publish_until < now),
+                ),
+            ))
+            _recount_for_media(changed_media, now, connection)
+            connection.execute(settings.update()\
+                .where(settings.c.key == _watermark_key)\
+                .values(value=unicode(now.strftime(_watermark_format))))
+    next_publish = connection.execute(sql.select(
+        [sql.func.min(media.c.publish_on)],
+        sql.and_(_publishable(), media.c.publish_on > now),
+    )).scalar()
+    next_expiry = connection.execute(sql.select(
+        [sql.func.min(media.c.publish_until)],
+        sql.and_(_publishable(), media.c.publish_until >= now),
+    )).scalar()
+    changes = [d for d in (next_publish, next_expiry) if d is not None]
+    return changes and min(changes) or None
@@ -26,6 +26,7 @@ from mediacore.lib.storage import StorageEngine
 from mediacore.model import JsonType
 from mediacore.model.media import MediaFile, MediaFileQuery, media_files
 from mediacore.model.meta import DBSession, metadata
+from mediacore.plugin import events
 
 log = logging.getLogger(__name__)
 
@@ -45,6 +46,7 @@ storage = Table('storage', metadata,
 storage_mapper = mapper(
     StorageEngine, storage,
     polymorphic_on=storage.c.engine_type,
+    extension=events.MapperObserver(events.StorageEngine),
     properties={
         '_data': storage.c.data,
 
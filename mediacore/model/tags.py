@@ -37,6 +37,7 @@ tags = Table('tags', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True),
     Column('name', Unicode(50), unique=True, nullable=False),
     Column('slug', Unicode(SLUG_LENGTH), unique=True, nullable=False),
+    Column('media_count_published', Integer, default=0, nullable=False, index=True),
     mysql_engine='InnoDB',
     mysql_charset='utf8'
 )
@@ -59,6 +60,9 @@ class Tag(object):
 
     .. attribute:: media_count_published
 
+        The number of published media with this tag. This is maintained
+        by :mod:`mediacore.model.published_counts`.
+
     """
     query = DBSession.query_property()
 
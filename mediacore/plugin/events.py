@@ -123,6 +123,7 @@ class Admin(object):
         merge_stubs = Event(['**kwargs'])
         save_thumb = Event(['**kwargs'])
         update_status = Event(['**kwargs'])
+        jobs = Event(['**kwargs'])
 
     class PodcastsController(object):
         index = Event(['**kwargs'])
@@ -145,6 +146,7 @@ class API(object):
     class MediaController(object):
         index = Event(['**kwargs'])
         get = Event(['**kwargs'])
+        related = Event(['**kwargs'])
 
 class CategoriesController(object):
     index = Event(['**kwargs'])
@@ -179,6 +181,8 @@ class UploadController(object):
     index = Event(['**kwargs'])
     submit = Event(['**kwargs'])
     submit_async = Event(['**kwargs'])
+    begin_upload = Event(['**kwargs'])
+    upload_chunk = Event(['**kwargs'])
     success = Event(['**kwargs'])
     failure = Event(['**kwargs'])
 
@@ -257,6 +261,14 @@ class User(object):
     before_update = Event(['instance'])
     after_update = Event(['instance'])
 
+class StorageEngine(object):
+    before_delete = Event(['instance'])
+    after_delete = Event(['instance'])
+    before_insert = Event(['instance'])
+    after_insert = Event(['instance'])
+    before_update = Event(['instance'])
+    after_update = Event(['instance'])
+
 ###############################################################################
 # Forms
 
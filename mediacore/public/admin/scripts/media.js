@@ -35,6 +35,7 @@ var MediaManager = new Class({
 			fileEdited: this.updateStatusForm.bind(this),
 			fileDeleted: this.updateStatusForm.bind(this)
 		});
+		this.jobs = opts.jobs;
 		this.isNew = !!opts.isNew;
 		this.newID = null;
 		this.mergeURL = opts.mergeURL;
@@ -89,6 +90,8 @@ var MediaManager = new Class({
 			this.updateStatusForm(json.status_form);
 		}
 		this.thumbUploader.refreshThumb();
+		// Adding a file may have queued jobs to process or transfer it
+		if (this.jobs) this.jobs.check();
 	},
 
 	onFileEdited: function(json){
@@ -146,6 +149,7 @@ var MediaManager = new Class({
 		});
 		this.files.addForm.action = this.files.addForm.action.replace(find, repl);
 		this.files.options.editURL = this.files.options.editURL.replace(find, repl);
+		if (this.jobs) this.jobs.setURL(this.jobs.options.url.replace(find, repl));
 	},
 
 	updateStatusForm: function(resp){
@@ -706,3 +710,54 @@ var FileList = new Class({
 	}
 
 });
+
+var JobStatus = new Class({
+
+	Implements: [Options],
+
+	options: {
+		box: '',
+		list: '',
+		url: '',
+		interval: 5000 // ms between checks while any job is pending
+	},
+
+	box: null,
+	list: null,
+	req: null,
+	timer: null,
+
+	initialize: function(opts){
+		this.setOptions(opts);
+		this.box = $(this.options.box);
+		this.list = $(this.options.list);
+		this.setURL(this.options.url);
+	},
+
+	setURL: function(url){
+		this.options.url = url;
+		this.req = new Request.JSON({url: url, noCache: true, link: 'cancel'}).addEvents({
+			success: this.update.bind(this)
+		});
+	},
+
+	check: function(){
+		$clear(this.timer);
+		this.req.get();
+	},
+
+	update: function(json){
+		json = json || {jobs: []};
+		this.list.empty();
+		json.jobs.each(function(job){
+			var text = job.type.replace(/_/g, ' ') + ': ' + job.status;
+			if (job.status == 'running') text += ' (' + job.progress + '%)';
+			if (job.message) text += ' \u2013 ' + job.message;
+			new Element('li', {'class': 'job-' + job.status, text: text}).inject(this.list);
+		}, this);
+		if (json.jobs.length) this.box.removeClass('hidden');
+		else this.box.addClass('hidden');
+		if (json.pending) this.timer = this.check.delay(this.options.interval, this);
+	}
+
+});
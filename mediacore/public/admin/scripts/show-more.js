@@ -23,6 +23,7 @@ var ShowMore = new Class({
 		fetchUrl: '', // If no URL is passed the current URL is used
 		page: 1,
 		lastPage: 1,
+		cursor: null, // Continues from the last row of the first page
 		numColumns: null,
 		request: {method: 'get'}
 	},
@@ -35,6 +36,7 @@ var ShowMore = new Class({
 	fetchReq: null,
 	fetchUrl: null,
 	lastLoadedPage: 1,
+	cursor: null,
 	fxTween: null,
 
 	initialize: function(opts){
@@ -43,6 +45,7 @@ var ShowMore = new Class({
 			this.table = $(this.options.table);
 			this.tbody = this.table.getElement('tbody').setStyle('overflow', 'hidden');
 			this.lastLoadedPage = this.options.page;
+			this.cursor = this.options.cursor;
 			this._setupButton();
 		}
 	},
@@ -53,7 +56,9 @@ var ShowMore = new Class({
 			this.fetchReq = new Request.HTML(this.options.request).addEvent('success', this.injectMore.bind(this));
 		}
 		this.lastLoadedPage += 1;
-		this.fetchReq.send({url: this.fetchUrl.setData({page: this.lastLoadedPage}, true).toString()});
+		var data = {page: this.lastLoadedPage};
+		if (this.cursor) data.cursor = this.cursor;
+		this.fetchReq.send({url: this.fetchUrl.setData(data, true).toString()});
 		if (!this.fxTween) {
 			var unlockHeight = function(){ this.tbody.setStyle('height', 'auto'); }.bind(this);
 			this.fxTween = this.tbody.get('tween').addEvent('complete', unlockHeight, true);
@@ -62,6 +67,8 @@ var ShowMore = new Class({
 	},
 
 	injectMore: function(tableTree){
+		this.cursor = this.fetchReq.xhr.getResponseHeader('X-Next-Cursor');
+
 		// temporarily lock the height of the table while we inject the new rows
 		var newHeight = origHeight = this.tbody.getHeight();
 		this.tbody.setStyle('height', origHeight);
@@ -1,3 +1,7 @@
+from datetime import datetime, timedelta
+
+import simplejson
+
 from mediacore.tests import *
 
 class TestApiMediaController(TestController):
@@ -5,3 +9,65 @@ class TestApiMediaController(TestController):
     def test_index(self):
         response = self.app.get(url(controller='api/media', action='index'))
         # Test response...
+
+    def test_index_queries_dont_grow_with_limit(self):
+        from mediacore.lib.apicache import discard_responses
+        from mediacore.lib.storage import add_new_media_file
+        from mediacore.model import Category, DBSession, Setting, Tag
+        tag = Tag(u'api-query-count')
+        category = Category(u'api-query-count')
+        media_list = []
+        for i in range(10):
+            media = self._new_publishable_media(u'api-query-count-%d' % i,
+                                                u'API Query Count %d' % i)
+            media.encoded = True
+            media.publish_on = datetime.now() - timedelta(minutes=i + 1)
+            media.tags = [tag]
+            media.categories = [category]
+            add_new_media_file(media, url=u'http://example.com/qc-%d.mp4' % i)
+            DBSession.add(media)
+            media_list.append(media)
+        DBSession.commit()
+        tag_slug = tag.slug
+        categories = {category.slug: category.name}
+        secret_key = Setting.query.filter_by(key=u'api_secret_key').one().value
+
+        dialect = DBSession.bind.dialect
+        do_execute = dialect.do_execute
+        statements = []
+        def counting_do_execute(cursor, statement, parameters, context=None):
+            statements.append(statement)
+            return do_execute(cursor, statement, parameters, context)
+        def fetch(limit):
+            discard_responses()
+            del statements[:]
+            response = self.app.get(url(controller='api/media',
+                action='index', tag=tag_slug, limit=limit, include_embed=1,
+                secret_key=secret_key))
+            return simplejson.loads(response.body), len(statements)
+
+        try:
+            dialect.do_execute = counting_do_execute
+            # Fill the per-process caches first so both requests see the same
+            fetch(1)
+            fetch(10)
+            one, one_count = fetch(1)
+            ten, ten_count = fetch(10)
+        finally:
+            del dialect.do_execute
+            for media in media_list:
+                DBSession.delete(media)
+            DBSession.delete(tag)
+            DBSession.delete(category)
+            DBSession.commit()
+
+        self.assertEqual(one['count'], 10)
+        self.assertEqual([m['slug'] for m in ten['media']],
+                         [u'api-query-count-%d' % i for i in range(10)])
+        self.assertEqual(one['media'], ten['media'][:1])
+        for info in ten['media']:
+            self.assertEqual(info['categories'], categories)
+            self.assertTrue(info['embed'])
+        self.assertEqual(one_count, ten_count,
+                         '%d queries for 1 item, %d for 10'
+                         % (one_count, ten_count))
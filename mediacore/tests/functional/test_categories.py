@@ -5,3 +5,17 @@ class TestCategoriesController(TestController):
     def test_index(self):
         response = self.app.get(url(controller='categories', action='index'))
         # Test response...
+
+    def test_category_newer_than_tree(self):
+        from mediacore.model import DBSession
+        from mediacore.model.categories import categories
+        # Cache the tree, then add a category the way another process
+        # would, without this process hearing about it.
+        self.app.get(url(controller='categories', action='index'))
+        DBSession.execute(categories.insert().values(
+            name=u'Newer than the tree', slug=u'newer-than-the-tree'))
+        DBSession.commit()
+        self.app.get(url(controller='categories', action='index',
+                         slug='newer-than-the-tree'), status=200)
+        self.app.get(url(controller='categories', action='index',
+                         slug='no-such-category'), status=404)
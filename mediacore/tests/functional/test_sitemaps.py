@@ -0,0 +1,37 @@
+from gzip import GzipFile
+from StringIO import StringIO
+
+from mediacore.tests import *
+from mediacore.lib import jobs
+
+class TestSitemapsController(TestController):
+
+    def setUp(self):
+        # Run the update jobs ourselves, when we're ready for them
+        self._job_runner = jobs.job_runner()
+        jobs.init_jobs({'job_runner': 'worker'})
+        self.app.get(url(controller='sitemaps', action='google'),
+                     status='*')
+        jobs.run_pending_jobs()
+
+    def tearDown(self):
+        jobs._job_runner = self._job_runner
+
+    def test_google(self):
+        response = self.app.get(url(controller='sitemaps', action='google'))
+        assert '<sitemapindex' in response.body
+        links = self.app.get(url(controller='sitemaps', action='google',
+                                 page='0'))
+        assert '<urlset' in links.body
+        assert '<loc>http://localhost/</loc>' in links.body
+
+    def test_mrss(self):
+        response = self.app.get(url(controller='sitemaps', action='mrss'),
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        body = GzipFile(fileobj=StringIO(response.body)).read()
+        assert '<rss' in body
+
+    def test_missing_page(self):
+        self.app.get(url(controller='sitemaps', action='google', page='999'),
+                     status=404)
@@ -1,8 +1,31 @@
+import simplejson
+
 from mediacore.tests import *
+from mediacore.lib import jobs
+from mediacore.lib.compat import sha1
 from mediacore.model import DBSession, Media, fetch_row
+from mediacore.model.jobs import DONE
 
 class TestUploadController(TestController):
 
+    def setUp(self):
+        # Run the upload jobs ourselves, when we're ready for them
+        self._job_runner = jobs.job_runner()
+        jobs.init_jobs({'job_runner': 'worker'})
+
+    def tearDown(self):
+        jobs._job_runner = self._job_runner
+
+    def _run_jobs(self, slug):
+        media = fetch_row(Media, slug=slug)
+        assert len(media.files) == 0
+        assert media.jobs.count() == 1
+        jobs.run_pending_jobs()
+        DBSession.expire_all()
+        media = fetch_row(Media, slug=slug)
+        assert [job.status for job in media.jobs][0] == DONE
+        return media
+
     def test_index(self):
         response = self.app.get(url(controller='upload', action='index'))
         # Test response...
@@ -30,7 +53,7 @@ class TestUploadController(TestController):
         assert response.headers['Content-Type'] == 'application/json'
         assert response.body == '{"redirect": "/upload/success", "success": true}'
 
-        media = fetch_row(Media, slug=u'testing-mp3-async-upload')
+        media = self._run_jobs(u'testing-mp3-async-upload')
         assert len(media.files) == 1
         assert media.files[0].container == 'mp3'
         assert media.description == "<p>actually just testing an mp3 upload.</p>"
@@ -56,7 +79,39 @@ class TestUploadController(TestController):
         assert submit_response.location == 'http://localhost%s' % success_url
 
         # Ensure the media item and file were  created properly.
-        media = fetch_row(Media, slug=u'testing-mp3-upload')
+        media = self._run_jobs(u'testing-mp3-upload')
         assert len(media.files) == 1
         assert media.files[0].container == 'mp3'
         assert media.description == "<p>actually just testing an mp3 upload.</p>"
+
+    def test_chunked_submit(self):
+        fields, files = self._valid_values('testing chunked mp3 upload')
+        data = files[0][2]
+        chunk_url = url(controller='upload', action='upload_chunk')
+
+        response = self.app.post(url(controller='upload',
+                                     action='begin_upload'))
+        upload_id = simplejson.loads(response.body)['upload_id']
+
+        response = self.app.post(chunk_url, params={
+            'upload_id': upload_id,
+            'offset': '0',
+            'checksum': sha1(data).hexdigest(),
+        }, upload_files=[('chunk', 'blob', data)])
+        result = simplejson.loads(response.body)
+        assert result['success']
+        assert result['offset'] == len(data)
+
+        # A client resuming after a dropped response asks for the offset
+        response = self.app.post(chunk_url, params={'upload_id': upload_id})
+        assert simplejson.loads(response.body)['offset'] == len(data)
+
+        fields['upload_id'] = upload_id
+        fields['upload_filename'] = 'filename.mp3'
+        response = self.app.post(url(controller='upload',
+                                     action='submit_async'), params=fields)
+        assert response.body == '{"redirect": "/upload/success", "success": true}'
+
+        media = self._run_jobs(u'testing-chunked-mp3-upload')
+        assert len(media.files) == 1
+        assert media.files[0].container == 'mp3'
@@ -0,0 +1,23 @@
+from mediacore.tests import *
+from mediacore.lib.apicache import response_key
+
+def _key(params, host_url='http://example.com', script_name=''):
+    return response_key(host_url, script_name, '/api/media/index', params)
+
+class TestResponseKey(TestCase):
+
+    def test_normalized_params(self):
+        self.assertEqual(_key([('limit', u'5'), ('tag', u'')]),
+                         _key([('_', u'1273500000'), ('limit', u'5')]))
+        self.assertNotEqual(_key([('limit', u'5')]), _key([('limit', u'6')]))
+        self.assertNotEqual(
+            _key([('limit', u'5')]),
+            response_key('http://example.com', '', '/api/categories/index',
+                         [('limit', u'5')]))
+
+    def test_host(self):
+        self.assertNotEqual(_key([]), _key([], host_url='https://example.com'))
+        self.assertNotEqual(_key([]), _key([], script_name='/mediacore'))
+
+    def test_unknown_params(self):
+        self.assertEqual(_key([('limit', u'5'), ('nonce', u'123')]), None)
@@ -0,0 +1,34 @@
+from mediacore.tests import *
+from mediacore.model.categories import CategoryTree
+
+class TestCategoryTree(TestCase):
+
+    def setUp(self):
+        # (id, name, slug, parent_id, media_count_published)
+        self.tree = CategoryTree([
+            (1, u'Animals', u'animals', None, 2),
+            (2, u'Birds', u'birds', 1, 3),
+            (3, u'Cats', u'cats', 1, 0),
+            (4, u'Kittens', u'kittens', 3, 5),
+            (5, u'Music', u'music', None, 1),
+            (6, u'Loop A', u'loop-a', 7, 1),
+            (7, u'Loop B', u'loop-b', 6, 1),
+        ])
+
+    def test_structure(self):
+        self.assertEqual([node.slug for node in self.tree.roots],
+                         [u'animals', u'music'])
+        kittens = self.tree.by_slug[u'kittens']
+        self.assertEqual([node.slug for node in kittens.ancestors()],
+                         [u'animals', u'cats'])
+        self.assertEqual([node.slug for node, depth in self.tree.traverse()],
+                         [u'animals', u'birds', u'cats', u'kittens', u'music'])
+
+    def test_subtrees(self):
+        self.assertEqual(self.tree.get(1).subtree_ids, frozenset([1, 2, 3, 4]))
+        self.assertEqual(self.tree.get(4).subtree_ids, frozenset([4]))
+        self.assertEqual(self.tree.counts, {1: 10, 2: 3, 3: 5, 4: 5, 5: 1})
+
+    def test_circular_nesting_is_omitted(self):
+        self.assertEqual(self.tree.get(6), None)
+        self.assertEqual(self.tree.by_slug.get(u'loop-a'), None)
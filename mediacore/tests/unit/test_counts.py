@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from mediacore.tests import *
+from mediacore.lib.counts import query_fingerprint
+from mediacore.model import Media
+
+class TestQueryFingerprint(TestCase):
+
+    def test_params(self):
+        self.assertEqual(query_fingerprint(Media.query.filter(Media.id == 1)),
+                         query_fingerprint(Media.query.filter(Media.id == 1)))
+        self.assertNotEqual(
+            query_fingerprint(Media.query.filter(Media.id == 1)),
+            query_fingerprint(Media.query.filter(Media.id == 2)))
+
+    def test_datetimes(self):
+        def published_before(when):
+            return query_fingerprint(
+                Media.query.filter(Media.publish_on <= when))
+        self.assertEqual(published_before(datetime(2010, 5, 1, 12, 30, 5)),
+                         published_before(datetime(2010, 5, 1, 12, 30, 55)))
+        self.assertNotEqual(published_before(datetime(2010, 5, 1, 12, 30)),
+                            published_before(datetime(2010, 5, 1, 12, 31)))
@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+from mediacore.tests import *
+from mediacore.lib.fileserve import FileServingApp, parse_range
+
+class TestParseRange(TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range(None, 100), None)
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 10))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 100))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 100))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 100))
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=100-', 100), False)
+        self.assertEqual(parse_range('bytes=-0', 100), False)
+
+    def test_ignored(self):
+        self.assertEqual(parse_range('bytes=0-9,20-29', 100), None)
+        self.assertEqual(parse_range('bytes=9-0', 100), None)
+        self.assertEqual(parse_range('lines=0-9', 100), None)
+
+class TestFileServingApp(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, '0123456789')
+        os.close(fd)
+        self.app = FileServingApp(self.path, 'video/mp4')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _get(self, **headers):
+        environ = {'REQUEST_METHOD': 'GET'}
+        for name, value in headers.iteritems():
+            environ['HTTP_' + name.upper()] = value
+        result = {}
+        def start_response(status, headers):
+            result['status'] = status
+            result['headers'] = dict(headers)
+        body = ''.join(self.app(environ, start_response))
+        return result['status'], result['headers'], body
+
+    def test_whole_file(self):
+        status, headers, body = self._get()
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertEqual(body, '0123456789')
+
+    def test_range(self):
+        status, headers, body = self._get(range='bytes=2-4')
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(headers['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(body, '234')
+
+        status, headers, body = self._get(range='bytes=20-')
+        self.assertEqual(status, '416 Requested Range Not Satisfiable')
+
+    def test_validators(self):
+        status, headers, body = self._get()
+        etag = headers['ETag']
+        status, headers, body = self._get(if_none_match=etag)
+        self.assertEqual(status, '304 Not Modified')
+        status, headers, body = self._get(range='bytes=2-4', if_range=etag)
+        self.assertEqual(body, '234')
+        status, headers, body = self._get(range='bytes=2-4', if_range='"x"')
+        self.assertEqual(body, '0123456789')
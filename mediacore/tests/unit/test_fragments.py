@@ -0,0 +1,119 @@
+from datetime import datetime
+
+import pylons
+from webob import Request
+from sqlalchemy.exc import SQLAlchemyError
+
+from mediacore.tests import *
+from mediacore.lib.fragments import cached_fragment, discard_fragments
+from mediacore.lib.storage import add_new_media_file
+from mediacore.model import AuthorWithIP, Comment, DBSession
+
+class FakeMedia(object):
+    id = 1
+    modified_on = datetime(2010, 1, 1)
+
+class TestCachedFragment(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        self.renders = []
+        pylons.request._push_object(Request.blank('/',
+                                    base_url='http://example.com'))
+
+    def tearDown(self):
+        pylons.request._pop_object()
+
+    def _request(self, host_url, script_name=''):
+        pylons.request._pop_object()
+        pylons.request._push_object(Request.blank('/',
+                                    base_url=host_url + script_name))
+
+    def _fragment(self, media, name='player', stamp=()):
+        def render():
+            markup = u'<p>%s %s</p>' % (pylons.request.host_url,
+                                        len(self.renders))
+            self.renders.append(markup)
+            return markup
+        return cached_fragment(name, media, render, stamp)
+
+    def test_cached_until_stamp_changes(self):
+        media = FakeMedia()
+        discard_fragments(media.id)
+        first = self._fragment(media, stamp=('a',))
+        self.assertEqual(self._fragment(media, stamp=('a',)), first)
+        self.assertEqual(len(self.renders), 1)
+        self.assertNotEqual(self._fragment(media, stamp=('b',)), first)
+        media.modified_on = datetime(2010, 1, 2)
+        self._fragment(media, stamp=('b',))
+        self.assertEqual(len(self.renders), 3)
+
+    def test_kept_per_host(self):
+        media = FakeMedia()
+        discard_fragments(media.id)
+        first = self._fragment(media)
+        self._request('https://example.com')
+        secure = self._fragment(media)
+        self._request('http://example.com', '/mediacore')
+        mounted = self._fragment(media)
+        self.assertEqual(len(self.renders), 3)
+        self.assert_(first.startswith(u'<p>http://example.com '), first)
+        self.assert_(secure.startswith(u'<p>https://example.com '), secure)
+        self._request('http://example.com')
+        self.assertEqual(self._fragment(media), first)
+        self.assertEqual(len(self.renders), 3)
+
+    def test_discard(self):
+        media = FakeMedia()
+        discard_fragments(media.id)
+        self._fragment(media, 'player')
+        self._fragment(media, 'comments')
+        discard_fragments(media.id, 'comments')
+        self._fragment(media, 'player')
+        self.assertEqual(len(self.renders), 2)
+        self._fragment(media, 'comments')
+        self.assertEqual(len(self.renders), 3)
+
+    def test_discarded_on_commit(self):
+        """Changes to a media, its files and comments discard fragments."""
+        try:
+            media = self._new_publishable_media(u'fragment-discard',
+                                                u'Fragment Discard')
+            DBSession.add(media)
+            DBSession.commit()
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+        def rendered(*names):
+            count = len(self.renders)
+            for name in names:
+                self._fragment(media, name)
+            return len(self.renders) - count
+
+        try:
+            self.assertEqual(rendered('player', 'comments'), 2)
+            self.assertEqual(rendered('player', 'comments'), 0)
+
+            add_new_media_file(media, url=u'http://example.com/movie.mp4')
+            DBSession.flush()
+            # Nothing is discarded before the commit
+            self.assertEqual(rendered('player', 'comments'), 0)
+            DBSession.commit()
+            self.assertEqual(rendered('player'), 1)
+
+            comment = Comment()
+            comment.author = AuthorWithIP(u'Name', u'a@example.com',
+                                          '127.0.0.1')
+            comment.subject = u'Re: Fragment Discard'
+            comment.body = u'Comment'
+            media.comments.append(comment)
+            DBSession.commit()
+            self.assertEqual(rendered('comments'), 1)
+        finally:
+            DBSession.delete(media)
+            DBSession.commit()
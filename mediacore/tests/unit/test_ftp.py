@@ -0,0 +1,202 @@
+import ftplib
+import gettext
+from cStringIO import StringIO
+from urllib2 import URLError
+
+import pylons
+
+from mediacore.tests import *
+from mediacore.lib.compat import sha1
+from mediacore.lib.storage import ftp
+from mediacore.lib.storage.ftp import (FTPConnectionPool, FTPStorage,
+    FTPUploadError)
+
+LOGIN = ('ftp.example.com', 'user', 'secret')
+
+class FakeClock(object):
+    """Stands in for the time module, so tests never actually wait."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeFTP(object):
+    """Records what is done with the session instead of connecting."""
+
+    instances = []
+
+    def __init__(self, *login):
+        self.login = login
+        self.commands = []
+        self.stored = {}
+        self.closed = False
+        self.fail = False
+        FakeFTP.instances.append(self)
+
+    def _check(self, command):
+        self.commands.append(command)
+        if self.fail:
+            raise ftplib.error_temp('421 Timeout')
+
+    def voidcmd(self, command):
+        self._check(command)
+
+    def storbinary(self, command, fp, blocksize, callback):
+        self._check(command)
+        data = fp.read()
+        callback(data)
+        self.stored[command[len('STOR '):]] = data
+
+    def delete(self, path):
+        self._check('DELE ' + path)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+class FakeMediaFile(object):
+    id = 1
+    container = 'mp4'
+
+class FakeUpload(object):
+    filename = 'movie.mp4'
+
+    def __init__(self, data):
+        self.file = StringIO(data)
+
+class FTPTestCase(TestCase):
+
+    def setUp(self):
+        FakeFTP.instances = []
+        self.clock = FakeClock()
+        self._patched = ftp.FTP, ftp.time, ftp.urlopen, ftp._pool
+        ftp.FTP = FakeFTP
+        ftp.time = self.clock
+        ftp._pool = FTPConnectionPool(max_idle=2, max_idle_time=60)
+        # Error messages are translated, outside of any request
+        pylons.translator._push_object(gettext.NullTranslations())
+
+    def tearDown(self):
+        pylons.translator._pop_object()
+        ftp.FTP, ftp.time, ftp.urlopen, ftp._pool = self._patched
+
+class TestFTPConnectionPool(FTPTestCase):
+
+    def setUp(self):
+        FTPTestCase.setUp(self)
+        self.pool = ftp._pool
+
+    def test_reuse(self):
+        session = self.pool.acquire(LOGIN)
+        self.assertEqual(session.login, LOGIN)
+        self.pool.release(LOGIN, session)
+        self.assert_(self.pool.acquire(LOGIN) is session)
+        self.assertEqual(len(FakeFTP.instances), 1)
+        # Recently used sessions are trusted without a NOOP
+        self.assertEqual(session.commands, [])
+
+    def test_no_reuse_after_error(self):
+        session = self.pool.acquire(LOGIN)
+        self.pool.release(LOGIN, session, reuse=False)
+        self.assert_(session.closed)
+        self.assert_(self.pool.acquire(LOGIN) is not session)
+
+    def test_max_idle(self):
+        sessions = [self.pool.acquire(LOGIN) for i in range(3)]
+        for session in sessions:
+            self.pool.release(LOGIN, session)
+        self.assertEqual([s.closed for s in sessions], [False, False, True])
+
+    def test_stale_session_checked(self):
+        session = self.pool.acquire(LOGIN)
+        self.pool.release(LOGIN, session)
+        self.clock.now += 61
+        self.assert_(self.pool.acquire(LOGIN) is session)
+        self.assertEqual(session.commands, ['NOOP'])
+
+    def test_timed_out_session_replaced(self):
+        session = self.pool.acquire(LOGIN)
+        self.pool.release(LOGIN, session)
+        self.clock.now += 61
+        session.fail = True
+        fresh = self.pool.acquire(LOGIN)
+        self.assert_(fresh is not session)
+        self.assert_(session.closed)
+
+    def test_fork_drops_sessions(self):
+        session = self.pool.acquire(LOGIN)
+        self.pool.release(LOGIN, session)
+        self.pool._pid = -1
+        self.assert_(self.pool.acquire(LOGIN) is not session)
+
+class TestFTPStorage(FTPTestCase):
+
+    def setUp(self):
+        FTPTestCase.setUp(self)
+        self.engine = FTPStorage(data=dict(FTPStorage._default_data,
+            ftp_server=LOGIN[0], ftp_username=LOGIN[1], ftp_password=LOGIN[2],
+            ftp_upload_dir='media', http_download_uri='http://example.com/',
+            ftp_max_integrity_retries=4))
+        self.downloads = []
+
+    def _urlopen(self, *responses):
+        """Answer each download with the next response, raising errors."""
+        responses = list(responses)
+        def urlopen(url):
+            self.downloads.append(url)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return StringIO(response)
+        ftp.urlopen = urlopen
+
+    def test_transfer(self):
+        self._urlopen('abc')
+        unique_id = self.engine.transfer(FakeMediaFile(), FakeUpload('abc'))
+        session, = FakeFTP.instances
+        self.assertEqual(session.stored, {'media/' + unique_id: 'abc'})
+        self.assertEqual(self.downloads, ['http://example.com/' + unique_id])
+        # The session went back to the pool
+        self.assert_(ftp._pool.acquire(LOGIN) is session)
+
+    def test_failed_transfer_discards_session(self):
+        session = ftp._pool.acquire(LOGIN)
+        session.fail = True
+        ftp._pool.release(LOGIN, session)
+        self.assertRaises(FTPUploadError, self.engine.transfer,
+                          FakeMediaFile(), FakeUpload('abc'))
+        self.assert_(session.closed)
+        self.assert_(ftp._pool.acquire(LOGIN) is not session)
+
+    def test_integrity_retries_back_off(self):
+        digest = sha1('abc').hexdigest()
+        self._urlopen(URLError('404'), URLError('404'), URLError('404'), 'abc')
+        self.assert_(self.engine._verify_upload_integrity(digest, 'url'))
+        self.assertEqual(self.clock.sleeps, [1, 2, 4])
+
+    def test_integrity_retries_give_up(self):
+        digest = sha1('abc').hexdigest()
+        self.engine._data['ftp_max_integrity_retries'] = 8
+        self._urlopen(*[URLError('404')] * 8)
+        self.assertRaises(FTPUploadError, self.engine._verify_upload_integrity,
+                          digest, 'url')
+        self.assertEqual(len(self.downloads), 8)
+        # No sleep after the last attempt, and the delay is capped
+        self.assertEqual(self.clock.sleeps, [1, 2, 4, 8, 16, 30, 30])
+
+    def test_integrity_mismatch(self):
+        digest = sha1('abc').hexdigest()
+        self._urlopen('abd')
+        self.assertRaises(FTPUploadError, self.engine._verify_upload_integrity,
+                          digest, 'url')
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual(self.clock.sleeps, [])
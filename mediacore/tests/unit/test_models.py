@@ -148,3 +148,126 @@ class TestModels(TestController):
         except SQLAlchemyError, e:
             DBSession.rollback()
             raise e
+
+    def test_fulltext_index_follows_changes(self):
+        """The fulltext index should be updated when indexed data changes."""
+        from mediacore.model import Tag
+        from mediacore.model.media import MediaFullText
+        def indexed(media):
+            return DBSession.query(MediaFullText).get(media.id)
+        try:
+            media = self._new_publishable_media(u'fulltext-index',
+                    u'Fulltext Index')
+            media.tags = [Tag(u'fulltext-tag')]
+            DBSession.add(media)
+            DBSession.commit()
+            row = indexed(media)
+            assert row.title == u'Fulltext Index', row.title
+            assert row.tags == u'fulltext-tag', row.tags
+
+            media.tags[0].name = u'renamed-fulltext-tag'
+            DBSession.commit()
+            DBSession.expire(row)
+            assert row.tags == u'renamed-fulltext-tag', row.tags
+
+            media.title = u'Fulltext Index Renamed'
+            DBSession.commit()
+            DBSession.expire(row)
+            assert row.title == u'Fulltext Index Renamed', row.title
+
+            media_id = media.id
+            DBSession.delete(media)
+            DBSession.commit()
+            assert DBSession.query(MediaFullText).get(media_id) is None
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+    def test_published_counts_follow_changes(self):
+        """Tag counts should be updated as media are published or removed."""
+        from datetime import datetime, timedelta
+        from mediacore.model import Tag
+        from mediacore.model import published_counts
+        from mediacore.model.published_counts import update_scheduled_counts
+        from mediacore.model.settings import settings
+        from sqlalchemy import sql
+        def count(tag):
+            DBSession.expire(tag)
+            return tag.media_count_published
+        # Counting two hours ahead moves the next check and the stored
+        # watermark ahead too, so they're put back afterwards.
+        next_check = published_counts._next_check
+        watermark_key = published_counts._watermark_key
+        watermark = DBSession.execute(sql.select([settings.c.value],
+            settings.c.key == watermark_key)).scalar()
+        try:
+            tag = Tag(u'published-count-tag')
+            media = self._new_publishable_media(u'published-count',
+                    u'Published Count')
+            media.tags = [tag]
+            DBSession.add(media)
+            DBSession.commit()
+            assert count(tag) == 0, "Unencoded media was counted"
+
+            media.encoded = True
+            DBSession.commit()
+            assert count(tag) == 1, tag.media_count_published
+
+            media.publish_until = datetime.now() + timedelta(hours=1)
+            DBSession.commit()
+            update_scheduled_counts(datetime.now() + timedelta(hours=2))
+            assert count(tag) == 0, "Expired media was counted"
+
+            media.publish_until = None
+            media.tags = []
+            DBSession.commit()
+            assert count(tag) == 0, "Untagged media was counted"
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+        finally:
+            published_counts._next_check = next_check
+            if watermark is None:
+                DBSession.execute(settings.delete()
+                    .where(settings.c.key == watermark_key))
+            else:
+                DBSession.execute(settings.update()
+                    .where(settings.c.key == watermark_key)
+                    .values(value=watermark))
+            DBSession.commit()
+
+    def test_category_closure_follows_changes(self):
+        """The category_closure rows should follow categories as they move."""
+        from mediacore.model import Category
+        from mediacore.model.categories import category_closure
+        from sqlalchemy import sql
+        def ancestors(cat):
+            query = sql.select(
+                [category_closure.c.ancestor_id, category_closure.c.depth],
+                category_closure.c.descendant_id == cat.id,
+            ).order_by(category_closure.c.depth)
+            return [tuple(row) for row in DBSession.execute(query)]
+        try:
+            a = Category(u'closure-a')
+            b = Category(u'closure-b')
+            c = Category(u'closure-c')
+            b.parent = a
+            c.parent = b
+            DBSession.add_all([a, b, c])
+            DBSession.commit()
+            assert ancestors(c) == [(c.id, 0), (b.id, 1), (a.id, 2)], \
+                ancestors(c)
+
+            b.parent = None
+            DBSession.commit()
+            assert ancestors(c) == [(c.id, 0), (b.id, 1)], ancestors(c)
+
+            c_id = c.id
+            DBSession.delete(c)
+            DBSession.commit()
+            query = sql.select([category_closure.c.ancestor_id],
+                               category_closure.c.descendant_id == c_id)
+            assert DBSession.execute(query).fetchall() == []
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pylons
+from sqlalchemy.exc import SQLAlchemyError
+
+from mediacore.tests import *
+from mediacore.lib.paginate import (KeysetPage, _decode_cursor,
+    _encode_cursor, _keyset_order, _seek_clause)
+from mediacore.model import DBSession, Media
+
+class TestKeysetCursors(TestCase):
+
+    def test_round_trip(self):
+        publish_on = datetime(2010, 5, 1, 12, 30, 0, 1234)
+        cursor = _encode_cursor(u'-publish_on,-id', 3, 95, True,
+                                [publish_on, 42])
+        state = _decode_cursor(cursor)
+        self.assertEqual(state['order'], u'-publish_on,-id')
+        self.assertEqual(state['page'], 3)
+        self.assertEqual(state['count'], 95)
+        self.assert_(state['forward'])
+        self.assertEqual(state['key'], [publish_on, 42])
+
+    def test_invalid(self):
+        self.assertEqual(_decode_cursor(None), None)
+        self.assertEqual(_decode_cursor('not a cursor'), None)
+        self.assertEqual(_decode_cursor(_encode_cursor(u'id', 1, 1, True, [5])
+                                        [:-4]), None)
+
+class TestKeysetOrder(TestCase):
+
+    def test_tie_breaker(self):
+        order = _keyset_order(Media.query.order_by(Media.publish_on.desc()))
+        self.assertEqual([(column.key, descending)
+                          for column, descending in order],
+                         [('publish_on', True), ('id', True)])
+
+    def test_unsupported(self):
+        # Ordered by the mapper's default
+        self.assertEqual(_keyset_order(Media.query), None)
+        self.assertEqual(_keyset_order([1, 2, 3]), None)
+
+class TestSeekClause(TestCase):
+
+    def _clause(self, key, nulls_high):
+        order = [(Media.publish_on, True), (Media.id, True)]
+        return str(_seek_clause(order, key, nulls_high))
+
+    def test_nulls_low(self):
+        # MySQL and SQLite put drafts last when sorting by publish_on desc
+        self.assert_('publish_on IS NULL' in
+                     self._clause([datetime(2010, 5, 1), 5], False))
+        self.assert_('publish_on IS NOT NULL' not in
+                     self._clause([None, 5], False))
+
+    def test_nulls_high(self):
+        # PostgreSQL puts them first
+        self.assert_('publish_on IS NULL' not in
+                     self._clause([datetime(2010, 5, 1), 5], True))
+        self.assert_('publish_on IS NOT NULL' in
+                     self._clause([None, 5], True))
+
+class TestKeysetPage(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        # Ties at two dates, and drafts with no date at all
+        dates = [datetime(2010, 5, 1)] * 3 + [datetime(2010, 4, 1)] * 2 \
+            + [None] * 2
+        try:
+            self.media = []
+            for i, publish_on in enumerate(dates):
+                media = self._new_publishable_media(u'keyset-%d' % i,
+                                                    u'Keyset %d' % i)
+                media.publish_on = publish_on
+                DBSession.add(media)
+                self.media.append(media)
+            DBSession.commit()
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+    def tearDown(self):
+        for media in self.media:
+            DBSession.delete(media)
+        DBSession.commit()
+
+    def _query(self, descending):
+        column = descending and Media.publish_on.desc() \
+            or Media.publish_on.asc()
+        return Media.query.filter(Media.slug.like(u'keyset-%'))\
+            .order_by(column)
+
+    def _test_paging(self, descending):
+        # The order the database itself gives, read with an OFFSET
+        expected = [m.id for m in KeysetPage(self._query(descending),
+                                             items_per_page=100)]
+        self.assertEqual(len(expected), len(self.media))
+
+        page = KeysetPage(self._query(descending), items_per_page=2)
+        pages = [[m.id for m in page]]
+        while page.next_cursor:
+            page = KeysetPage(self._query(descending), items_per_page=2,
+                              cursor=page.next_cursor)
+            pages.append([m.id for m in page])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(page.page, 4)
+
+        backwards = [[m.id for m in page]]
+        while page.previous_cursor:
+            page = KeysetPage(self._query(descending), items_per_page=2,
+                              cursor=page.previous_cursor)
+            backwards.insert(0, [m.id for m in page])
+        self.assertEqual(backwards, pages)
+        self.assertEqual(page.page, 1)
+
+    def test_paging_descending(self):
+        self._test_paging(True)
+
+    def test_paging_ascending(self):
+        self._test_paging(False)
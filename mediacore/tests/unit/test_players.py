@@ -0,0 +1,62 @@
+import pylons
+from routes.util import URLGenerator
+from sqlalchemy.exc import SQLAlchemyError
+
+from mediacore.tests import *
+from mediacore.lib.players import manager
+from mediacore.lib.sitemaps import _url_environ
+from mediacore.lib.storage import LocalFileStorage
+from mediacore.model import DBSession, MediaFile
+
+class TestPlayerSelection(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def _http_uri(self, media, host_url, script_name=''):
+        generator = URLGenerator(pylons.config['routes.map'],
+                                 _url_environ(host_url, script_name))
+        pylons.url._push_object(generator)
+        try:
+            uris, chosen = manager().selection(media)
+        finally:
+            pylons.url._pop_object(generator)
+        http_uris = [uri.file_uri for uri in uris if uri.scheme == 'http']
+        self.assertEqual(len(http_uris), 1)
+        return http_uris[0]
+
+    def test_selection_per_host(self):
+        """Local files are served from whichever host the page is for."""
+        try:
+            media = self._new_publishable_media(u'player-selection-hosts',
+                                                u'Player Selection Hosts')
+            media_file = MediaFile()
+            media_file.storage = DBSession.query(LocalFileStorage).first()
+            media_file.type = u'video'
+            media_file.container = u'mp4'
+            media_file.display_name = u'movie.mp4'
+            media_file.unique_id = u'player-selection-hosts.mp4'
+            media.files.append(media_file)
+            DBSession.add(media)
+            DBSession.commit()
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+        try:
+            first = self._http_uri(media, 'http://one.example.com')
+            second = self._http_uri(media, 'https://two.example.com',
+                                    '/mediacore')
+            # The first selection is cached, and must not leak through
+            again = self._http_uri(media, 'http://one.example.com')
+        finally:
+            DBSession.delete(media)
+            DBSession.commit()
+
+        self.assert_(first.startswith('http://one.example.com/'), first)
+        self.assert_(second.startswith('https://two.example.com/mediacore/'),
+                     second)
+        self.assertEqual(again, first)
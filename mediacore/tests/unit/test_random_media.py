@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+import pylons
+from sqlalchemy.exc import SQLAlchemyError
+
+from mediacore.tests import *
+from mediacore.lib import random_media
+from mediacore.lib.random_media import (_load_pool, _pick,
+    clear_random_media_pool, random_published_media)
+from mediacore.model import DBSession
+
+NOW = datetime(2010, 5, 1, 12, 0)
+HOUR = timedelta(hours=1)
+
+class TestPick(TestCase):
+
+    def test_window(self):
+        pool = (
+            (1, NOW - HOUR, None),              # published
+            (2, NOW + HOUR, None),              # scheduled
+            (3, NOW - 2 * HOUR, NOW - HOUR),    # expired since it loaded
+            (4, NOW - HOUR, NOW + HOUR),        # published until later
+        )
+        picked = set(_pick(pool, NOW) for i in range(100))
+        self.assertEqual(picked, set([1, 4]))
+
+    def test_nothing_live(self):
+        self.assertEqual(_pick((), NOW), None)
+        self.assertEqual(_pick(((2, NOW + HOUR, None),), NOW), None)
+
+    def test_mostly_scheduled(self):
+        # Random picks would rarely find the one live entry
+        pool = tuple((i, NOW + HOUR, None) for i in range(1, 100)) \
+            + ((100, NOW - HOUR, None),)
+        for i in range(10):
+            self.assertEqual(_pick(pool, NOW), 100)
+
+class TestRandomPublishedMedia(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        now = datetime.now()
+        windows = [
+            (u'random-published', now - HOUR, None, True),
+            (u'random-scheduled', now + HOUR, None, True),
+            (u'random-expired', now - 2 * HOUR, now - HOUR, True),
+            (u'random-unreviewed', now - HOUR, None, False),
+        ]
+        try:
+            self.media = {}
+            for slug, publish_on, publish_until, reviewed in windows:
+                media = self._new_publishable_media(slug, slug)
+                media.encoded = True
+                media.reviewed = reviewed
+                media.publish_on = publish_on
+                media.publish_until = publish_until
+                DBSession.add(media)
+                self.media[slug] = media
+            DBSession.commit()
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+        self.loads = []
+        self._load_pool = random_media._load_pool
+        clear_random_media_pool()
+
+    def tearDown(self):
+        random_media._load_pool = self._load_pool
+        clear_random_media_pool()
+        for media in self.media.itervalues():
+            DBSession.delete(media)
+        DBSession.commit()
+
+    def _fake_pools(self, *pools):
+        """Answer each reload of the pool with the next of these."""
+        pools = list(pools)
+        def load_pool():
+            self.loads.append(True)
+            return pools.pop(0)
+        random_media._load_pool = load_pool
+
+    def _entry(self, slug):
+        media = self.media[slug]
+        return (media.id, media.publish_on, media.publish_until)
+
+    def test_pool_window(self):
+        ids = set(entry[0] for entry in _load_pool())
+        self.assert_(self.media[u'random-published'].id in ids)
+        self.assert_(self.media[u'random-scheduled'].id in ids)
+        self.assert_(self.media[u'random-expired'].id not in ids)
+        self.assert_(self.media[u'random-unreviewed'].id not in ids)
+
+    def test_scheduled_media_not_picked(self):
+        self._fake_pools((self._entry(u'random-published'),
+                          self._entry(u'random-scheduled')))
+        for i in range(20):
+            self.assertEqual(random_published_media(),
+                             self.media[u'random-published'])
+        # The pool was only loaded once
+        self.assertEqual(len(self.loads), 1)
+
+    def test_empty_pool(self):
+        self._fake_pools(())
+        self.assertEqual(random_published_media(), None)
+
+    def test_retry_after_unpublished(self):
+        # The pool still has an entry that has since been unpublished
+        published = self.media[u'random-published']
+        self._fake_pools((self._entry(u'random-unreviewed'),),
+                         (self._entry(u'random-published'),))
+        self.assertEqual(random_published_media(), published)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_retry_after_deleted(self):
+        deleted = self._entry(u'random-published')
+        DBSession.delete(self.media.pop(u'random-published'))
+        DBSession.commit()
+        self._fake_pools((deleted,), (deleted,))
+        # Gives up after reloading the pool once
+        self.assertEqual(random_published_media(), None)
+        self.assertEqual(len(self.loads), 2)
@@ -0,0 +1,125 @@
+import time
+
+import pylons
+from sqlalchemy.exc import SQLAlchemyError
+
+from mediacore.tests import *
+from mediacore.lib import related
+from mediacore.lib.related import (_BackgroundRefresher, _related_cache,
+    related_media, related_media_ids)
+from mediacore.model import DBSession
+
+class TestRelatedMedia(TestController):
+
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        self.searches = []
+        self._search_related = related._search_related
+        self._refresher = related._refresher
+        related._refresher = _BackgroundRefresher(2, threaded=False)
+        try:
+            self.media = []
+            for slug, title in [
+                    (u'related-zebra-crossing', u'Zebra crossing guide'),
+                    (u'related-zebra-tips', u'Zebra crossing tips'),
+                    (u'related-unrelated', u'Something else entirely')]:
+                media = self._new_publishable_media(slug, title)
+                media.encoded = True
+                DBSession.add(media)
+                self.media.append(media)
+            DBSession.commit()
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+        _related_cache().clear()
+
+    def tearDown(self):
+        related._search_related = self._search_related
+        related._refresher = self._refresher
+        for media in self.media:
+            DBSession.delete(media)
+        DBSession.commit()
+
+    def _count_searches(self, results=None):
+        """Count searches, and optionally fake their results."""
+        def search_related(media_id):
+            self.searches.append(media_id)
+            if results is None:
+                return self._search_related(media_id)
+            return results
+        related._search_related = search_related
+
+    def _age(self, media, seconds):
+        cache = _related_cache()
+        computed_on, ids = cache.get_value(str(media.id))
+        cache.set_value(str(media.id), (computed_on - seconds, ids))
+
+    def test_search_is_cached(self):
+        zebra, tips, other = self.media
+        self._count_searches()
+        ids = related_media_ids(zebra)
+        self.assert_(tips.id in ids, ids)
+        self.assert_(other.id not in ids, ids)
+        self.assertEqual(related_media_ids(zebra), ids)
+        self.assertEqual(self.searches, [zebra.id])
+
+    def test_unpublished_media_are_left_out(self):
+        zebra, tips, other = self.media
+        self._count_searches((tips.id, other.id))
+        self.assertEqual(related_media(zebra), [tips, other])
+        tips.publishable = False
+        DBSession.commit()
+        # The cached IDs still include it, but it isn't shown
+        self.assertEqual(related_media_ids(zebra), (tips.id, other.id))
+        self.assertEqual(related_media(zebra), [other])
+
+    def test_stale_ids_refreshed_in_background(self):
+        zebra, tips, other = self.media
+        self._count_searches((tips.id,))
+        related_media_ids(zebra)
+        self._age(zebra, related._refresh_interval + 1)
+        self._count_searches((tips.id, other.id))
+        # The stale IDs are still used, and only one search is queued
+        self.assertEqual(related_media_ids(zebra), (tips.id,))
+        self.assertEqual(related_media_ids(zebra), (tips.id,))
+        self.assertEqual(self.searches, [])
+        related._refresher.run_queued()
+        self.assertEqual(self.searches, [zebra.id])
+        self.assertEqual(related_media_ids(zebra), (tips.id, other.id))
+
+    def test_refresh_queue_is_bounded(self):
+        self._count_searches(())
+        for media in self.media:
+            related_media_ids(media)
+            self._age(media, related._refresh_interval + 1)
+        self.searches = []
+        for media in self.media:
+            related_media_ids(media)
+        related._refresher.run_queued()
+        # The third didn't fit, and is left for its next view
+        self.assertEqual(self.searches, [m.id for m in self.media[:2]])
+        self.assertEqual(related._refresher.refresh(_related_cache(),
+                                                    self.media[2].id), True)
+
+    def test_discarded_when_title_changes(self):
+        zebra, tips, other = self.media
+        self._count_searches(())
+        related_media_ids(zebra)
+        related_media_ids(tips)
+        zebra.description = u'<p>Not searched</p>'
+        DBSession.commit()
+        related_media_ids(zebra)
+        self.assertEqual(len(self.searches), 2)
+        zebra.title = u'Zebra crossing manual'
+        DBSession.flush()
+        related_media_ids(zebra)
+        self.assertEqual(len(self.searches), 2)
+        DBSession.commit()
+        related_media_ids(zebra)
+        related_media_ids(tips)
+        self.assertEqual(self.searches, [zebra.id, tips.id, zebra.id])
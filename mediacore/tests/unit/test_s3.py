@@ -0,0 +1,81 @@
+from cStringIO import StringIO
+
+from formencode.api import Invalid
+from nose.plugins.skip import SkipTest
+
+from mediacore.tests import *
+from mediacore.forms.admin.storage.s3 import URLExpiresValidator
+from mediacore.lib.storage import s3
+from mediacore.lib.storage.s3 import AmazonS3Storage
+
+try:
+    from moto import mock_s3
+except ImportError:
+    mock_s3 = None
+
+class FakeMediaFile(object):
+    id = 1
+    container = 'mp4'
+
+class FakeUpload(object):
+    filename = 'movie.mp4'
+
+    def __init__(self, data):
+        self.file = StringIO(data)
+
+class TestAmazonS3Storage(TestCase):
+    """Test against moto's in-memory stand-in for S3."""
+
+    def setUp(self):
+        if mock_s3 is None or s3.S3Connection is None:
+            raise SkipTest('boto and moto are required.')
+        self.mock = mock_s3()
+        self.mock.start()
+        self.engine = AmazonS3Storage(data=dict(AmazonS3Storage._default_data,
+            s3_access_key='key', s3_secret_key='secret', s3_bucket='media'))
+        self.bucket = self.engine._connection().create_bucket('media')
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_small_upload(self):
+        unique_id = self.engine.store(FakeMediaFile(), FakeUpload('abc'))
+        self.assertEqual(unique_id, u'1-movie.mp4')
+        key = self.bucket.get_key(unique_id)
+        self.assertEqual(key.get_contents_as_string(), 'abc')
+
+    def test_multipart_upload(self):
+        data = ''.join(chr(i % 256) * s3._part_size for i in range(2)) + 'end'
+        unique_id = self.engine.store(FakeMediaFile(), FakeUpload(data))
+        key = self.bucket.get_key(unique_id)
+        self.assertEqual(key.get_contents_as_string(), data)
+
+    def test_uris(self):
+        media_file = FakeMediaFile()
+        media_file.unique_id = u'1-movie.mp4'
+        uri, = self.engine.get_uris(media_file)
+        self.assert_(uri.file_uri.endswith('1-movie.mp4'))
+
+        self.engine._data['cloudfront_http'] = 'http://cdn.example.com/'
+        uri, = self.engine.get_uris(media_file)
+        self.assertEqual(uri.file_uri, 'http://cdn.example.com/1-movie.mp4')
+
+class TestURLExpiresValidator(TestCase):
+
+    def test_range(self):
+        validator = URLExpiresValidator()
+        self.assertEqual(validator.to_python('0'), 0)
+        self.assertEqual(validator.to_python('7200'), 7200)
+        self.assertRaises(Invalid, validator.to_python, '3600')
+        self.assertRaises(Invalid, validator.to_python, '-1')
+
+class TestURIsExpire(TestCase):
+
+    def test_signed_urls_expire(self):
+        engine = AmazonS3Storage(data=dict(AmazonS3Storage._default_data))
+        self.assertFalse(engine.uris_expire)
+        engine._data['s3_url_expires'] = 7200
+        self.assertTrue(engine.uris_expire)
+        # CloudFront URLs aren't signed
+        engine._data['cloudfront_http'] = 'http://cdn.example.com/'
+        self.assertFalse(engine.uris_expire)
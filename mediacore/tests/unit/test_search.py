@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+
+from mediacore.tests import *
+from mediacore.lib.search import inverted, parse_search
+from mediacore.lib.search.inverted import (InvertedIndex,
+    InvertedIndexSearchEngine)
+
+def _row(media_id, title, tags=u'', notes=u''):
+    return {
+        'media_id': media_id,
+        'title': title,
+        'subtitle': None,
+        'description_plain': u'',
+        'notes': notes,
+        'author_name': u'Author',
+        'tags': tags,
+        'categories': u'',
+    }
+
+class TestParseSearch(TestCase):
+
+    def test_natural_mode_ignores_operators(self):
+        required, optional, excluded = parse_search(u'+Cats -dogs bird*')
+        self.assertEqual(required, [])
+        self.assertEqual(excluded, [])
+        self.assertEqual(optional,
+                         [(u'cats', False), (u'dogs', False), (u'bird', False)])
+
+    def test_boolean_mode(self):
+        required, optional, excluded = parse_search(u'+Cats -dogs bird*', True)
+        self.assertEqual(required, [(u'cats', False)])
+        self.assertEqual(optional, [(u'bird', True)])
+        self.assertEqual(excluded, [(u'dogs', False)])
+
+class TestInvertedIndex(TestCase):
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(_row(1, u'Cats and dogs', u'pets'))
+        self.index.add(_row(2, u'Running dogs', u'dogs, sports'))
+        self.index.add(_row(3, u'Birds', u'pets', notes=u'secret'))
+
+    def test_ranking(self):
+        self.assertEqual(self.index.search('public', u'dogs'), [2, 1])
+
+    def test_boolean_operators(self):
+        self.assertEqual(self.index.search('public', u'+pets -cats', True), [3])
+        self.assertEqual(self.index.search('public', u'+run*', True), [2])
+
+    def test_admin_only_columns(self):
+        self.assertEqual(self.index.search('public', u'secret'), [])
+        self.assertEqual(self.index.search('admin', u'secret'), [3])
+
+    def test_replace_and_remove(self):
+        self.index.add(_row(1, u'Cats'))
+        self.assertEqual(self.index.search('public', u'dogs'), [2])
+        self.index.remove(2)
+        self.assertEqual(self.index.search('public', u'dogs'), [])
+
+class TestInvertedIndexJournal(TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.rows = {}
+        self._committed_rows = inverted._committed_rows
+        inverted._committed_rows = lambda media_ids: \
+            [self.rows[id] for id in media_ids if id in self.rows]
+
+    def tearDown(self):
+        inverted._committed_rows = self._committed_rows
+        shutil.rmtree(self.index_dir)
+
+    def _engine(self, journal_size=2):
+        return InvertedIndexSearchEngine({
+            'search_engine.index_dir': self.index_dir,
+            'search_engine.journal_size': journal_size,
+        }, None)
+
+    def _change(self, engine, media_id, title):
+        if title is None:
+            del self.rows[media_id]
+        else:
+            self.rows[media_id] = _row(media_id, title)
+        engine.apply_committed([media_id])
+
+    def test_other_process_replays_journal(self):
+        writer, reader = self._engine(), self._engine()
+        self._change(writer, 1, u'Cats')
+        self.assertEqual(reader._current().search('public', u'cats'), [1])
+        snapshot = os.stat(writer.path).st_ino
+        self._change(writer, 2, u'More cats')
+        self._change(writer, 1, None)
+        # Both changes were appended, the snapshot was left alone
+        self.assertEqual(os.stat(writer.path).st_ino, snapshot)
+        self.assertEqual(reader._current().search('public', u'cats'), [2])
+
+    def test_compaction(self):
+        writer, reader = self._engine(), self._engine()
+        for media_id in (1, 2, 3, 4):
+            self._change(writer, media_id, u'Dogs')
+        # The fourth change found two journaled and rewrote the snapshot
+        self.assertFalse(os.path.exists(writer.journal_path))
+        self.assertEqual(writer._journal_entries, 0)
+        self.assertEqual(sorted(reader._current().search('public', u'dogs')),
+                         [1, 2, 3, 4])
+        self.assertEqual(sorted(self._engine()._current()\
+                                .search('public', u'dogs')), [1, 2, 3, 4])
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+from urllib2 import URLError
+
+from mediacore.tests import *
+from mediacore.lib.storage import (candidate_engines, fetch_url,
+    LocalFileStorage, RemoteURLStorage, VimeoStorage, YoutubeStorage)
+
+class TestCandidateEngines(TestCase):
+
+    def setUp(self):
+        self.local = LocalFileStorage()
+        self.youtube = YoutubeStorage()
+        self.vimeo = VimeoStorage()
+        self.remote = RemoteURLStorage()
+        self.engines = [self.local, self.youtube, self.vimeo, self.remote]
+
+    def _candidates(self, **kwargs):
+        return list(candidate_engines(self.engines, **kwargs))
+
+    def test_url_dispatch(self):
+        self.assertEqual(
+            self._candidates(url=u'http://www.youtube.com/watch?v=abc'),
+            [self.local, self.youtube, self.remote])
+        self.assertEqual(
+            self._candidates(url=u'http://vimeo.com/1234'),
+            [self.local, self.vimeo, self.remote])
+        self.assertEqual(
+            self._candidates(url=u'http://example.com/movie.mp4'),
+            [self.local, self.remote])
+
+    def test_file(self):
+        self.assertEqual(self._candidates(file=object()),
+                         [self.local, self.remote])
+
+class TestFetchURL(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, '{"title": "Example"}')
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_fetch(self):
+        url = u'file://' + self.path
+        self.assertEqual(fetch_url(url), '{"title": "Example"}')
+
+    def test_failure(self):
+        os.remove(self.path)
+        self.assertRaises(URLError, fetch_url, 'file://' + self.path)
@@ -0,0 +1,192 @@
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+from pylons import config
+
+from mediacore.tests import *
+from mediacore.lib import thumbnails
+from mediacore.lib.thumbnails import (default_thumbs, delete_thumbs,
+    init_thumbs, remove_unused_thumbs, render_thumbs, resize_thumbs,
+    store_thumb, stored_thumb_path, thumb, thumb_store_dir)
+
+class TestResizeThumbs(TestCase):
+
+    def test_sizes(self):
+        img = Image.new('RGB', (1280, 720))
+        sizes = [(128, 72), (560, 315), (160, 90)]
+        resized = resize_thumbs(img, sizes, keep_aspect_ratio=False)
+        self.assertEqual(sorted(resized.keys()), sorted(sizes))
+        for size, thumb in resized.iteritems():
+            self.assertEqual(thumb.size, size)
+
+    def test_cropping(self):
+        img = Image.new('RGB', (1280, 720))
+        resized = resize_thumbs(img, [(560, 315), (128, 128)],
+                                keep_aspect_ratio=False)
+        # The square thumb can't be scaled from the wide one
+        self.assertEqual(resized[(128, 128)].size, (128, 128))
+
+    def test_keep_aspect_ratio(self):
+        img = Image.new('RGB', (100, 50))
+        resized = resize_thumbs(img, [(200, 200)], keep_aspect_ratio=True)
+        self.assertEqual(resized[(200, 200)].size, (200, 100))
+
+class TestThumbStore(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_store_once(self):
+        name = store_thumb('image data', self.dir)
+        self.assertEqual(store_thumb('image data', self.dir), name)
+        self.assertNotEqual(store_thumb('other data', self.dir), name)
+        path = stored_thumb_path(name, self.dir)
+        self.assertEqual(open(path, 'rb').read(), 'image data')
+
+    def test_render(self):
+        path = os.path.join(self.dir, 'source.png')
+        Image.new('RGB', (640, 360)).save(path)
+        names = render_thumbs(path, {'s': (128, 72), 'l': (560, 315)},
+                              self.dir, keep_aspect_ratio=False)
+        self.assertEqual(sorted(names.keys()), ['l', 's'])
+        thumb = Image.open(stored_thumb_path(names['s'], self.dir))
+        self.assertEqual(thumb.size, (128, 72))
+        # The dimensions are in the name, for the thumbnail manifest
+        self.assert_(names['s'].endswith('_128x72.jpg'))
+
+class TestDefaultThumbs(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.image_dir = config['image_dir']
+        self.interval = thumbnails._default_check_interval
+        config['image_dir'] = self.dir
+        os.mkdir(os.path.join(self.dir, 'media'))
+        self._save_defaults('black')
+
+    def tearDown(self):
+        config['image_dir'] = self.image_dir
+        thumbnails._default_check_interval = self.interval
+        thumbnails._default_thumbs.pop((self.dir, 'media'), None)
+        shutil.rmtree(self.dir)
+
+    def _save_defaults(self, color):
+        for key, size in config['thumb_sizes']['media'].iteritems():
+            Image.new('RGB', tuple(size), color).save(
+                os.path.join(self.dir, 'media', 'new%s.jpg' % key))
+
+    def test_modified_defaults(self):
+        thumbnails._default_check_interval = 0
+        old = default_thumbs('media')
+        self.assertEqual(default_thumbs('media'), old)
+        self._save_defaults('white')
+        # Make sure the modification time changes, however coarse it is
+        for key in old:
+            path = os.path.join(self.dir, 'media', 'new%s.jpg' % key)
+            os.utime(path, (0, 0))
+        new = default_thumbs('media')
+        self.assertNotEqual(new['s'], old['s'])
+
+class NoStatPath(object):
+    """Stands in for os.path, failing on anything that looks at a file."""
+
+    def __init__(self, path):
+        self._path = path
+
+    def __getattr__(self, name):
+        if name in ('exists', 'isfile', 'isdir', 'getsize', 'getmtime'):
+            raise AssertionError('os.path.%s was called' % name)
+        return getattr(self._path, name)
+
+class NoStatOS(object):
+    """Stands in for os, failing on anything that looks at a file."""
+
+    def __init__(self, os):
+        self._os = os
+        self.path = NoStatPath(os.path)
+
+    def __getattr__(self, name):
+        if name in ('stat', 'lstat', 'listdir'):
+            raise AssertionError('os.%s was called' % name)
+        return getattr(self._os, name)
+
+class FakeItem(object):
+    _thumb_dir = 'media'
+
+    def __init__(self, id, thumbs):
+        self.id = id
+        self.thumbs = thumbs
+
+class TestThumbManifest(TestController):
+    """Uses TestController for the URL generator that thumb() needs."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self._config = dict((key, config.get(key, None))
+                            for key in ('image_dir', 'deleted_files_dir'))
+        config['image_dir'] = self.dir
+        config['deleted_files_dir'] = ''
+        for image_dir, sizes in config['thumb_sizes'].iteritems():
+            os.mkdir(os.path.join(self.dir, image_dir))
+            for key, size in sizes.iteritems():
+                Image.new('RGB', tuple(size)).save(
+                    os.path.join(self.dir, image_dir, 'new%s.jpg' % key))
+        # Thumbs named for an item's ID, from before the store existed
+        Image.new('RGB', (40, 30)).save(
+            os.path.join(self.dir, 'media', '5s.jpg'))
+        init_thumbs(config)
+
+    def tearDown(self):
+        thumbnails.os = os
+        config.update(self._config)
+        for key in self._config:
+            if config[key] is None:
+                del config[key]
+        thumbnails._default_thumbs.clear()
+        # Rebuilt for the real image_dir when it's next needed
+        thumbnails._manifest = None
+        shutil.rmtree(self.dir)
+
+    def test_exists_without_stat(self):
+        thumbnails.os = NoStatOS(os)
+        found = thumb(('media', 5), 's', exists=True)
+        self.assertEqual((found.x, found.y), (40, 30))
+        self.assertEqual(thumb(('media', 6), 's', exists=True), None)
+
+    def test_stored_by_another_process(self):
+        # Stored without this process registering it in its manifest
+        name = store_thumb('not really an image', thumb_store_dir(),
+                           dimensions=(48, 27))
+        self.assert_(name not in thumbnails._manifest)
+        thumbnails.os = NoStatOS(os)
+        found = thumb(FakeItem(7, {'s': name}), 's')
+        self.assertEqual((found.x, found.y), (48, 27))
+        self.assertEqual(thumbnails._manifest[name], (48, 27))
+
+    def test_delete_thumbs(self):
+        delete_thumbs(('media', 5))
+        self.assert_('media/5s.jpg' not in thumbnails._manifest)
+        self.assertEqual(thumb(('media', 5), 's', exists=True), None)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.dir, 'media', '5s.jpg')))
+
+    def test_remove_unused_thumbs(self):
+        used = store_thumb('used', thumb_store_dir(), dimensions=(1, 1))
+        unused = store_thumb('unused', thumb_store_dir(), dimensions=(1, 1))
+        recent = store_thumb('recent', thumb_store_dir(), dimensions=(1, 1))
+        for name in (used, unused, recent):
+            thumb(FakeItem(7, {'s': name}), 's')
+        # Only files older than the grace period are removed
+        for name in (used, unused):
+            os.utime(stored_thumb_path(name), (0, 0))
+        removed = remove_unused_thumbs([FakeItem(7, {'s': used})])
+        self.assertEqual(removed, 1)
+        self.assert_(unused not in thumbnails._manifest)
+        self.assertFalse(os.path.exists(stored_thumb_path(unused)))
+        self.assert_(used in thumbnails._manifest)
+        self.assert_(recent in thumbnails._manifest)
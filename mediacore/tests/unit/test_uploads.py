@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from StringIO import StringIO
+
+from mediacore.tests import *
+from mediacore.lib.compat import sha1
+from mediacore.lib.uploads import (ChunkError, append_chunk, begin_upload,
+    finish_upload, upload_offset)
+
+def _checksum(data):
+    return sha1(data).hexdigest()
+
+class TestChunkedUploads(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {'upload_spool_dir': self.dir, 'upload_chunk_size': '4'}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _append(self, upload_id, offset, data, checksum=None, max_size=None):
+        return append_chunk(upload_id, offset, StringIO(data),
+                            checksum or _checksum(data), self.config,
+                            max_size)
+
+    def test_assembly(self):
+        upload_id = begin_upload(self.config)
+        self.assertEqual(upload_offset(upload_id, self.config), 0)
+        self.assertEqual(self._append(upload_id, 0, 'abcd'), 4)
+        self.assertEqual(self._append(upload_id, 4, 'ef'), 6)
+        path = finish_upload(upload_id, 'movie.mp4', self.config)
+        self.assert_(path.endswith('.mp4'))
+        self.assertEqual(open(path, 'rb').read(), 'abcdef')
+
+    def test_resume(self):
+        upload_id = begin_upload(self.config)
+        self._append(upload_id, 0, 'abcd')
+        # The same chunk is sent again after a dropped response
+        try:
+            self._append(upload_id, 0, 'abcd')
+        except ChunkError, e:
+            self.assertEqual(e.offset, 4)
+        else:
+            self.fail('The chunk was appended twice.')
+        self.assertEqual(upload_offset(upload_id, self.config), 4)
+
+    def test_rejected_chunks(self):
+        upload_id = begin_upload(self.config)
+        self.assertRaises(ChunkError, self._append, upload_id, 0, 'abcd',
+                          _checksum('abce'))
+        self.assertRaises(ChunkError, self._append, upload_id, 0, 'abcde')
+        self._append(upload_id, 0, 'ab')
+        # Nothing may follow a short, final chunk
+        self.assertRaises(ChunkError, self._append, upload_id, 2, 'cd')
+        self.assertEqual(upload_offset(upload_id, self.config), 2)
+
+    def test_max_size(self):
+        upload_id = begin_upload(self.config)
+        self._append(upload_id, 0, 'abcd', max_size=6)
+        self.assertRaises(ChunkError, self._append, upload_id, 4, 'efgh',
+                          max_size=6)
+        self.assertEqual(self._append(upload_id, 4, 'ef', max_size=6), 6)
+
+    def test_stale_parts(self):
+        stale_id = begin_upload(self.config)
+        fresh_id = begin_upload(self.config)
+        stale_path = os.path.join(self.dir, 'chunks', stale_id + '.part')
+        os.utime(stale_path, (0, 0))
+        begin_upload(self.config)
+        self.assertRaises(ChunkError, upload_offset, stale_id, self.config)
+        self.assertEqual(upload_offset(fresh_id, self.config), 0)
+
+    def test_invalid_ids(self):
+        self.assertRaises(ChunkError, upload_offset, '../etc', self.config)
+        self.assertRaises(ChunkError, upload_offset, 'f' * 32, self.config)
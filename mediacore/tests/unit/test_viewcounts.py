@@ -0,0 +1,55 @@
+from mediacore.tests import *
+from mediacore.lib.viewcounts import BufferedViewCounter
+
+class RecordingViewCounter(BufferedViewCounter):
+    """A buffered counter that records its writes instead of running SQL."""
+
+    def __init__(self, *args, **kwargs):
+        BufferedViewCounter.__init__(self, *args, **kwargs)
+        self.writes = []
+        self.fail = False
+
+    def _ensure_thread(self):
+        pass
+
+    def _write(self, deltas):
+        if self.fail:
+            raise IOError('Database unavailable')
+        self.writes.append(dict(deltas))
+
+class TestBufferedViewCounter(TestCase):
+
+    def test_views_are_aggregated(self):
+        counter = RecordingViewCounter()
+        for media_id in (1, 2, 1, 1):
+            counter.increment(media_id)
+        self.assertEqual(counter.pending(1), 3)
+        self.assertEqual(counter.writes, [])
+        counter.flush()
+        self.assertEqual(counter.writes, [{1: 3, 2: 1}])
+        self.assertEqual(counter.pending(1), 0)
+
+    def test_failed_writes_are_retried(self):
+        counter = RecordingViewCounter()
+        counter.increment(1)
+        counter.fail = True
+        counter.flush()
+        counter.increment(1)
+        counter.fail = False
+        counter.flush()
+        self.assertEqual(counter.writes, [{1: 2}])
+
+    def test_overflow_flush(self):
+        counter = RecordingViewCounter(max_pending=2, overflow='flush')
+        for media_id in (1, 2, 3):
+            counter.increment(media_id)
+        self.assertEqual(counter.writes, [{1: 1, 2: 1}])
+        self.assertEqual(counter.pending(3), 1)
+
+    def test_overflow_drop(self):
+        counter = RecordingViewCounter(max_pending=2, overflow='drop')
+        for media_id in (1, 2, 3, 1):
+            counter.increment(media_id)
+        self.assertEqual(counter.pending(1), 2)
+        self.assertEqual(counter.pending(3), 0)
+        self.assertEqual(counter.dropped, 1)
@@ -46,11 +46,11 @@ def setup_app(command, conf, vars):
            ``python batch-scripts/upgrade/upgrade_from_v072.py deployment.ini``
            ``python batch-scripts/upgrade/upgrade_from_v080.py deployment.ini``
 
-    XXX: For search to work, we depend on a number of MySQL triggers which
-         copy the data from our InnoDB tables to a MyISAM table for its
-         fulltext indexing capability. Triggers can only be installed with
-         a mysql superuser like root, so you must run the setup_triggers.sql
-         script yourself.
+    XXX: If you are upgrading from a version which relied on the MySQL
+         triggers from setup_triggers.sql for search, drop them using
+         remove_triggers.sql. Then, whatever your database, rebuild the
+         search index:
+           ``python batch-scripts/search/rebuild_fulltext_index.py deployment.ini``
 
     """
     if pylons.test.pylonsapp:
@@ -0,0 +1,25 @@
+-- MediaCore used to depend on these triggers to copy searchable text into
+-- the media_fulltext table. The application now maintains that table
+-- itself, so if you installed the triggers from setup_triggers.sql in a
+-- previous version, remove them with:
+--
+--   mysql -u root mediacore < remove_triggers.sql
+--
+-- and then rebuild the search index:
+--
+--   python batch-scripts/search/rebuild_fulltext_index.py deployment.ini
+--
+-- XXX: If your config.ini file has a db_table_prefix set, the triggers were
+--      created with that prefix too: prepend it to the table names below.
+
+DROP TRIGGER IF EXISTS media_ai;
+DROP TRIGGER IF EXISTS media_au;
+DROP TRIGGER IF EXISTS media_ad;
+DROP TRIGGER IF EXISTS media_tags_ai;
+DROP TRIGGER IF EXISTS media_tags_ad;
+DROP TRIGGER IF EXISTS tags_au;
+DROP TRIGGER IF EXISTS tags_ad;
+DROP TRIGGER IF EXISTS media_categories_ai;
+DROP TRIGGER IF EXISTS media_categories_ad;
+DROP TRIGGER IF EXISTS categories_au;
+DROP TRIGGER IF EXISTS categories_ad;